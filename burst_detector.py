@@ -0,0 +1,194 @@
+"""Потоковое обнаружение всплесков: EWMA по каналам и count-min sketch по ключевым словам"""
+import math
+import hashlib
+from array import array
+from typing import Dict, Iterable, List, Optional
+
+
+class DecayingCounter:
+    """Счетчик с экспоненциальным затуханием: value/tau - сглаженная частота событий в секунду"""
+
+    __slots__ = ('tau', 'value', 'updated_at', 'started_at')
+
+    def __init__(self, half_life: float):
+        self.tau = half_life / math.log(2)
+        self.value = 0.0
+        self.updated_at: Optional[float] = None
+        self.started_at: Optional[float] = None
+
+    def _decay(self, ts: float):
+        if self.updated_at is None:
+            self.updated_at = self.started_at = ts
+        elif ts > self.updated_at:
+            self.value *= math.exp(-(ts - self.updated_at) / self.tau)
+            self.updated_at = ts
+
+    def add(self, ts: float, count: float = 1.0):
+        self._decay(ts)
+        self.value += count
+
+    def age(self, ts: float) -> float:
+        return 0.0 if self.started_at is None else ts - self.started_at
+
+    def rate_per_hour(self, ts: float, bias_correction: bool = False) -> float:
+        self._decay(ts)
+        rate = self.value / self.tau * 3600
+        # Пока истории мало, счетчик занижает темп - поправка как у EWMA с нулевым стартом
+        if bias_correction and self.age(ts) > 0:
+            rate /= 1 - math.exp(-self.age(ts) / self.tau)
+        return rate
+
+
+class DecayingCountMinSketch:
+    """Count-min sketch с экспоненциальным затуханием счетчиков и фиксированной памятью"""
+
+    def __init__(self, width: int = 2048, depth: int = 4, half_life: float = 1800.0):
+        self.width = width
+        self.depth = depth
+        self.tau = half_life / math.log(2)
+        self.values = array('d', bytes(8 * width * depth))
+        self.stamps = array('d', bytes(8 * width * depth))
+
+    def _cells(self, key: str) -> Iterable[int]:
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8 * self.depth).digest()
+        for row in range(self.depth):
+            column = int.from_bytes(digest[row * 8:(row + 1) * 8], 'little') % self.width
+            yield row * self.width + column
+
+    def _decayed(self, cell: int, ts: float) -> float:
+        elapsed = ts - self.stamps[cell]
+        if elapsed > 0:
+            self.values[cell] *= math.exp(-elapsed / self.tau)
+            self.stamps[cell] = ts
+        return self.values[cell]
+
+    def add(self, key: str, ts: float, count: float = 1.0) -> float:
+        """Увеличивает счетчик ключа и возвращает его оценку после увеличения"""
+        estimate = float('inf')
+        for cell in self._cells(key):
+            self.values[cell] = self._decayed(cell, ts) + count
+            estimate = min(estimate, self.values[cell])
+        return estimate
+
+    def estimate(self, key: str, ts: float) -> float:
+        return min(self._decayed(cell, ts) for cell in self._cells(key))
+
+
+class BurstEvent:
+    """Обнаруженный всплеск"""
+
+    def __init__(self, kind: str, key: str, value: float, baseline: float, channels: int = 0):
+        self.kind = kind  # 'channel' или 'keyword'
+        self.key = key
+        self.value = value
+        self.baseline = baseline
+        self.channels = channels
+
+    def __repr__(self):
+        return f"BurstEvent({self.kind}, {self.key}, {self.value:.1f}/{self.baseline:.1f})"
+
+
+class BurstDetector:
+    """Отслеживает темп публикаций каналов и распространение ключевых слов между каналами"""
+
+    def __init__(self, keywords: Iterable[str], fast_half_life: float = 900.0,
+                 slow_half_life: float = 6 * 3600.0, channel_ratio: float = 3.0,
+                 channel_min_rate: float = 12.0, keyword_min_channels: int = 3,
+                 keyword_min_rate: float = 6.0, cooldown: float = 1800.0,
+                 global_cooldown: float = 900.0, max_age: float = 3600.0,
+                 warmup: float = 3600.0):
+        self.keywords = tuple(keywords)
+        self.fast_half_life = fast_half_life
+        self.slow_half_life = slow_half_life
+        self.channel_ratio = channel_ratio
+        self.channel_min_rate = channel_min_rate
+        self.keyword_min_channels = keyword_min_channels
+        self.keyword_min_rate = keyword_min_rate
+        self.cooldown = cooldown
+        self.global_cooldown = global_cooldown
+        self.max_age = max_age
+        self.warmup = warmup
+
+        self.channel_fast: Dict[str, DecayingCounter] = {}
+        self.channel_slow: Dict[str, DecayingCounter] = {}
+        # Упоминания ключевого слова и число разных каналов, где оно недавно появилось
+        self.mentions = DecayingCountMinSketch(half_life=fast_half_life)
+        self.mentions_slow = DecayingCountMinSketch(half_life=slow_half_life)
+        self.pairs = DecayingCountMinSketch(width=8192, half_life=fast_half_life)
+        self.spread = DecayingCountMinSketch(half_life=fast_half_life)
+
+        self.started_at: Optional[float] = None
+        self.last_alert_at = 0.0
+        self.alerted: Dict[str, float] = {}
+
+    def _channel_counters(self, channel_id: str):
+        if channel_id not in self.channel_fast:
+            self.channel_fast[channel_id] = DecayingCounter(self.fast_half_life)
+            self.channel_slow[channel_id] = DecayingCounter(self.slow_half_life)
+        return self.channel_fast[channel_id], self.channel_slow[channel_id]
+
+    def observe(self, channel_id: str, text: str, ts: float, now: float) -> List[BurstEvent]:
+        """Учитывает новое сообщение и возвращает всплески-кандидаты (без учета cooldown)"""
+        if self.started_at is None:
+            self.started_at = now
+        # Старые посты (например, при первом сборе) в темп не входят
+        if now - ts > self.max_age:
+            return []
+        ts = min(ts, now)
+
+        events = []
+        fast, slow = self._channel_counters(channel_id)
+        # Базовый темп считаем до добавления сообщения, чтобы всплеск не поднимал свою же базу
+        baseline = slow.rate_per_hour(ts, bias_correction=True)
+        has_history = slow.age(ts) >= 2 * self.fast_half_life
+        fast.add(ts)
+        slow.add(ts)
+        fast_rate = fast.rate_per_hour(ts)
+        if (has_history and fast_rate >= self.channel_min_rate
+                and fast_rate >= self.channel_ratio * max(baseline, 1.0)):
+            events.append(BurstEvent('channel', channel_id, fast_rate, baseline))
+
+        text_lower = text.lower()
+        for keyword in self.keywords:
+            if keyword not in text_lower:
+                continue
+            mention_rate = self.mentions.add(keyword, ts) / self.mentions.tau * 3600
+            # Обычный темп слова (с поправкой на короткую историю) - чтобы "президент" не был вечным всплеском
+            baseline = self.mentions_slow.estimate(keyword, ts) / self.mentions_slow.tau * 3600
+            history = max(ts - self.started_at, self.fast_half_life)
+            baseline /= 1 - math.exp(-history / self.mentions_slow.tau)
+            self.mentions_slow.add(keyword, ts)
+            # Новый канал для этого слова - только если пара (слово, канал) недавно не встречалась
+            if self.pairs.add(f"{keyword}|{channel_id}", ts) < 1.5:
+                channels = self.spread.add(keyword, ts)
+            else:
+                channels = self.spread.estimate(keyword, ts)
+            if (channels >= self.keyword_min_channels and mention_rate >= self.keyword_min_rate
+                    and mention_rate >= self.channel_ratio * max(baseline, 1.0)):
+                events.append(BurstEvent('keyword', keyword, mention_rate, baseline, channels=int(round(channels))))
+        return events
+
+    def filter_alerts(self, events: List[BurstEvent], now: float) -> List[BurstEvent]:
+        """Отбирает события, по которым можно слать алерт с учетом прогрева и cooldown"""
+        if self.started_at is None or now - self.started_at < self.warmup:
+            return []
+        if now - self.last_alert_at < self.global_cooldown:
+            return []
+
+        # Забываем истекшие cooldown, чтобы словарь не рос
+        self.alerted = {key: ts for key, ts in self.alerted.items() if now - ts < self.cooldown}
+
+        selected = {}
+        for event in events:
+            key = f"{event.kind}:{event.key}"
+            if key in self.alerted:
+                continue
+            if key not in selected or event.value > selected[key].value:
+                selected[key] = event
+        if not selected:
+            return []
+
+        for key in selected:
+            self.alerted[key] = now
+        self.last_alert_at = now
+        return sorted(selected.values(), key=lambda e: e.value, reverse=True)
@@ -0,0 +1,144 @@
+"""Постраничное меню управления каналами с компактными callback data.
+
+Telegram ограничивает callback data 64 байтами и не показывает клавиатуры на тысячи
+кнопок, поэтому меню выводит страницу из PAGE_SIZE каналов (с фильтром по подстроке
+названия или username), а кнопки кодируют действие коротко: 'c<действие>:<страница>[:<канал>]',
+например 'ct:3:meduza' - переключить канал meduza и показать страницу 3. Длинные id
+каналов заменяются коротким хешем. Каждое действие меню - одна правка сообщения.
+"""
+import hashlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+PAGE_SIZE = 10
+CALLBACK_PREFIX = 'c'
+MAX_TOKEN_BYTES = 40  # id длиннее заменяется хешем, чтобы callback data уложились в 64 байта
+
+# Действия меню
+TOGGLE = 't'  # переключить канал
+PAGE = 'p'  # показать страницу
+PAGE_ON = 'on'  # включить все каналы страницы
+PAGE_OFF = 'off'  # выключить все каналы страницы
+FOUND_ON = 'ON'  # включить все каналы под фильтром (без фильтра - все)
+FOUND_OFF = 'OFF'
+SEARCH = 's'  # попросить строку поиска
+CLEAR = 'x'  # сбросить поиск
+ACTIONS = {TOGGLE, PAGE, PAGE_ON, PAGE_OFF, FOUND_ON, FOUND_OFF, SEARCH, CLEAR}
+
+# Кнопки сообщений, отправленных до постраничного меню
+LEGACY_CALLBACKS = {'refresh_channels': PAGE, 'select_all_channels': FOUND_ON, 'deselect_all_channels': FOUND_OFF}
+LEGACY_TOGGLE_PREFIX = 'toggle_channel:'
+
+
+def channel_token(channel_id: str) -> str:
+    if len(channel_id.encode('utf-8')) <= MAX_TOKEN_BYTES and ':' not in channel_id and not channel_id.startswith('#'):
+        return channel_id
+    return '#' + hashlib.blake2b(channel_id.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def resolve_channel(token: str, channels: Dict[str, dict]) -> Optional[str]:
+    """id канала по токену из callback data (None - канал уже удален)"""
+    if not token.startswith('#'):
+        return token if token in channels else None
+    for channel_id in channels:
+        if channel_token(channel_id) == token:
+            return channel_id
+    return None
+
+
+def encode_callback(action: str, page: int = 0, channel_id: Optional[str] = None) -> str:
+    data = f"{CALLBACK_PREFIX}{action}:{page}"
+    if channel_id is not None:
+        data += f":{channel_token(channel_id)}"
+    return data
+
+
+def decode_callback(data: str) -> Optional[Tuple[str, int, Optional[str]]]:
+    """(действие, страница, токен канала) или None, если это не кнопка меню каналов"""
+    if data in LEGACY_CALLBACKS:
+        return LEGACY_CALLBACKS[data], 0, None
+    if data.startswith(LEGACY_TOGGLE_PREFIX):
+        return TOGGLE, 0, data[len(LEGACY_TOGGLE_PREFIX):]
+    if not data.startswith(CALLBACK_PREFIX):
+        return None
+    parts = data[len(CALLBACK_PREFIX):].split(':', 2)
+    if len(parts) < 2 or parts[0] not in ACTIONS or not parts[1].isdigit():
+        return None
+    return parts[0], int(parts[1]), parts[2] if len(parts) == 3 else None
+
+
+def filter_channels(channels: Dict[str, dict], query: str = '') -> List[str]:
+    """id каналов, в названии, username или id которых есть query, в порядке хранилища"""
+    query = query.strip().lower().lstrip('@')
+    if not query:
+        return list(channels)
+    return [channel_id for channel_id, info in channels.items()
+            if query in info.get('title', '').lower() or query in (info.get('username') or '').lower()
+            or query in channel_id.lower()]
+
+
+def page_bounds(total: int, page: int, page_size: int = PAGE_SIZE) -> Tuple[int, int, int]:
+    """(страница в допустимых пределах, число страниц, индекс первого канала страницы)"""
+    pages = max(1, -(-total // page_size))
+    page = min(max(page, 0), pages - 1)
+    return page, pages, page * page_size
+
+
+def page_channels(channel_ids: List[str], page: int, page_size: int = PAGE_SIZE) -> List[str]:
+    page, _, start = page_bounds(len(channel_ids), page, page_size)
+    return channel_ids[start:start + page_size]
+
+
+def render_menu(channels: Dict[str, dict], monitored: Iterable[str], query: str = '', page: int = 0,
+                notice: str = '', page_size: int = PAGE_SIZE) -> Tuple[str, InlineKeyboardMarkup]:
+    """Текст и клавиатура одной страницы меню"""
+    monitored = set(monitored)
+    found = filter_channels(channels, query)
+    page, pages, start = page_bounds(len(found), page, page_size)
+    shown = found[start:start + page_size]
+
+    text = ""
+    if notice:
+        text += f"{notice}\n\n"
+    text += "📋 Управление каналами для анализа\n\n"
+    text += f"Отслеживается: {len(monitored & set(channels))} из {len(channels)} каналов\n"
+    if query:
+        text += f"🔍 Поиск «{query}»: найдено {len(found)}\n"
+    if found:
+        text += f"Страница {page + 1} из {pages}\n\n"
+        text += "Нажмите на канал, чтобы включить/выключить его анализ:"
+    else:
+        text += "\nНичего не найдено"
+
+    keyboard = []
+    for channel_id in shown:
+        status_emoji = "✅" if channel_id in monitored else "❌"
+        title = channels[channel_id].get('title', channel_id)
+        keyboard.append([InlineKeyboardButton(f"{status_emoji} {title}",
+                                              callback_data=encode_callback(TOGGLE, page, channel_id))])
+
+    if pages > 1:
+        keyboard.append([
+            InlineKeyboardButton("◀️", callback_data=encode_callback(PAGE, (page - 1) % pages)),
+            InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=encode_callback(PAGE, page)),
+            InlineKeyboardButton("▶️", callback_data=encode_callback(PAGE, (page + 1) % pages)),
+        ])
+    if shown:
+        keyboard.append([
+            InlineKeyboardButton("✅ Вся страница", callback_data=encode_callback(PAGE_ON, page)),
+            InlineKeyboardButton("❌ Вся страница", callback_data=encode_callback(PAGE_OFF, page)),
+        ])
+    scope = f" найденные ({len(found)})" if query else " все"
+    keyboard.append([
+        InlineKeyboardButton(f"✅{scope}", callback_data=encode_callback(FOUND_ON, page)),
+        InlineKeyboardButton(f"❌{scope}", callback_data=encode_callback(FOUND_OFF, page)),
+    ])
+    if query:
+        keyboard.append([InlineKeyboardButton("✖️ Сбросить поиск", callback_data=encode_callback(CLEAR))])
+    else:
+        keyboard.append([
+            InlineKeyboardButton("🔍 Поиск", callback_data=encode_callback(SEARCH, page)),
+            InlineKeyboardButton("🔄 Обновить", callback_data=encode_callback(PAGE, page)),
+        ])
+    return text, InlineKeyboardMarkup(keyboard)
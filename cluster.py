@@ -0,0 +1,387 @@
+"""Горизонтальное масштабирование сбора: несколько процессов делят каналы через аренды в общей SQLite.
+
+Каналы раскладываются по CLUSTER_SHARDS шардам стабильным хешем. Каждый узел
+раз в lease_seconds / 3 отмечается в таблице workers, продлевает аренды своих шардов
+и забирает свободные (истекшие) до своей доли ceil(шардов / живых узлов); лишние
+отпускает, чтобы новый узел получил работу. Если узел умер, его аренды истекают и
+шарды достаются остальным. Результаты сбора пишутся в channel_messages с растущим
+номером версии, запись принимается, только пока узел держит аренду шарда.
+
+Одну аренду 'leader' держит лидер: только он запускает бота, расписание дайджестов
+и доставку, остальные узлы лишь собирают. Лидер публикует список каналов и может
+попросить внеочередной сбор (номер запроса в settings), дожидаясь, пока все живые
+узлы его отработают.
+"""
+import os
+import json
+import math
+import time
+import socket
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from metrics import registry as metrics_registry
+
+logger = logging.getLogger(__name__)
+
+LEADER_LEASE = 'leader'
+SHARD_LEASE_PREFIX = 'shard:'
+
+CLUSTER_SHARDS_OWNED = metrics_registry.gauge('digest_bot_cluster_shards_owned', 'Шарды каналов, арендованные узлом')
+CLUSTER_IS_LEADER = metrics_registry.gauge('digest_bot_cluster_leader', 'Узел - лидер кластера (1) или нет (0)')
+CLUSTER_REJECTED_WRITES = metrics_registry.counter(
+    'digest_bot_cluster_rejected_writes_total', 'Результаты сбора, отброшенные после потери аренды шарда')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    epoch INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    heartbeat_at REAL NOT NULL,
+    handled_request INTEGER NOT NULL DEFAULT 0,
+    info TEXT
+);
+CREATE TABLE IF NOT EXISTS channels (
+    channel_id TEXT PRIMARY KEY,
+    username TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS channel_messages (
+    channel_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    worker_id TEXT NOT NULL,
+    collected_at REAL NOT NULL,
+    messages TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS channel_messages_version ON channel_messages(version);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def channel_shard(channel_id: str, shards: int) -> int:
+    """Шард канала: одинаковый на всех узлах и при любом числе узлов"""
+    return int.from_bytes(hashlib.blake2b(channel_id.encode('utf-8'), digest_size=8).digest(), 'little') % shards
+
+
+def shard_preference(worker_id: str, shard: int) -> int:
+    """Вес для rendezvous-хеширования: каждый узел предпочитает свои шарды, меньше перетасовок"""
+    return int.from_bytes(hashlib.blake2b(f'{worker_id}:{shard}'.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def default_worker_id() -> str:
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+class ClusterStore:
+    """Общая база кластера: аренды, живые узлы, каналы и результаты сбора.
+    Каждый поток работает через свое соединение (sqlite3 их не разделяет)."""
+
+    def __init__(self, path: str, busy_timeout: float = 30):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        connection.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        """Пишущая транзакция: BEGIN IMMEDIATE сразу берет блокировку записи"""
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    # --- аренды ---
+
+    @staticmethod
+    def _acquire(connection, name: str, owner: str, now: float, ttl: float) -> bool:
+        connection.execute('INSERT OR IGNORE INTO leases (name, owner, expires_at) VALUES (?, ?, 0)', (name, owner))
+        cursor = connection.execute(
+            'UPDATE leases SET epoch = epoch + (owner != ?), owner = ?, expires_at = ? '
+            'WHERE name = ? AND (owner = ? OR expires_at < ?)',
+            (owner, owner, now + ttl, name, owner, now),
+        )
+        return cursor.rowcount == 1
+
+    def acquire_lease(self, name: str, owner: str, ttl: float, now: Optional[float] = None) -> bool:
+        """Берет или продлевает аренду; False - она у другого владельца и еще не истекла"""
+        now = now if now is not None else time.time()
+        with self._transaction() as connection:
+            return self._acquire(connection, name, owner, now, ttl)
+
+    def release_lease(self, name: str, owner: str):
+        with self._transaction() as connection:
+            connection.execute('UPDATE leases SET expires_at = 0 WHERE name = ? AND owner = ?', (name, owner))
+
+    def lease_owner(self, name: str, now: Optional[float] = None) -> Optional[str]:
+        now = now if now is not None else time.time()
+        row = self._connection().execute(
+            'SELECT owner FROM leases WHERE name = ? AND expires_at >= ?', (name, now)).fetchone()
+        return row[0] if row else None
+
+    def rebalance_shards(self, worker_id: str, shards: int, ttl: float, info: str = '',
+                         now: Optional[float] = None) -> Set[int]:
+        """Отмечает узел живым, продлевает его шарды и выравнивает их число по живым узлам"""
+        now = now if now is not None else time.time()
+        with self._transaction() as connection:
+            connection.execute(
+                'INSERT INTO workers (worker_id, heartbeat_at, info) VALUES (?, ?, ?) '
+                'ON CONFLICT(worker_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at, info = excluded.info',
+                (worker_id, now, info),
+            )
+            # Давно молчащие узлы убираем из таблицы, их аренды к этому времени истекли
+            connection.execute('DELETE FROM workers WHERE heartbeat_at < ?', (now - ttl * 10,))
+            live = connection.execute('SELECT COUNT(*) FROM workers WHERE heartbeat_at >= ?', (now - ttl,)).fetchone()[0]
+            target = math.ceil(shards / max(1, live))
+
+            leases = {
+                int(name[len(SHARD_LEASE_PREFIX):]): (owner, expires_at)
+                for name, owner, expires_at in connection.execute(
+                    'SELECT name, owner, expires_at FROM leases WHERE name LIKE ?', (SHARD_LEASE_PREFIX + '%',))
+                if int(name[len(SHARD_LEASE_PREFIX):]) < shards
+            }
+            mine = sorted((shard for shard, (owner, expires_at) in leases.items()
+                           if owner == worker_id and expires_at >= now),
+                          key=lambda shard: shard_preference(worker_id, shard), reverse=True)
+            # Лишние шарды отпускаем, начиная с наименее предпочтительных
+            for shard in mine[target:]:
+                connection.execute('UPDATE leases SET expires_at = 0 WHERE name = ? AND owner = ?',
+                                   (f'{SHARD_LEASE_PREFIX}{shard}', worker_id))
+            owned = set(mine[:target])
+            free = sorted((shard for shard in range(shards)
+                           if shard not in leases or leases[shard][1] < now),
+                          key=lambda shard: shard_preference(worker_id, shard), reverse=True)
+            for shard in free[:max(0, target - len(owned))]:
+                owned.add(shard)
+            for shard in owned:
+                self._acquire(connection, f'{SHARD_LEASE_PREFIX}{shard}', worker_id, now, ttl)
+        return owned
+
+    def live_workers(self, ttl: float, now: Optional[float] = None) -> List[dict]:
+        now = now if now is not None else time.time()
+        rows = self._connection().execute(
+            'SELECT worker_id, heartbeat_at, handled_request, info FROM workers WHERE heartbeat_at >= ? '
+            'ORDER BY worker_id', (now - ttl,)).fetchall()
+        return [{'worker_id': row[0], 'heartbeat_at': row[1], 'handled_request': row[2], 'info': row[3]}
+                for row in rows]
+
+    def shard_owners(self, shards: int, now: Optional[float] = None) -> Dict[int, str]:
+        now = now if now is not None else time.time()
+        rows = self._connection().execute(
+            'SELECT name, owner FROM leases WHERE name LIKE ? AND expires_at >= ?',
+            (SHARD_LEASE_PREFIX + '%', now)).fetchall()
+        owners = {int(name[len(SHARD_LEASE_PREFIX):]): owner for name, owner in rows}
+        return {shard: owner for shard, owner in owners.items() if shard < shards}
+
+    # --- каналы и результаты сбора ---
+
+    def publish_channels(self, channels: Iterable[Tuple[str, str]]):
+        """Лидер заменяет список каналов для сбора парами (channel_id, username)"""
+        channels = list(channels)
+        with self._transaction() as connection:
+            connection.execute('DELETE FROM channels')
+            connection.executemany('INSERT OR REPLACE INTO channels (channel_id, username) VALUES (?, ?)', channels)
+
+    def channels(self) -> List[Tuple[str, str]]:
+        return self._connection().execute('SELECT channel_id, username FROM channels ORDER BY channel_id').fetchall()
+
+    def save_messages(self, worker_id: str, shards: int, channel_id: str, messages: List[dict],
+                      now: Optional[float] = None) -> bool:
+        """Записывает сообщения канала, если узел все еще держит аренду его шарда"""
+        now = now if now is not None else time.time()
+        payload = json.dumps(messages, ensure_ascii=False)
+        with self._transaction() as connection:
+            lease = connection.execute(
+                'SELECT 1 FROM leases WHERE name = ? AND owner = ? AND expires_at >= ?',
+                (f'{SHARD_LEASE_PREFIX}{channel_shard(channel_id, shards)}', worker_id, now)).fetchone()
+            if lease is None:
+                CLUSTER_REJECTED_WRITES.inc()
+                return False
+            version = connection.execute('SELECT COALESCE(MAX(version), 0) + 1 FROM channel_messages').fetchone()[0]
+            connection.execute(
+                'INSERT OR REPLACE INTO channel_messages (channel_id, version, worker_id, collected_at, messages) '
+                'VALUES (?, ?, ?, ?, ?)', (channel_id, version, worker_id, now, payload))
+        return True
+
+    def load_messages(self, since_version: int = 0) -> List[Tuple[str, int, float, List[dict]]]:
+        """Каналы, обновленные после since_version: (channel_id, версия, время сбора, сообщения)"""
+        rows = self._connection().execute(
+            'SELECT channel_id, version, collected_at, messages FROM channel_messages WHERE version > ? '
+            'ORDER BY version', (since_version,)).fetchall()
+        return [(channel_id, version, collected_at, json.loads(messages))
+                for channel_id, version, collected_at, messages in rows]
+
+    # --- внеочередной сбор ---
+
+    def request_collection(self) -> int:
+        """Лидер просит все узлы собрать свои шарды; возвращает номер запроса"""
+        with self._transaction() as connection:
+            row = connection.execute("SELECT value FROM settings WHERE key = 'collect_request'").fetchone()
+            request = int(row[0]) + 1 if row else 1
+            connection.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('collect_request', ?)",
+                               (str(request),))
+        return request
+
+    def collection_request(self) -> int:
+        row = self._connection().execute("SELECT value FROM settings WHERE key = 'collect_request'").fetchone()
+        return int(row[0]) if row else 0
+
+    def mark_handled(self, worker_id: str, request: int):
+        with self._transaction() as connection:
+            connection.execute('UPDATE workers SET handled_request = MAX(handled_request, ?) WHERE worker_id = ?',
+                               (request, worker_id))
+
+
+class ClusterNode:
+    """Узел кластера: поток аренд (узел, шарды, лидерство) и поток сбора своих шардов.
+
+    collect(channels) - блокирующая функция, которая собирает пары (channel_id, username)
+    и сохраняет их через save(channel_id, messages). on_leader_lost вызывается, если
+    лидер не смог продлить аренду: дальше он не должен ничего отправлять.
+    """
+
+    def __init__(self, store: ClusterStore, worker_id: Optional[str] = None, shards: int = 64,
+                 lease_seconds: float = 30, collect_interval: float = 300,
+                 collect: Optional[Callable[[List[Tuple[str, str]]], None]] = None,
+                 on_leader_lost: Optional[Callable[[], None]] = None):
+        self.store = store
+        self.worker_id = worker_id or default_worker_id()
+        self.shards = shards
+        self.lease_seconds = lease_seconds
+        self.collect_interval = collect_interval
+        self.collect = collect
+        self.on_leader_lost = on_leader_lost
+        self.owned: Set[int] = set()
+        self.leader_until = 0.0
+        self.became_leader = threading.Event()
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+        self.last_round = 0.0
+        self.handled_request = 0  # последний отработанный запрос внеочередного сбора
+        self.stats = {'rounds': 0, 'channels': 0, 'rejected': 0}
+
+    def start(self):
+        threading.Thread(target=self._lease_loop, name='cluster-leases', daemon=True).start()
+        threading.Thread(target=self._collect_loop, name='cluster-collect', daemon=True).start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.wake_event.set()
+        try:
+            if self.is_leader():
+                self.store.release_lease(LEADER_LEASE, self.worker_id)
+            for shard in self.owned:
+                self.store.release_lease(f'{SHARD_LEASE_PREFIX}{shard}', self.worker_id)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка освобождения аренд узла {self.worker_id}: {e}")
+
+    def is_leader(self, now: Optional[float] = None) -> bool:
+        return (now if now is not None else time.time()) < self.leader_until
+
+    def owns_channel(self, channel_id: str) -> bool:
+        return channel_shard(channel_id, self.shards) in self.owned
+
+    def _lease_loop(self):
+        while not self.stop_event.is_set():
+            self.renew_leases(time.time())
+            self.stop_event.wait(self.lease_seconds / 3)
+
+    def renew_leases(self, now: float):
+        """Один шаг потока аренд: пульс узла, перераспределение шардов и продление лидерства"""
+        try:
+            owned = self.store.rebalance_shards(self.worker_id, self.shards, self.lease_seconds,
+                                                info=socket.gethostname(), now=now)
+            if owned != self.owned:
+                logger.info(f"Узел {self.worker_id}: шардов {len(owned)} из {self.shards}")
+                if owned - self.owned:
+                    self.wake_event.set()  # новые шарды собираем сразу
+            self.owned = owned
+            CLUSTER_SHARDS_OWNED.set(len(owned))
+
+            was_leader = self.is_leader(now)
+            if self.store.acquire_lease(LEADER_LEASE, self.worker_id, self.lease_seconds, now=now):
+                self.leader_until = now + self.lease_seconds
+                if not was_leader:
+                    logger.info(f"Узел {self.worker_id} стал лидером кластера")
+                self.became_leader.set()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка продления аренд узла {self.worker_id}: {e}")
+
+        if self.became_leader.is_set() and not self.is_leader(now):
+            logger.error(f"Узел {self.worker_id} потерял лидерство")
+            self.became_leader.clear()
+            if self.on_leader_lost:
+                self.on_leader_lost()
+        CLUSTER_IS_LEADER.set(1 if self.is_leader(now) else 0)
+
+    def _collect_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                request = self.store.collection_request()
+                due = time.time() - self.last_round >= self.collect_interval
+                if self.owned and (due or request > self.handled_request):
+                    self._round(request)
+                elif request > self.handled_request and not self.owned:
+                    # Без шардов собирать нечего, но лидер не должен нас ждать
+                    self.store.mark_handled(self.worker_id, request)
+                    self.handled_request = request
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка сбора узла {self.worker_id}: {e}")
+            self.wake_event.wait(1)
+            self.wake_event.clear()
+
+    def _round(self, request: int):
+        channels = [(channel_id, username) for channel_id, username in self.store.channels()
+                    if self.owns_channel(channel_id)]
+        started = time.time()
+        if channels and self.collect:
+            self.collect(channels)
+        self.last_round = started
+        self.stats['rounds'] += 1
+        self.stats['channels'] = len(channels)
+        self.store.mark_handled(self.worker_id, request)
+        self.handled_request = request
+
+    def save(self, channel_id: str, messages: List[dict]) -> bool:
+        """Сохраняет результат сбора канала; False - шард уже у другого узла"""
+        saved = self.store.save_messages(self.worker_id, self.shards, channel_id, messages)
+        if not saved:
+            self.stats['rejected'] += 1
+        return saved
+
+    def wait_for_collection(self, request: int, timeout: float) -> bool:
+        """Ждет, пока все живые узлы отработают запрос и все шарды будут разобраны"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            workers = self.store.live_workers(self.lease_seconds)
+            owners = self.store.shard_owners(self.shards)
+            if len(owners) == self.shards and all(worker['handled_request'] >= request for worker in workers):
+                return True
+            time.sleep(0.2)
+        return False
@@ -0,0 +1,333 @@
+"""Сбор сообщений каналов потоковым конвейером: загрузка -> разбор -> признаки -> запись"""
+import re
+import html
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from digest_engine import clean_story_text
+from entities import extract_entities
+from metrics import BYTES_BUCKETS, COUNT_BUCKETS, registry
+import tracing
+from text_analysis import calculate_resonance_score, classify_message, find_countries, find_trend_keywords
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WEB_BASE_URL = 'https://t.me'
+MAX_MESSAGES_PER_PAGE = 15
+FALLBACK_TIMEZONE = timezone(timedelta(hours=1))
+
+REQUEST_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'ru-RU,ru;q=0.8,en-US;q=0.5,en;q=0.3',
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+}
+
+# Паттерны сообщений в порядке от точного к общему
+MESSAGE_PATTERNS = (
+    re.compile(r'<div class="tgme_widget_message_text js-message_text" dir="auto">(.*?)</div>', re.DOTALL),
+    re.compile(r'<div class="tgme_widget_message_text[^"]*">(.*?)</div>', re.DOTALL),
+    re.compile(r'<div[^>]*class="[^"]*message_text[^"]*"[^>]*>(.*?)</div>', re.DOTALL),
+)
+TIME_PATTERN = re.compile(r'<time datetime="([^"]+)"')
+TAG_PATTERN = re.compile(r'<[^>]+>')
+SPACE_PATTERN = re.compile(r'\s+')
+HTML_ENTITIES = (('&nbsp;', ' '), ('&amp;', '&'), ('&lt;', '<'), ('&gt;', '>'), ('&quot;', '"'), ('&#39;', "'"))
+
+# Шапка канала на t.me/s/<username>: есть только у публичных каналов с веб-превью
+CHANNEL_INFO_MARK = 'tgme_channel_info'
+CHANNEL_TITLE_PATTERN = re.compile(r'<div class="tgme_channel_info_header_title"[^>]*>(.*?)</div>', re.DOTALL)
+CHANNEL_USERNAME_PATTERN = re.compile(r'<div class="tgme_channel_info_header_username"[^>]*>.*?@([A-Za-z0-9_]+)', re.DOTALL)
+CHANNEL_PHOTO_PATTERN = re.compile(r'<i class="tgme_page_photo_image[^"]*"[^>]*>\s*<img src="([^"]+)"')
+SUBSCRIBERS_PATTERN = re.compile(
+    r'<span class="counter_value">([^<]+)</span>\s*<span class="counter_type">subscribers?</span>')
+OG_PATTERN = re.compile(r'<meta property="og:(title|image)" content="([^"]*)"')
+COUNTER_MULTIPLIERS = {'K': 1_000, 'M': 1_000_000, 'B': 1_000_000_000}
+
+# Username канала: @name, name, t.me/name, https://t.me/s/name/123, tg://resolve?domain=name
+CHANNEL_REF_PATTERN = re.compile(
+    r'^(?:@|(?:https?://)?(?:www\.)?(?:t\.me|telegram\.me|telegram\.dog)/(?:s/)?|tg://resolve\?domain=)?'
+    r'([A-Za-z][A-Za-z0-9_]{3,31})(?:[/?#].*)?$'
+)
+
+SCRAPE_SECONDS = registry.histogram('digest_bot_scrape_seconds', 'Время загрузки страницы канала', ['channel'])
+SCRAPE_BYTES = registry.histogram('digest_bot_scrape_bytes', 'Размер загруженной страницы канала', ['channel'],
+                                  buckets=BYTES_BUCKETS)
+POSTS_PARSED = registry.histogram('digest_bot_posts_parsed', 'Сообщений, извлеченных из страницы канала', ['channel'],
+                                  buckets=COUNT_BUCKETS)
+SCRAPE_FAILURES = registry.counter('digest_bot_scrape_failures_total', 'Ошибки сбора по каналам и стадиям',
+                                   ['channel', 'stage'])
+STAGE_SECONDS = registry.histogram('digest_bot_collect_stage_seconds', 'Время стадий конвейера сбора', ['stage'])
+
+
+def fetch_channel_page(channel_username: str, base_url: str = DEFAULT_WEB_BASE_URL, timeout: float = 15) -> str:
+    """Загружает HTML веб-версии канала (блокирующий вызов, запускается в потоке)"""
+    import requests  # импорт с certifi и urllib3 не нужен боту до первого сбора
+    web_url = f"{base_url.rstrip('/')}/s/{channel_username}"
+    logger.info(f"Пытаюсь получить сообщения из: {web_url}")
+    response = requests.get(web_url, headers=REQUEST_HEADERS, timeout=timeout)
+    response.raise_for_status()
+    html_content = response.text
+    logger.info(f"Получен HTML размером {len(html_content)} символов")
+    return html_content
+
+
+def clean_message_html(message_html: str) -> str:
+    """Убирает HTML-теги и сущности из текста сообщения"""
+    clean_text = TAG_PATTERN.sub('', message_html)
+    for entity, char in HTML_ENTITIES:
+        clean_text = clean_text.replace(entity, char)
+    return SPACE_PATTERN.sub(' ', clean_text).strip()
+
+
+def parse_channel_page(html_content: str, channel_username: str) -> List[dict]:
+    """Извлекает сообщения из HTML веб-версии канала"""
+    message_matches = []
+    for pattern in MESSAGE_PATTERNS:
+        message_matches = pattern.findall(html_content)
+        if message_matches:
+            break
+    time_matches = TIME_PATTERN.findall(html_content)
+    logger.info(f"Найдено {len(message_matches)} сообщений и {len(time_matches)} временных меток")
+
+    messages = []
+    for i, message_html in enumerate(message_matches[:MAX_MESSAGES_PER_PAGE]):
+        message_time = time_matches[i] if i < len(time_matches) else datetime.now(FALLBACK_TIMEZONE).strftime('%Y-%m-%dT%H:%M:%S')
+        clean_text = clean_message_html(message_html)
+        if clean_text and len(clean_text) > 10:  # Минимальная длина сообщения
+            messages.append({
+                'text': clean_text,
+                'from_user': 'Channel',
+                'timestamp': message_time,
+                'message_id': i + 1,
+            })
+
+    logger.info(f"Собрано {len(messages)} сообщений из канала {channel_username}")
+    if not messages:
+        logger.warning(f"Не удалось найти сообщения в канале {channel_username}")
+    return messages
+
+
+def normalize_channel_ref(ref: str) -> Optional[str]:
+    """Username из ссылки или упоминания канала; None - это не похоже на публичный канал"""
+    match = CHANNEL_REF_PATTERN.match(ref.strip().strip(',;'))
+    if not match or match.group(1).lower() in ('joinchat', 'addstickers', 'share', 'proxy'):
+        return None
+    return match.group(1)
+
+
+def parse_counter(value: str) -> Optional[int]:
+    """Счетчик с t.me ('1.2M', '12.5K', '3 456') в число"""
+    value = value.replace(' ', '').replace('\xa0', '').upper()
+    multiplier = COUNTER_MULTIPLIERS.get(value[-1:], 1)
+    if multiplier > 1:
+        value = value[:-1]
+    try:
+        return int(float(value) * multiplier)
+    except ValueError:
+        return None
+
+
+def parse_channel_info(html_content: str, channel_username: str) -> Optional[dict]:
+    """Название, аватар и число подписчиков из шапки страницы канала.
+    None - шапки нет: канала не существует, он приватный или это не канал (t.me/s/ уводит на профиль)"""
+    if CHANNEL_INFO_MARK not in html_content:
+        return None
+    og = dict(OG_PATTERN.findall(html_content))
+    title_match = CHANNEL_TITLE_PATTERN.search(html_content)
+    title = clean_message_html(title_match.group(1)) if title_match else html.unescape(og.get('title', ''))
+    username_match = CHANNEL_USERNAME_PATTERN.search(html_content)
+    photo_match = CHANNEL_PHOTO_PATTERN.search(html_content)
+    subscribers_match = SUBSCRIBERS_PATTERN.search(html_content)
+    return {
+        'title': title or f"@{channel_username}",
+        'username': username_match.group(1) if username_match else channel_username,
+        'photo_url': html.unescape(photo_match.group(1) if photo_match else og.get('image', '')) or None,
+        'subscribers': parse_counter(subscribers_match.group(1)) if subscribers_match else None,
+    }
+
+
+async def validate_channels(usernames: Iterable[str], base_url: str = DEFAULT_WEB_BASE_URL,
+                            concurrency: int = 8, timeout: float = 15) -> dict:
+    """Проверяет каналы по их веб-версии, не больше concurrency загрузок одновременно.
+
+    Одна загрузка t.me/s/<username> на канал и подтверждает, что он существует, и дает
+    его метаданные. Возвращает {'valid': {username: info}, 'failed': {username: причина},
+    'wall_time'} - порядок каналов в обоих словарях как во входном списке.
+    """
+    usernames = list(usernames)
+    semaphore = asyncio.Semaphore(concurrency)
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='validate')
+    loop = asyncio.get_running_loop()
+    results: Dict[str, Tuple[Optional[dict], str]] = {}
+    started = time.perf_counter()
+
+    async def check(username: str):
+        async with semaphore:
+            try:
+                html_content = await loop.run_in_executor(executor, fetch_channel_page, username, base_url, timeout)
+            except Exception as e:
+                logger.warning(f"Канал {username} не прошел проверку: {e}")
+                SCRAPE_FAILURES.inc(channel=username, stage='validate')
+                status = getattr(getattr(e, 'response', None), 'status_code', None)
+                results[username] = (None, f"HTTP {status}" if status else "страница недоступна")
+                return
+        info = parse_channel_info(html_content, username)
+        results[username] = (info, '' if info else "не найден или нет веб-версии")
+
+    try:
+        await asyncio.gather(*(check(username) for username in usernames))
+    finally:
+        executor.shutdown(wait=False)
+
+    valid = {username: results[username][0] for username in usernames if results[username][0]}
+    failed = {username: results[username][1] for username in usernames if not results[username][0]}
+    wall_time = time.perf_counter() - started
+    STAGE_SECONDS.observe(wall_time, stage='validate')
+    logger.info(f"Проверка каналов: {len(valid)}/{len(usernames)} найдено за {wall_time:.2f} с")
+    return {'valid': valid, 'failed': failed, 'wall_time': wall_time}
+
+
+def extract_features(msg: dict) -> dict:
+    """Добавляет к сообщению признаки, нужные трендам, алертам и дайджестам"""
+    text = msg.get('text', '')
+    msg['category'] = classify_message(text)
+    msg['entities'] = extract_entities(text)
+    msg['countries'] = find_countries(text, msg['entities'])
+    msg['keywords'] = find_trend_keywords(text)
+    msg['resonance'] = calculate_resonance_score(clean_story_text(text))
+    return msg
+
+
+def parse_page_features(html_content: str, channel_username: str) -> List[dict]:
+    """Разбор страницы канала и признаки его сообщений - вся работа CPU одного канала"""
+    return [extract_features(msg) for msg in parse_channel_page(html_content, channel_username)]
+
+
+async def run_collection(channels: Iterable[Tuple[str, str]],
+                         store: Callable[[str, List[dict]], Awaitable[None]],
+                         base_url: str = DEFAULT_WEB_BASE_URL, concurrency: int = 8,
+                         queue_size: int = 4, timeout: float = 15, archive=None) -> dict:
+    """Прогоняет каналы через конвейер и возвращает статистику сбора.
+
+    channels - пары (channel_id, username). Загрузки идут параллельно (не больше
+    concurrency одновременно), и каждая страница сразу уходит на разбор, не дожидаясь
+    остальных каналов. Между стадиями - очереди размера queue_size: если разбор или
+    запись отстают, загрузчики ждут место в очереди. store(channel_id, messages)
+    вызывается последовательно, по одному каналу за раз. Если передан archive
+    (page_archive.PageArchive), сырые страницы сохраняются в нем для повторного разбора.
+    """
+    parse_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    store_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    semaphore = asyncio.Semaphore(concurrency)
+    # Свой пул потоков: общий пул asyncio.to_thread меньше concurrency на машинах с малым числом ядер
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='collect')
+    # Разбор идет по одной странице за раз в своем потоке, чтобы не ждать свободного загрузчика
+    parse_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='parse')
+    loop = asyncio.get_running_loop()
+    stats = {'channels': 0, 'fetched': 0, 'failed': 0, 'messages': 0, 'bytes': 0,
+             'fetch_time': 0.0, 'longest_fetch': 0.0, 'process_time': 0.0}
+    started = time.perf_counter()
+
+    async def fetch(channel_id: str, username: str):
+        async with semaphore:
+            fetch_started = time.perf_counter()
+            try:
+                html_content = await loop.run_in_executor(executor, fetch_channel_page, username, base_url, timeout)
+            except Exception as e:
+                logger.error(f"Ошибка при скрапинге канала {username}: {e}")
+                stats['failed'] += 1
+                SCRAPE_FAILURES.inc(channel=username, stage='fetch')
+                tracing.add_stage('fetch', fetch_started, time.perf_counter() - fetch_started,
+                                  channel=username, error=str(e))
+                return
+            finally:
+                elapsed = time.perf_counter() - fetch_started
+                stats['fetch_time'] += elapsed
+                stats['longest_fetch'] = max(stats['longest_fetch'], elapsed)
+                SCRAPE_SECONDS.observe(elapsed, channel=username)
+        stats['fetched'] += 1
+        stats['bytes'] += len(html_content)
+        SCRAPE_BYTES.observe(len(html_content), channel=username)
+        tracing.add_stage('fetch', fetch_started, elapsed, channel=username, bytes=len(html_content))
+        if archive is not None:
+            archive_started = time.perf_counter()
+            try:
+                await loop.run_in_executor(executor, archive.store, channel_id, username, html_content)
+            except Exception as e:
+                logger.error(f"Ошибка сохранения страницы канала {username} в архив: {e}")
+                SCRAPE_FAILURES.inc(channel=username, stage='archive')
+            STAGE_SECONDS.observe(time.perf_counter() - archive_started, stage='archive')
+        await parse_queue.put((channel_id, username, html_content))
+
+    async def parse_stage():
+        # Разбор и признаки (с поиском сущностей) на большом сборе заметно нагружают CPU -
+        # выносим их из цикла событий, чтобы команды бота не ждали конца сбора
+        while True:
+            item = await parse_queue.get()
+            if item is None:
+                await store_queue.put(None)
+                return
+            channel_id, username, html_content = item
+            stage_started = time.perf_counter()
+            try:
+                messages = await loop.run_in_executor(parse_executor, parse_page_features, html_content, username)
+            except Exception as e:
+                logger.error(f"Ошибка разбора страницы канала {username}: {e}")
+                SCRAPE_FAILURES.inc(channel=username, stage='parse')
+                continue
+            finally:
+                elapsed = time.perf_counter() - stage_started
+                stats['process_time'] += elapsed
+                STAGE_SECONDS.observe(elapsed, stage='parse')
+            POSTS_PARSED.observe(len(messages), channel=username)
+            tracing.add_stage('parse', stage_started, elapsed, channel=username, posts=len(messages))
+            tracing.count('posts_parsed', len(messages))
+            if not messages:
+                SCRAPE_FAILURES.inc(channel=username, stage='empty')
+            await store_queue.put((channel_id, messages))
+
+    async def store_stage():
+        while True:
+            item = await store_queue.get()
+            if item is None:
+                return
+            channel_id, messages = item
+            stage_started = time.perf_counter()
+            try:
+                await store(channel_id, messages)
+                stats['messages'] += len(messages)
+            except Exception as e:
+                logger.error(f"Ошибка записи сообщений канала {channel_id}: {e}")
+                SCRAPE_FAILURES.inc(channel=channel_id, stage='store')
+            elapsed = time.perf_counter() - stage_started
+            stats['process_time'] += elapsed
+            STAGE_SECONDS.observe(elapsed, stage='store')
+            tracing.add_stage('store', stage_started, elapsed, channel=channel_id, posts=len(messages))
+
+    consumers = [asyncio.create_task(parse_stage()), asyncio.create_task(store_stage())]
+    fetchers = [asyncio.create_task(fetch(channel_id, username)) for channel_id, username in channels]
+    stats['channels'] = len(fetchers)
+    try:
+        await asyncio.gather(*fetchers)
+        await parse_queue.put(None)
+        await asyncio.gather(*consumers)
+    finally:
+        for task in fetchers + consumers:
+            task.cancel()
+        executor.shutdown(wait=False)
+        parse_executor.shutdown(wait=False)
+
+    stats['wall_time'] = time.perf_counter() - started
+    STAGE_SECONDS.observe(stats['wall_time'], stage='total')
+    logger.info(
+        f"Сбор завершен: {stats['fetched']}/{stats['channels']} каналов, {stats['messages']} сообщений, "
+        f"{stats['wall_time']:.2f} с (самая долгая загрузка {stats['longest_fetch']:.2f} с)"
+    )
+    return stats
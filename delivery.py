@@ -0,0 +1,408 @@
+"""Очередь доставки исходящих сообщений с учетом лимитов Telegram"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from collections import deque
+from datetime import timedelta
+from typing import Callable, Dict, List, Optional
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Приоритеты: меньше - раньше
+PRIORITY_INTERACTIVE = 0  # ответы на команды
+PRIORITY_ALERT = 1  # срочные алерты
+PRIORITY_DIGEST = 2  # плановые дайджесты
+PRIORITY_BULK = 3  # массовые рассылки подписчикам
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: 'interactive',
+    PRIORITY_ALERT: 'alert',
+    PRIORITY_DIGEST: 'digest',
+    PRIORITY_BULK: 'bulk',
+}
+
+DELIVERED_KEYS_SECONDS = 3 * 86400  # сколько помнить ключи идемпотентности доставленных сообщений
+
+SEND_SECONDS = registry.histogram('digest_bot_telegram_send_seconds', 'Время вызова sendMessage', ['priority'])
+SEND_FAILURES = registry.counter('digest_bot_telegram_send_failures_total', 'Неудачные вызовы sendMessage',
+                                 ['priority', 'reason'])
+QUEUE_WAIT_SECONDS = registry.histogram('digest_bot_delivery_wait_seconds', 'Время от постановки в очередь до отправки',
+                                        ['priority'])
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Делит длинный текст на части не длиннее limit: по абзацам, строкам, словам"""
+    if len(text) <= limit:
+        return [text]
+
+    chunks = []
+    rest = text
+    while len(rest) > limit:
+        window = rest[:limit]
+        cut = -1
+        for separator in ('\n\n', '\n', ' '):
+            cut = window.rfind(separator)
+            if cut > limit // 2:
+                break
+        if cut <= 0:
+            cut = limit
+        chunks.append(rest[:cut].rstrip())
+        rest = rest[cut:].lstrip()
+    if rest:
+        chunks.append(rest)
+    return chunks
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity накопленных"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated_at')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self) -> float:
+        """Сколько ждать до появления токена (0 - токен можно брать сразу)"""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill(time.monotonic())
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """Запрещает отправку на seconds секунд (после RetryAfter)"""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+def is_group_chat(chat_id) -> bool:
+    """Каналы и группы (@username или отрицательный id) имеют более строгий лимит"""
+    return isinstance(chat_id, str) or int(chat_id) < 0
+
+
+class DeliveryQueue:
+    """Приоритетная очередь отправки с лимитами на чат и глобально, повторами и outbox на диске"""
+
+    def __init__(self, outbox_path: Optional[str] = None, workers: int = 4,
+                 global_rate: float = 30.0, private_rate: float = 1.0,
+                 group_rate: float = 20 / 60, max_attempts: int = 5):
+        self.outbox_path = outbox_path
+        self.workers = workers
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.max_attempts = max_attempts
+
+        self.bot = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._chat_buckets: Dict[str, TokenBucket] = {}
+        self._busy_chats: Dict[str, deque] = {}  # чат -> задания, ждущие, пока воркер досылает предыдущие
+        self._futures: Dict[str, asyncio.Future] = {}
+        self._outbox: Dict[str, dict] = {}
+        self._delivered: Dict[str, float] = {}  # ключ идемпотентности -> время доставки
+        self._journal_done = 0
+        self._seq = 0
+        self.stats = {'sent': 0, 'failed': 0, 'retry_after': 0, 'retries': 0, 'withdrawn': 0, 'duplicates': 0}
+
+    # --- outbox ---
+    # Журнал JSONL: add - новое сообщение, progress - отправлены первые части, done - доставлено.
+    # Дописывание дешевое даже при массовой рассылке; журнал сжимается при старте и остановке.
+    # Для сообщений с ключом идемпотентности done хранит ключ и время, и при сжатии такие
+    # записи остаются DELIVERED_KEYS_SECONDS, чтобы сообщение с тем же ключом не ушло повторно.
+
+    def _journal(self, record: dict):
+        if not self.outbox_path:
+            return
+        try:
+            with open(self.outbox_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except OSError as e:
+            logger.error(f"Ошибка записи outbox {self.outbox_path}: {e}")
+            return
+        if record['op'] == 'done':
+            self._journal_done += 1
+            if self._journal_done > 1000 and self._journal_done > 2 * len(self._outbox):
+                self._compact_outbox()
+
+    def _load_outbox(self) -> List[dict]:
+        if not self.outbox_path or not os.path.exists(self.outbox_path):
+            return []
+        jobs = {}
+        try:
+            with open(self.outbox_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record['op'] == 'add':
+                        jobs[record['job']['id']] = record['job']
+                    elif record['op'] == 'progress' and record['id'] in jobs:
+                        jobs[record['id']]['sent_chunks'] = record['sent_chunks']
+                    elif record['op'] == 'done':
+                        jobs.pop(record['id'], None)
+                        if record.get('key'):
+                            self._delivered[record['key']] = record['at']
+        except OSError as e:
+            logger.error(f"Ошибка чтения outbox {self.outbox_path}: {e}")
+        return list(jobs.values())
+
+    def _compact_outbox(self):
+        """Переписывает журнал, оставляя только недоставленные сообщения"""
+        if not self.outbox_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.outbox_path) or '.', exist_ok=True)
+            tmp_path = self.outbox_path + '.tmp'
+            horizon = time.time() - DELIVERED_KEYS_SECONDS
+            self._delivered = {key: at for key, at in self._delivered.items() if at >= horizon}
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for key, at in self._delivered.items():
+                    f.write(json.dumps({'op': 'done', 'id': key, 'key': key, 'at': at}, ensure_ascii=False) + '\n')
+                for job in self._outbox.values():
+                    f.write(json.dumps({'op': 'add', 'job': job}, ensure_ascii=False) + '\n')
+            os.replace(tmp_path, self.outbox_path)
+            self._journal_done = 0
+        except OSError as e:
+            logger.error(f"Ошибка записи outbox {self.outbox_path}: {e}")
+
+    # --- жизненный цикл ---
+
+    async def start(self, bot):
+        """Запускает воркеры в текущем event loop и досылает сообщения из outbox"""
+        self.bot = bot
+        self.loop = asyncio.get_running_loop()
+        self._queue = asyncio.PriorityQueue()
+        for job in self._load_outbox():
+            self._put(job)
+        self._compact_outbox()
+        if self._outbox:
+            logger.info(f"Из outbox восстановлено {len(self._outbox)} неотправленных сообщений")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0):
+        """Дожидается отправки очереди (не дольше timeout) и останавливает воркеры"""
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Очередь доставки не опустела за {timeout} с, остаток сохранен в outbox")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._compact_outbox()
+
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    # --- постановка в очередь ---
+
+    def _put(self, job: dict):
+        self._seq += 1
+        if job.get('persist'):
+            self._outbox[job['id']] = job
+        self._queue.put_nowait((job['priority'], self._seq, job))
+
+    def enqueue(self, chat_id, text: str, priority: int = PRIORITY_DIGEST,
+                persist: bool = True, key: Optional[str] = None, **kwargs) -> asyncio.Future:
+        """Ставит сообщение в очередь (из loop очереди). Future завершится после отправки всех частей.
+
+        key - ключ идемпотентности: если сообщение с таким ключом уже доставлено или ждет
+        в outbox (например, восстановлено после перезапуска), новое не ставится, а future
+        сразу завершается пустым списком.
+        """
+        if key is not None and (key in self._delivered or key in self._outbox):
+            self.stats['duplicates'] += 1
+            logger.info(f"Сообщение {key} уже принято к доставке, повтор пропущен")
+            future = self.loop.create_future()
+            future.set_result([])
+            return future
+        job = {
+            'id': key or uuid.uuid4().hex,
+            'key': key,
+            'chat_id': chat_id,
+            'chunks': split_message(text),
+            'sent_chunks': 0,
+            'priority': priority,
+            'persist': persist,
+            'attempts': 0,
+            'queued_at': time.time(),
+            # Клавиатуры и прочие объекты не сериализуются - только для непостоянных сообщений
+            'kwargs': kwargs if not persist else {},
+        }
+        future = self.loop.create_future()
+        self._futures[job['id']] = future
+        self._put(job)
+        if persist:
+            self._journal({'op': 'add', 'job': job})
+        return future
+
+    async def submit(self, chat_id, text: str, priority: int = PRIORITY_DIGEST,
+                     persist: bool = True, key: Optional[str] = None, **kwargs):
+        """Отправляет сообщение через очередь и ждет результата; можно вызывать из любого event loop"""
+        if self.loop is None:
+            raise RuntimeError("Очередь доставки не запущена")
+        if asyncio.get_running_loop() is self.loop:
+            return await self.enqueue(chat_id, text, priority, persist, key, **kwargs)
+
+        async def _submit_local():
+            return await self.enqueue(chat_id, text, priority, persist, key, **kwargs)
+
+        # Вызов из другого потока (планировщик) - передаем задачу в loop очереди
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(_submit_local(), self.loop))
+
+    # --- отправка ---
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        key = str(chat_id)
+        bucket = self._chat_buckets.get(key)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # Полные корзины ничего не ограничивают - их можно забыть
+                self._chat_buckets = {k: b for k, b in self._chat_buckets.items() if not b.is_full()}
+            if is_group_chat(chat_id):
+                bucket = TokenBucket(self.group_rate, 3)
+            else:
+                bucket = TokenBucket(self.private_rate, 1)
+            self._chat_buckets[key] = bucket
+        return bucket
+
+    async def _acquire(self, chat_id, withdrawn: Optional[Callable[[], bool]] = None) -> bool:
+        """Ждет токен и в корзине чата, и в глобальной корзине; False - сообщение отозвано, пока ждало"""
+        chat_bucket = self._chat_bucket(chat_id)
+        while True:
+            if withdrawn is not None and withdrawn():
+                return False
+            delay = max(chat_bucket.delay(), self.global_bucket.delay())
+            if delay <= 0:
+                chat_bucket.take()
+                self.global_bucket.take()
+                return True
+            await asyncio.sleep(delay)
+
+    async def _send_chunk(self, job: dict, chunk: str, priority: str):
+        send_started = time.perf_counter()
+        try:
+            return await self.bot.send_message(chat_id=job['chat_id'], text=chunk, **job['kwargs'])
+        except Exception as e:
+            SEND_FAILURES.inc(priority=priority, reason=type(e).__name__)
+            raise
+        finally:
+            SEND_SECONDS.observe(time.perf_counter() - send_started, priority=priority)
+
+    async def _send_job(self, job: dict, future: Optional[asyncio.Future] = None) -> list:
+        results = []
+        priority = PRIORITY_NAMES.get(job['priority'], str(job['priority']))
+        if job.get('queued_at'):
+            QUEUE_WAIT_SECONDS.observe(max(0.0, time.time() - job['queued_at']), priority=priority)
+        # Отправитель отменил запрос, пока сообщение ждало очереди (например, сводку
+        # заменили новой) - не отправляем. Начатое многочастное сообщение дошлем целиком
+        withdrawn = (lambda: future.cancelled() and not job['sent_chunks']) if future is not None else None
+        while job['sent_chunks'] < len(job['chunks']):
+            if not await self._acquire(job['chat_id'], withdrawn):
+                self.stats['withdrawn'] += 1
+                break
+            chunk = job['chunks'][job['sent_chunks']]
+            try:
+                message = await self._send_chunk(job, chunk, priority)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                self.stats['retry_after'] += 1
+                logger.warning(f"Flood limit для {job['chat_id']}: ждем {retry_after} с")
+                self._chat_bucket(job['chat_id']).pause(float(retry_after))
+                continue
+            except (TimedOut, NetworkError) as e:
+                if isinstance(e, (BadRequest, Forbidden)):
+                    raise
+                job['attempts'] += 1
+                if job['attempts'] >= self.max_attempts:
+                    raise
+                self.stats['retries'] += 1
+                backoff = min(60, 2 ** job['attempts'])
+                logger.warning(f"Ошибка сети при отправке в {job['chat_id']} ({e}), повтор через {backoff} с")
+                await asyncio.sleep(backoff)
+                continue
+            results.append(message)
+            job['sent_chunks'] += 1
+            if job.get('persist') and job['sent_chunks'] < len(job['chunks']):
+                self._journal({'op': 'progress', 'id': job['id'], 'sent_chunks': job['sent_chunks']})
+        return results
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            chat = str(job['chat_id'])
+            parked = self._busy_chats.get(chat)
+            if parked is not None:
+                # Чат уже обслуживает другой воркер - он отправит задание следом, сохранив порядок
+                # частей, а этот воркер не ждет чужой чат и берет из очереди задания других чатов
+                parked.append(job)
+                continue
+            self._busy_chats[chat] = parked = deque()
+            try:
+                while job is not None:
+                    await self._deliver(job)
+                    job = parked.popleft() if parked else None
+            finally:
+                del self._busy_chats[chat]
+
+    async def _deliver(self, job: dict):
+        future = self._futures.pop(job['id'], None)
+        finished = True
+        delivered = False
+        try:
+            results = await self._send_job(job, future)
+            self.stats['sent'] += 1
+            delivered = job['sent_chunks'] == len(job['chunks'])
+            if future and not future.done():
+                future.set_result(results)
+        except asyncio.CancelledError:
+            # Остановка посреди отправки - сообщение остается в outbox до следующего запуска
+            finished = False
+            if future and not future.done():
+                future.cancel()
+            raise
+        except Exception as e:
+            self.stats['failed'] += 1
+            logger.error(f"Сообщение для {job['chat_id']} не доставлено: {e}")
+            if future and not future.done():
+                future.set_exception(e)
+        finally:
+            if finished and self._outbox.pop(job['id'], None) is not None:
+                record = {'op': 'done', 'id': job['id']}
+                if delivered and job.get('key'):
+                    # Недоставленное сообщение ключ не занимает - повторный запуск слота его дошлет
+                    self._delivered[job['key']] = record['at'] = round(time.time(), 3)
+                    record['key'] = job['key']
+                self._journal(record)
+            self._queue.task_done()
@@ -0,0 +1,194 @@
+"""Общий анализ окна сообщений: признаки каналов считаются один раз, дайджесты собираются из них"""
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from text_analysis import CATEGORIES, calculate_resonance_score, classify_message, is_promotional
+from worker_pool import check_cancelled
+
+TOP_NEWS_COUNT = 3
+FACTS_COUNT = 6
+# Сколько лучших кандидатов пересматривать с учетом уже опубликованных новостей
+NOVELTY_POOL_FACTOR = 3
+# Сколько лучших кандидатов хранить по каждому каналу. Пул из K лучших новостей любого
+# набора каналов всегда содержится в объединении K лучших отдельных каналов, поэтому
+# слияние точное и для топа, и для пула пересмотра повторов (пока top_n не больше TOP_NEWS_COUNT).
+CANDIDATES_PER_CHANNEL = TOP_NEWS_COUNT * NOVELTY_POOL_FACTOR
+
+# Почему сообщение не попало в кандидаты на топ
+DROP_REASONS = ('skip_phrase', 'duplicate', 'too_short')
+
+# Очистка вызывается на каждое сообщение окна, поэтому шаблоны компилируются один раз
+URL_PATTERN = re.compile(r'https?://[^\s]+')
+WWW_PATTERN = re.compile(r'www\.[^\s]+')
+NON_TEXT_PATTERN = re.compile(r'[^\w\s.,!?\-]')
+SPACE_PATTERN = re.compile(r'\s+')
+
+
+def clean_story_text(text: str) -> str:
+    """Очищает текст новости от ссылок и лишних символов"""
+    text = URL_PATTERN.sub('', text)
+    text = WWW_PATTERN.sub('', text)
+    text = NON_TEXT_PATTERN.sub(' ', text)
+    return SPACE_PATTERN.sub(' ', text)
+
+
+class ChannelFeatures:
+    """Признаки одного канала за окно: категории, лучшие новости и факты для короткой сводки"""
+
+    __slots__ = ('channel_id', 'title', 'position', 'message_count', 'category_counts',
+                 'candidates', 'candidate_count', 'fact_texts', 'drops')
+
+    def __init__(self, channel_id: str, title: str, position: int):
+        self.channel_id = channel_id
+        self.title = title
+        self.position = position
+        self.message_count = 0
+        self.category_counts = dict.fromkeys(CATEGORIES, 0)
+        self.candidates = []  # (score, index, clean_text), не больше CANDIDATES_PER_CHANNEL
+        self.candidate_count = 0  # сколько сообщений вообще претендовало на топ
+        self.fact_texts = []  # первые FACTS_COUNT очищенных текстов
+        self.drops = dict.fromkeys(DROP_REASONS, 0)  # причина -> сколько сообщений не дошло до топа
+
+
+def analyze_channel(channel_id: str, title: str, position: int, messages: List[dict]) -> ChannelFeatures:
+    """Считает признаки канала; чистая функция без обращения к глобальному состоянию"""
+    rows = ((msg.get('text', ''), msg.get('category'), msg.get('resonance')) for msg in messages)
+    return analyze_rows(channel_id, title, position, rows)
+
+
+def analyze_rows(channel_id: str, title: str, position: int,
+                 rows: Iterable[Tuple[str, Optional[str], Optional[float]]]) -> ChannelFeatures:
+    """То же по строкам (текст, категория, резонансность) - в таком виде сообщения приходят
+    в процессы параллельного анализа (sharded_analysis.py)"""
+    features = ChannelFeatures(channel_id, title, position)
+    candidates = []
+    seen_texts = set()
+
+    for index, (text, category, score) in enumerate(rows):
+        features.message_count += 1
+        # Категория и резонансность обычно уже посчитаны при сборе
+        features.category_counts[category or classify_message(text)] += 1
+
+        # Рекламные сообщения не участвуют ни в топе, ни в фактах
+        if is_promotional(text):
+            features.drops['skip_phrase'] += 1
+            continue
+
+        clean_text = clean_story_text(text)
+        stripped = clean_text.strip()
+        # Повтор того же поста в канале (репост, правка) не должен занимать второе место в топе
+        if stripped in seen_texts:
+            features.drops['duplicate'] += 1
+            continue
+        seen_texts.add(stripped)
+        if len(stripped) > 3 and len(features.fact_texts) < FACTS_COUNT:
+            features.fact_texts.append(clean_text)
+        if len(stripped) <= 10:
+            features.drops['too_short'] += 1
+        else:
+            if score is None:
+                score = calculate_resonance_score(clean_text)
+            candidates.append((score, index, clean_text))
+
+    # Стабильная сортировка: при равной резонансности раньше идет более раннее сообщение
+    candidates.sort(key=lambda item: item[0], reverse=True)
+    features.candidate_count = len(candidates)
+    features.candidates = candidates[:CANDIDATES_PER_CHANNEL]
+    return features
+
+
+class DigestSelection:
+    """Данные для одного дайджеста, собранные из признаков выбранных каналов"""
+
+    def __init__(self):
+        self.message_count = 0
+        self.channel_count = 0
+        self.category_counts = dict.fromkeys(CATEGORIES, 0)
+        self.top_news: List[dict] = []
+        self.fact_texts: List[str] = []
+        self.candidate_count = 0
+        self.drops = dict.fromkeys(DROP_REASONS, 0)
+        self.repeats_demoted = 0  # опубликованные раньше новости, вытесненные из топа
+        self.entity_counts: Dict[str, int] = {}  # сущность -> сообщений с ней за окно (entities.EntityIndex)
+
+
+class WindowAnalysis:
+    """Признаки всех каналов окна; из них дешево собираются дайджесты для любых наборов каналов"""
+
+    def __init__(self, hours: int, features: Dict[str, ChannelFeatures]):
+        self.hours = hours
+        self.features = features
+
+    def has_messages(self, channel_ids: Optional[Iterable[str]] = None) -> bool:
+        return any(f.message_count for f in self._channels(channel_ids))
+
+    def _channels(self, channel_ids: Optional[Iterable[str]]) -> List[ChannelFeatures]:
+        if channel_ids is None:
+            channels = list(self.features.values())
+        else:
+            channels = [self.features[ch_id] for ch_id in set(channel_ids) if ch_id in self.features]
+        channels.sort(key=lambda f: f.position)
+        return channels
+
+    def select(self, channel_ids: Optional[Iterable[str]] = None,
+               top_n: int = TOP_NEWS_COUNT, facts: int = FACTS_COUNT,
+               is_published: Optional[Callable[[str], bool]] = None,
+               repeat_penalty: float = 0.5) -> DigestSelection:
+        """Сливает признаки каналов (None - все каналы окна) в один дайджест.
+
+        is_published - проверка по памяти опубликованных новостей: такие новости
+        конкурируют за топ с резонансностью, умноженной на repeat_penalty, а если
+        все же проходят, помечаются как повтор (repeat).
+        """
+        selection = DigestSelection()
+        candidates = []
+        titles = set()
+
+        for features in self._channels(channel_ids):
+            if not features.message_count:
+                continue
+            selection.message_count += features.message_count
+            selection.candidate_count += features.candidate_count
+            titles.add(features.title)
+            for category, count in features.category_counts.items():
+                selection.category_counts[category] += count
+            for reason, count in features.drops.items():
+                selection.drops[reason] += count
+            for score, index, text in features.candidates:
+                candidates.append((score, features.position, index, text, features.title))
+            if len(selection.fact_texts) < facts:
+                selection.fact_texts.extend(features.fact_texts[:facts - len(selection.fact_texts)])
+
+        selection.channel_count = len(titles)
+        candidates.sort(key=lambda item: (-item[0], item[1], item[2]))
+        repeats = set()
+        if is_published is not None:
+            pool = candidates[:top_n * NOVELTY_POOL_FACTOR]
+            repeats = {index for index, candidate in enumerate(pool) if is_published(candidate[3])}
+            if repeats:
+                order = sorted(range(len(pool)), key=lambda index: (
+                    -pool[index][0] * (repeat_penalty if index in repeats else 1), index))
+                new_top = set(order[:top_n])
+                selection.repeats_demoted = sum(1 for index in repeats if index < top_n and index not in new_top)
+                repeats = {position for position, index in enumerate(order) if index in repeats}
+                candidates = [pool[index] for index in order]
+        selection.top_news = [
+            {'text': text, 'score': score, 'channel': title, 'repeat': position in repeats}
+            for position, (score, _, _, text, title) in enumerate(candidates[:top_n])
+        ]
+        return selection
+
+
+def analyze_window(hours: int, window: Dict[str, List[dict]], titles: Dict[str, str],
+                   cancel_event=None) -> WindowAnalysis:
+    """Считает признаки всех каналов окна один раз для всех получателей.
+
+    cancel_event (threading.Event) проверяется между каналами: в пуле воркеров
+    отмененный запрос перестает считаться, не дожидаясь конца окна.
+    """
+    features = {}
+    for position, (channel_id, messages) in enumerate(window.items()):
+        check_cancelled(cancel_event)
+        title = titles.get(channel_id, f'Channel {channel_id}')
+        features[channel_id] = analyze_channel(channel_id, title, position, messages)
+    return WindowAnalysis(hours, features)
@@ -0,0 +1,329 @@
+"""Сущности в новостях: страны, персоны, организации - и фасетный индекс по ним.
+
+Справочник (газеттир) хранит для каждой сущности начальные формы имен, а формы падежей
+порождаются по окончанию слова: «россия» дает «россии», «россию», «россией», «путин» -
+«путина», «путиным», прилагательное «российский» - «российского», «российской» и т. д.
+Поиск идет по словам текста, а не по подстрокам, поэтому «здания» не считается Данией.
+Аббревиатуры (США, НАТО, ЕС) не склоняются и совпадают в любом регистре.
+
+EntityIndex, как и скользящие окна, обновляется вместе с хранилищем: для каждой сущности
+и канала держит отсортированные времена упоминаний, поэтому число упоминаний за любое
+окно считается двоичным поиском, без перебора сообщений.
+"""
+import re
+import time
+import threading
+from bisect import bisect_right
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from windows import parse_timestamp
+
+COUNTRY = 'country'
+PERSON = 'person'
+ORGANIZATION = 'org'
+KINDS = (COUNTRY, PERSON, ORGANIZATION)
+KIND_LABELS = {COUNTRY: 'страна', PERSON: 'персона', ORGANIZATION: 'организация'}
+
+# (id, название, вид, имена). id стран совпадают с прежними ключами трендов.
+# Имена в верхнем регистре - аббревиатуры, имена из нескольких слов склоняются по словам,
+# а формы, которые правила не порождают (Египта, Беларуси), перечислены явно.
+ENTITIES = (
+    ('россия', 'Россия', COUNTRY, ('россия', 'российский', 'РФ')),
+    ('украина', 'Украина', COUNTRY, ('украина', 'украинский')),
+    ('сша', 'США', COUNTRY, ('США', 'американский')),
+    ('китай', 'Китай', COUNTRY, ('китай', 'китайский', 'КНР')),
+    ('европа', 'Европа', COUNTRY, ('европа',)),
+    ('германия', 'Германия', COUNTRY, ('германия', 'немецкий', 'германский', 'ФРГ')),
+    ('франция', 'Франция', COUNTRY, ('франция', 'французский')),
+    ('великобритания', 'Великобритания', COUNTRY, ('великобритания', 'британия', 'британский')),
+    ('япония', 'Япония', COUNTRY, ('япония', 'японский')),
+    ('индия', 'Индия', COUNTRY, ('индия', 'индийский')),
+    ('бразилия', 'Бразилия', COUNTRY, ('бразилия', 'бразильский')),
+    ('канада', 'Канада', COUNTRY, ('канада', 'канадский')),
+    ('австралия', 'Австралия', COUNTRY, ('австралия', 'австралийский')),
+    ('иран', 'Иран', COUNTRY, ('иран', 'иранский')),
+    ('израиль', 'Израиль', COUNTRY, ('израиль', 'израильский')),
+    ('палестина', 'Палестина', COUNTRY, ('палестина', 'палестинский')),
+    ('турция', 'Турция', COUNTRY, ('турция', 'турецкий')),
+    ('саудовская аравия', 'Саудовская Аравия', COUNTRY, ('саудовская аравия',)),
+    ('египет', 'Египет', COUNTRY, ('египет', 'египта', 'египту', 'египтом', 'египте', 'египетский')),
+    ('норвегия', 'Норвегия', COUNTRY, ('норвегия', 'норвежский')),
+    ('польша', 'Польша', COUNTRY, ('польша', 'польский')),
+    ('чехия', 'Чехия', COUNTRY, ('чехия', 'чешский')),
+    ('словакия', 'Словакия', COUNTRY, ('словакия', 'словацкий')),
+    ('венгрия', 'Венгрия', COUNTRY, ('венгрия', 'венгерский')),
+    ('румыния', 'Румыния', COUNTRY, ('румыния', 'румынский')),
+    ('болгария', 'Болгария', COUNTRY, ('болгария', 'болгарский')),
+    ('греция', 'Греция', COUNTRY, ('греция', 'греческий')),
+    ('италия', 'Италия', COUNTRY, ('италия', 'итальянский')),
+    ('испания', 'Испания', COUNTRY, ('испания', 'испанский')),
+    ('португалия', 'Португалия', COUNTRY, ('португалия', 'португальский')),
+    ('нидерланды', 'Нидерланды', COUNTRY, ('нидерланды', 'нидерландов', 'нидерландам', 'нидерландами',
+                                           'нидерландах', 'нидерландский')),
+    ('бельгия', 'Бельгия', COUNTRY, ('бельгия', 'бельгийский')),
+    ('швейцария', 'Швейцария', COUNTRY, ('швейцария', 'швейцарский')),
+    ('австрия', 'Австрия', COUNTRY, ('австрия', 'австрийский')),
+    ('швеция', 'Швеция', COUNTRY, ('швеция', 'шведский')),
+    ('финляндия', 'Финляндия', COUNTRY, ('финляндия', 'финский')),
+    ('дания', 'Дания', COUNTRY, ('дания', 'датский')),
+    ('беларусь', 'Беларусь', COUNTRY, ('беларусь', 'беларуси', 'беларусью', 'белоруссия', 'белорусский')),
+
+    ('путин', 'Владимир Путин', PERSON, ('путин',)),
+    ('зеленский', 'Владимир Зеленский', PERSON, ('зеленский',)),
+    ('трамп', 'Дональд Трамп', PERSON, ('трамп',)),
+    ('байден', 'Джо Байден', PERSON, ('байден',)),
+    ('макрон', 'Эмманюэль Макрон', PERSON, ('макрон',)),
+    ('шольц', 'Олаф Шольц', PERSON, ('шольц',)),
+    ('мерц', 'Фридрих Мерц', PERSON, ('мерц',)),
+    ('си цзиньпин', 'Си Цзиньпин', PERSON, ('цзиньпин',)),
+    ('эрдоган', 'Реджеп Эрдоган', PERSON, ('эрдоган',)),
+    ('нетаньяху', 'Биньямин Нетаньяху', PERSON, ('нетаньяху',)),
+    ('лукашенко', 'Александр Лукашенко', PERSON, ('лукашенко',)),
+    ('лавров', 'Сергей Лавров', PERSON, ('лавров',)),
+    ('песков', 'Дмитрий Песков', PERSON, ('песков',)),
+    ('мишустин', 'Михаил Мишустин', PERSON, ('мишустин',)),
+    ('орбан', 'Виктор Орбан', PERSON, ('орбан',)),
+    ('захарова', 'Мария Захарова', PERSON, ('захарова',)),
+
+    ('оон', 'ООН', ORGANIZATION, ('ООН',)),
+    ('нато', 'НАТО', ORGANIZATION, ('НАТО',)),
+    ('ес', 'Евросоюз', ORGANIZATION, ('ЕС', 'евросоюз', 'еврокомиссия')),
+    ('мвф', 'МВФ', ORGANIZATION, ('МВФ',)),
+    ('вто', 'ВТО', ORGANIZATION, ('ВТО',)),
+    ('опек', 'ОПЕК', ORGANIZATION, ('ОПЕК', 'ОПЕК+')),
+    ('магатэ', 'МАГАТЭ', ORGANIZATION, ('МАГАТЭ',)),
+    ('цб', 'Центробанк', ORGANIZATION, ('ЦБ', 'центробанк')),
+    ('госдума', 'Госдума', ORGANIZATION, ('госдума',)),
+    ('кремль', 'Кремль', ORGANIZATION, ('кремль',)),
+    ('белый дом', 'Белый дом', ORGANIZATION, ('белый дом',)),
+    ('пентагон', 'Пентагон', ORGANIZATION, ('пентагон',)),
+    ('мид', 'МИД', ORGANIZATION, ('МИД',)),
+    ('минобороны', 'Минобороны', ORGANIZATION, ('минобороны',)),
+    ('всу', 'ВСУ', ORGANIZATION, ('ВСУ',)),
+    ('газпром', 'Газпром', ORGANIZATION, ('газпром',)),
+)
+
+TOKEN_PATTERN = re.compile(r'[A-Za-zА-Яа-яЁё0-9]+\+?')
+HARD_CONSONANTS = set('кгхжшчщ')
+ADJECTIVE_ENDINGS = ('ий', 'ого', 'ому', 'им', 'ом', 'ая', 'ой', 'ую', 'ою', 'ое', 'ие', 'их', 'ими')
+
+
+def normalize(word: str) -> str:
+    return word.lower().replace('ё', 'е')
+
+
+def word_forms(word: str) -> set:
+    """Падежные формы слова по его окончанию (единственное число; у прилагательных - все)"""
+    word = normalize(word)
+    if len(word) <= 2:
+        return {word}
+    if word.endswith(('ский', 'цкий', 'кий', 'жий', 'ший')):
+        return {word[:-2] + ending for ending in ADJECTIVE_ENDINGS}
+    if word.endswith('ый'):
+        return {word[:-2] + ending for ending in ('ый', 'ого', 'ому', 'ым', 'ом')}
+    if word.endswith(('ская', 'цкая', 'вая', 'ная')):
+        return {word[:-2] + ending for ending in ('ая', 'ой', 'ую', 'ою')}
+    if word.endswith('ия'):
+        return {word[:-1] + ending for ending in ('я', 'и', 'ю', 'ей', 'ею')}
+    if word.endswith('а'):
+        stem = word[:-1]
+        genitive = 'и' if stem[-1] in HARD_CONSONANTS else 'ы'
+        return {stem + ending for ending in ('а', genitive, 'е', 'у', 'ой', 'ою')}
+    if word.endswith('я'):
+        return {word[:-1] + ending for ending in ('я', 'и', 'е', 'ю', 'ей')}
+    if word.endswith('ь'):
+        return {word[:-1] + ending for ending in ('ь', 'я', 'ю', 'ем', 'е')}
+    if word.endswith('й'):
+        return {word[:-1] + ending for ending in ('й', 'я', 'ю', 'ем', 'е')}
+    if word[-1] in 'аеиоуыэюя':
+        return {word}  # несклоняемые: Нетаньяху, Лукашенко, минобороны
+    # Творительный падеж: фамилии на -ов/-ев/-ин - на -ым (Путиным), но Цзиньпином;
+    # после шипящих и ц - на -ем (Шольцем)
+    if word.endswith(('ов', 'ев', 'ин', 'ын')):
+        instrumental = ('ым', 'ом')
+    elif word[-1] in 'жшчщц':
+        instrumental = ('ем',)
+    else:
+        instrumental = ('ом',)
+    return {word + ending for ending in ('', 'а', 'у', 'е') + instrumental}
+
+
+class Gazetteer:
+    """Справочник сущностей: формы слов -> id сущности"""
+
+    def __init__(self, entries: Iterable[Tuple[str, str, str, Tuple[str, ...]]]):
+        self.entities: Dict[str, dict] = {}  # id -> {'id', 'name', 'kind'}
+        self.words: Dict[str, str] = {}  # форма слова -> id
+        # Имена из нескольких слов: форма первого слова -> [(формы остальных слов, id)]
+        self.phrases: Dict[str, List[Tuple[Tuple[set, ...], str]]] = defaultdict(list)
+        for entity_id, name, kind, aliases in entries:
+            self.entities[entity_id] = {'id': entity_id, 'name': name, 'kind': kind}
+            for alias in aliases:
+                words = alias.split()
+                if alias.isupper():
+                    self.words.setdefault(normalize(alias), entity_id)
+                elif len(words) == 1:
+                    for form in word_forms(alias):
+                        self.words.setdefault(form, entity_id)
+                else:
+                    rest = tuple(word_forms(word) for word in words[1:])
+                    for form in word_forms(words[0]):
+                        self.phrases[form].append((rest, entity_id))
+
+    def extract(self, text: str) -> List[str]:
+        """id сущностей текста в порядке первого упоминания, без повторов"""
+        lowered = [normalize(token) for token in TOKEN_PATTERN.findall(text)]
+        found = {}
+        for i, token in enumerate(lowered):
+            entity_id = None
+            for rest, phrase_id in self.phrases.get(token, ()):
+                if all(i + 1 + j < len(lowered) and lowered[i + 1 + j] in forms for j, forms in enumerate(rest)):
+                    entity_id = phrase_id
+                    break
+            if entity_id is None:
+                entity_id = self.words.get(token) or self.words.get(token.rstrip('+'))
+            if entity_id is not None:
+                found.setdefault(entity_id, None)
+        return list(found)
+
+    def resolve(self, query: str) -> Optional[str]:
+        """Сущность по запросу пользователя: любая форма имени или начало названия"""
+        query = query.strip()
+        if not query:
+            return None
+        entities = self.extract(query)
+        if entities:
+            return entities[0]
+        prefix = normalize(query)
+        for entity_id, entity in self.entities.items():
+            if entity_id.startswith(prefix) or normalize(entity['name']).startswith(prefix):
+                return entity_id
+        return None
+
+    def name(self, entity_id: str) -> str:
+        entity = self.entities.get(entity_id)
+        return entity['name'] if entity else entity_id
+
+    def kind(self, entity_id: str) -> Optional[str]:
+        entity = self.entities.get(entity_id)
+        return entity['kind'] if entity else None
+
+
+# Формы слов для всех имен строятся при первом разборе текста, а не при импорте
+_gazetteer: Optional[Gazetteer] = None
+_gazetteer_lock = threading.Lock()
+
+
+def get_gazetteer() -> Gazetteer:
+    """Общий справочник ENTITIES, создается при первом обращении"""
+    global _gazetteer
+    if _gazetteer is None:
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                _gazetteer = Gazetteer(ENTITIES)
+    return _gazetteer
+
+
+def extract_entities(text: str) -> List[str]:
+    return get_gazetteer().extract(text)
+
+
+def top_by_kind(counts: Dict[str, int], limit: int = 3) -> Dict[str, List[Tuple[str, int]]]:
+    """Самые упоминаемые сущности каждого вида: вид -> [(id, число)]"""
+    grouped = {kind: [] for kind in KINDS}
+    for entity_id, count in sorted(counts.items(), key=lambda item: (-item[1], item[0])):
+        kind = get_gazetteer().kind(entity_id)
+        if kind and count and len(grouped[kind]) < limit:
+            grouped[kind].append((entity_id, count))
+    return grouped
+
+
+class EntityIndex:
+    """Фасетный индекс: сущность -> канал -> (времена упоминаний по возрастанию, сообщения)"""
+
+    def __init__(self, default_tz, gazetteer: Optional[Gazetteer] = None):
+        self.default_tz = default_tz
+        self._gazetteer = gazetteer
+        self.lock = threading.Lock()
+        self.postings: Dict[str, Dict[str, Tuple[List[float], List[dict]]]] = {}
+        self._channel_entities: Dict[str, set] = {}
+
+    def _entities(self, msg: dict) -> List[str]:
+        # Признак считается при сборе; у сообщений из старых источников - на месте
+        entities = msg.get('entities')
+        return entities if entities is not None else self.gazetteer.extract(msg.get('text', ''))
+
+    @property
+    def gazetteer(self) -> Gazetteer:
+        return self._gazetteer or get_gazetteer()
+
+    def set_channel(self, channel_id: str, messages: List[dict]):
+        """Пересчитывает упоминания канала после замены всех его сообщений"""
+        mentions = defaultdict(list)
+        for msg in messages:
+            ts = parse_timestamp(msg, self.default_tz)
+            for entity_id in self._entities(msg):
+                mentions[entity_id].append((ts, msg))
+        with self.lock:
+            for entity_id in self._channel_entities.get(channel_id, ()):
+                if entity_id not in mentions:
+                    self.postings[entity_id].pop(channel_id, None)
+            for entity_id, items in mentions.items():
+                items.sort(key=lambda item: item[0])
+                self.postings.setdefault(entity_id, {})[channel_id] = ([ts for ts, _ in items], [msg for _, msg in items])
+            self._channel_entities[channel_id] = set(mentions)
+
+    def append(self, channel_id: str, msg: dict):
+        """Добавляет упоминания одного сообщения"""
+        ts = parse_timestamp(msg, self.default_tz)
+        with self.lock:
+            for entity_id in self._entities(msg):
+                stamps, messages = self.postings.setdefault(entity_id, {}).get(channel_id, ([], []))
+                # Списки заменяются, а не меняются: читатель без блокировки видит целый снимок
+                stamps, messages = list(stamps), list(messages)
+                position = bisect_right(stamps, ts)
+                stamps.insert(position, ts)
+                messages.insert(position, msg)
+                self.postings[entity_id][channel_id] = (stamps, messages)
+                self._channel_entities.setdefault(channel_id, set()).add(entity_id)
+
+    def counts(self, hours: float, channel_ids, now: Optional[float] = None, kind: Optional[str] = None) -> Dict[str, int]:
+        """Число сообщений с каждой сущностью за последние hours часов по выбранным каналам"""
+        cutoff = (now if now is not None else time.time()) - hours * 3600
+        result = {}
+        with self.lock:
+            for entity_id, by_channel in self.postings.items():
+                if kind is not None and self.gazetteer.kind(entity_id) != kind:
+                    continue
+                total = sum(len(stamps) - bisect_right(stamps, cutoff)
+                            for channel_id, (stamps, _) in by_channel.items() if channel_id in channel_ids)
+                if total:
+                    result[entity_id] = total
+        return result
+
+    def channel_counts(self, entity_id: str, hours: float, channel_ids, now: Optional[float] = None) -> Dict[str, int]:
+        """Сколько сообщений с сущностью за окно в каждом канале"""
+        cutoff = (now if now is not None else time.time()) - hours * 3600
+        with self.lock:
+            by_channel = dict(self.postings.get(entity_id, {}))
+        result = {}
+        for channel_id, (stamps, _) in by_channel.items():
+            if channel_id in channel_ids:
+                count = len(stamps) - bisect_right(stamps, cutoff)
+                if count:
+                    result[channel_id] = count
+        return result
+
+    def mentions(self, entity_id: str, hours: float, channel_ids, now: Optional[float] = None) -> List[Tuple[float, str, dict]]:
+        """Сообщения с сущностью за окно: (время, канал, сообщение), новые первыми"""
+        cutoff = (now if now is not None else time.time()) - hours * 3600
+        with self.lock:
+            by_channel = dict(self.postings.get(entity_id, {}))
+        found = []
+        for channel_id, (stamps, messages) in by_channel.items():
+            if channel_id in channel_ids:
+                start = bisect_right(stamps, cutoff)
+                found.extend((stamps[i], channel_id, messages[i]) for i in range(start, len(stamps)))
+        found.sort(key=lambda item: item[0], reverse=True)
+        return found
@@ -0,0 +1,205 @@
+"""Extractive-суммаризатор: ранжирование предложений в стиле TextRank с LRU-кэшем"""
+import re
+import math
+import hashlib
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+# Сокращения, после которых точка не означает конец предложения
+RUSSIAN_ABBREVIATIONS = frozenset([
+    'т', 'е', 'к', 'д', 'п', 'г', 'гг', 'в', 'вв', 'ул', 'им', 'тыс', 'млн', 'млрд', 'трлн',
+    'руб', 'долл', 'коп', 'н', 'э', 'др', 'пр', 'см', 'стр', 'св', 'проф', 'акад', 'ген',
+    'тел', 'обл', 'р', 'пос', 'с', 'ст', 'дер', 'просп', 'пер', 'наб', 'корп', 'кв', 'мин',
+    'сек', 'ч', 'чел', 'ок', 'прим', 'ред', 'англ', 'рус', 'лат', 'напр', 'мл', 'ср', 'зам',
+    'гос', 'экс', 'mr', 'mrs', 'dr', 'vs', 'etc', 'inc', 'ltd', 'co',
+])
+
+# Сокращения единиц, валют и перечислений стоят в конце фразы ("вырос до 100 руб. Это...").
+# После них точка - конец предложения, если следующее слово с заглавной буквы;
+# остальные сокращения ("г. Москва", "т. е.") стоят перед словом и предложение не завершают
+TERMINAL_ABBREVIATIONS = frozenset([
+    'тыс', 'млн', 'млрд', 'трлн', 'руб', 'долл', 'коп', 'р', 'мин', 'сек', 'ч', 'чел',
+    'гг', 'вв', 'др', 'пр', 'etc', 'inc', 'ltd', 'co',
+])
+_NEXT_WORD_PREFIX = '"«(-—– '
+
+STOP_WORDS = frozenset((
+    'и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по '
+    'только ее мне было вот от меня еще нет о из ему теперь когда даже ну вдруг ли если '
+    'уже или ни быть был него до вас нибудь опять уж вам ведь там потом себя ничего ей '
+    'может они тут где есть надо ней для мы тебя их чем была сам чтоб без будто чего раз '
+    'тоже себе под будет ж тогда кто этот того потому этого какой совсем ним здесь этом '
+    'один почти мой тем чтобы нее сейчас были куда зачем всех никогда можно при наконец '
+    'два об другой хоть после над больше тот через эти нас про всего них какая много '
+    'разве три эту моя впрочем хорошо свою этой перед иногда лучше чуть том нельзя такой '
+    'им более всегда конечно всю между это также который которые которая которое заявил '
+    'сообщил сообщает стало года году'
+).split())
+
+# Кандидат на границу предложения: знаки конца, пробелы и начало следующего предложения
+_BOUNDARY_RE = re.compile(r'([.!?…]+)(["»)]*)\s+(?=["«(\-—–]?\s*[A-ZА-ЯЁ0-9])')
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+MAX_SENTENCE_WORDS = 25
+SHORT_TEXT_WORDS = 12
+TRUNCATE_WORDS = 15
+
+
+@lru_cache(maxsize=4096)
+def split_sentences(text: str) -> Tuple[str, ...]:
+    """Делит текст на предложения, не разрывая сокращения ("т.е.", "г. Москва") и инициалы ("В. Путин")"""
+    sentences = []
+    start = 0
+    for match in _BOUNDARY_RE.finditer(text):
+        punctuation = match.group(1)
+        if punctuation == '.':
+            preceding = text[start:match.start()].split()
+            last_token = preceding[-1].lower().rstrip('.') if preceding else ''
+            last_word = last_token.split('.')[-1]
+            if last_word in TERMINAL_ABBREVIATIONS:
+                # "100 руб. Это" - конец предложения, "5 млн. 300 тыс." - нет
+                next_char = text[match.end():].lstrip(_NEXT_WORD_PREFIX)[:1]
+                if not (next_char.isalpha() and next_char.isupper()):
+                    continue
+            # Сокращение или инициал (одна заглавная буква) - не конец предложения
+            elif last_word in RUSSIAN_ABBREVIATIONS or (len(last_word) == 1 and preceding[-1][-1:].isupper()):
+                continue
+        end = match.end(2)
+        sentence = text[start:end].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+    tail = text[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return tuple(sentences)
+
+
+def _sentence_terms(sentence: str) -> frozenset:
+    """Нормализованные термы предложения: без стоп-слов, с грубым стеммингом по префиксу"""
+    terms = set()
+    for word in _WORD_RE.findall(sentence.lower()):
+        if word in STOP_WORDS or len(word) < 3:
+            continue
+        terms.add(word[:6] if not word.isdigit() else word)
+    return frozenset(terms)
+
+
+def rank_sentences(sentences: Tuple[str, ...], damping: float = 0.85,
+                   iterations: int = 30, tolerance: float = 1e-4) -> List[float]:
+    """TextRank: PageRank по графу предложений, вес ребра - нормированное пересечение термов"""
+    count = len(sentences)
+    if count <= 1:
+        return [1.0] * count
+
+    terms = [_sentence_terms(s) for s in sentences]
+    weights = [[0.0] * count for _ in range(count)]
+    for i in range(count):
+        if len(terms[i]) < 2:
+            continue
+        for j in range(i + 1, count):
+            if len(terms[j]) < 2:
+                continue
+            overlap = len(terms[i] & terms[j])
+            if overlap:
+                similarity = overlap / (math.log(len(terms[i])) + math.log(len(terms[j])))
+                weights[i][j] = weights[j][i] = similarity
+
+    out_sums = [sum(row) for row in weights]
+    scores = [1.0 / count] * count
+    for _ in range(iterations):
+        new_scores = []
+        for i in range(count):
+            rank = sum(weights[j][i] / out_sums[j] * scores[j] for j in range(count) if weights[j][i])
+            new_scores.append((1 - damping) / count + damping * rank)
+        delta = sum(abs(a - b) for a, b in zip(new_scores, scores))
+        scores = new_scores
+        if delta < tolerance:
+            break
+    return scores
+
+
+def _finish(sentence: str) -> str:
+    if not sentence.endswith(('.', '!', '?', '…')):
+        sentence += '.'
+    return sentence
+
+
+def _truncate_words(text: str, limit: int = TRUNCATE_WORDS) -> str:
+    return _finish(' '.join(text.split()[:limit]))
+
+
+def summarize_text(text: str) -> str:
+    """Выбирает самое центральное предложение новости (без кэша)"""
+    text = text.strip()
+    if len(text.split()) <= SHORT_TEXT_WORDS:
+        return _finish(text)
+
+    sentences = split_sentences(text)
+    if not sentences:
+        return _truncate_words(text)
+
+    scores = rank_sentences(sentences)
+    # В новостях главное обычно в начале - небольшой бонус за позицию
+    ranked = sorted(
+        range(len(sentences)),
+        key=lambda i: scores[i] * (1.0 + 0.3 / (i + 1)),
+        reverse=True,
+    )
+    for index in ranked:
+        sentence = sentences[index]
+        words = len(sentence.split())
+        if 4 <= words <= MAX_SENTENCE_WORDS:
+            return _finish(sentence)
+
+    return _truncate_words(sentences[ranked[0]])
+
+
+class SummaryLRU:
+    """Ограниченный LRU-кэш резюме по хэшу содержимого"""
+
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self._items: 'OrderedDict[bytes, str]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @staticmethod
+    def key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+    def get(self, key: bytes) -> Optional[str]:
+        summary = self._items.get(key)
+        if summary is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return summary
+
+    def put(self, key: bytes, summary: str):
+        self._items[key] = summary
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
+        self.hits = self.misses = 0
+
+
+summary_cache = SummaryLRU()
+
+
+def smart_summarize(text: str) -> str:
+    """Умно сокращает новость до одного ключевого предложения; повторные вызовы берутся из кэша"""
+    key = SummaryLRU.key(text)
+    summary = summary_cache.get(key)
+    if summary is None:
+        summary = summarize_text(text)
+        summary_cache.put(key, summary)
+    return summary
@@ -0,0 +1,78 @@
+"""Готовые ответы для inline-режима (@bot дайджест, @bot <слово>).
+
+Telegram ждет ответ на inline-запрос считанные секунды, поэтому ответы берутся только из
+памяти: после каждого изменения хранилища бот в фоне пересобирает снимок - тексты
+дайджестов и новости за сутки, отсортированные по резонансности. Поиск идет по снимку
+(все слова запроса должны встретиться в тексте), результаты запросов кэшируются до
+следующего снимка. cache_time для Telegram - сколько снимок еще будет актуален.
+"""
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+MIN_CACHE_TIME = 5  # пока снимок пересобирается, клиенты не должны держать старые ответы
+MAX_CACHE_TIME = 300
+
+
+class InlineAnswerCache:
+    """Снимок ответов, построенный из версии хранилища version"""
+
+    def __init__(self, max_queries: int = 512, max_results: int = 10):
+        self.max_queries = max_queries
+        self.max_results = max_results
+        self.lock = threading.Lock()
+        self.version: Optional[int] = None
+        self.digests: Dict[str, str] = {}
+        self.stories: List[dict] = []  # {'channel', 'text', 'lower', 'score'} по убыванию резонансности
+        self.built_at: Optional[float] = None
+        self.expires_at: Optional[float] = None
+        self._queries: 'OrderedDict[str, List[dict]]' = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def update(self, version: int, digests: Dict[str, str], stories: List[dict], expires_at: float):
+        """Заменяет снимок целиком; результаты прежних запросов сбрасываются"""
+        with self.lock:
+            self.version = version
+            self.digests = digests
+            self.stories = stories
+            self.built_at = time.time()
+            self.expires_at = expires_at
+            self._queries.clear()
+
+    def is_current(self, version: int) -> bool:
+        return self.version == version
+
+    def search(self, query: str) -> List[dict]:
+        """Новости снимка, где есть все слова запроса, - самые резонансные первыми"""
+        words = query.lower().split()
+        if not words:
+            return []
+        key = ' '.join(words)
+        with self.lock:
+            cached = self._queries.get(key)
+            if cached is not None:
+                self._queries.move_to_end(key)
+                self.stats['hits'] += 1
+                return cached
+            stories = self.stories
+        found = []
+        for story in stories:
+            if all(word in story['lower'] for word in words):
+                found.append(story)
+                if len(found) >= self.max_results:
+                    break
+        with self.lock:
+            self.stats['misses'] += 1
+            if stories is self.stories:  # снимок не заменили, пока искали
+                self._queries[key] = found
+                if len(self._queries) > self.max_queries:
+                    self._queries.popitem(last=False)
+        return found
+
+    def cache_time(self, version: int, now: Optional[float] = None) -> int:
+        """Сколько секунд Telegram может держать ответ: до ожидаемого обновления снимка"""
+        if not self.is_current(version) or self.expires_at is None or not (self.digests or self.stories):
+            return MIN_CACHE_TIME
+        now = now if now is not None else time.time()
+        return int(min(MAX_CACHE_TIME, max(MIN_CACHE_TIME, self.expires_at - now)))
@@ -0,0 +1,165 @@
+"""Журнал плановых задач: состояние каждого слота переживает перезапуск.
+
+Слот - задача и плановое время ('digest' в 07:00, 'subscribers' в 13:00). Он проходит
+состояния pending -> running -> sent (или failed, если запуск не удался). Записи
+дописываются в JSONL (последняя запись слота главная) и сжимаются при загрузке. После
+запуска по журналу находятся пропущенные слоты: плановое время прошло не раньше grace
+секунд назад, а слот не отправлен. Отправленный слот повторно не запускается.
+
+Журнал не знает, какие сообщения слота успели уйти до падения посреди рассылки: для
+этого сообщения ставятся в очередь доставки с ключами идемпотентности (ключ слота и чат,
+см. DeliveryQueue.enqueue), и повторный запуск слота не дублирует уже принятые.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def slot_start(ts: float) -> float:
+    """Начало часа (по локальному времени процесса, как в schedule), в котором лежит ts"""
+    return datetime.fromtimestamp(ts).replace(minute=0, second=0, microsecond=0).timestamp()
+
+
+def slot_key(job: str, planned_at: float) -> str:
+    return f"{job}:{datetime.fromtimestamp(planned_at).strftime('%Y-%m-%dT%H:%M')}"
+
+
+def slot_times(hours: Iterable[int], start: float, end: float) -> List[float]:
+    """Плановые моменты HH:00 с часом из hours в промежутке (start, end], по времени"""
+    hours = set(hours)
+    times = []
+    planned_at = slot_start(end)
+    while planned_at > start:
+        if datetime.fromtimestamp(planned_at).hour in hours:
+            times.append(planned_at)
+        planned_at = slot_start(planned_at - 1)
+    return sorted(times)
+
+
+class JobLedger:
+    """Журнал слотов: ключ слота -> {'key', 'job', 'planned_at', 'status', 'attempts', ...}"""
+
+    def __init__(self, path: str, max_attempts: int = 3, retention_days: float = 7):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retention = retention_days * 86400
+        self.lock = threading.Lock()
+        self.slots: Dict[str, dict] = {}
+        self.active = set()  # слоты, которые выполняются в этом процессе
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # строка, недописанная при остановке
+                    self.slots[record['key']] = record
+        except OSError as e:
+            logger.error(f"Ошибка чтения журнала задач {self.path}: {e}")
+            return
+        interrupted = [slot for slot in self.slots.values() if slot['status'] == 'running']
+        for slot in interrupted:
+            logger.warning(f"Слот {slot['key']} прерван перезапуском (попытка {slot['attempts']})")
+        self._compact()
+
+    def _compact(self):
+        """Переписывает журнал: одна запись на слот, старые слоты удаляются"""
+        horizon = time.time() - self.retention
+        self.slots = {key: slot for key, slot in self.slots.items() if slot['planned_at'] >= horizon}
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for slot in sorted(self.slots.values(), key=lambda slot: slot['planned_at']):
+                    f.write(json.dumps(slot, ensure_ascii=False) + '\n')
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Ошибка записи журнала задач {self.path}: {e}")
+
+    def _write(self, slot: dict):
+        slot['updated_at'] = round(time.time(), 3)
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(slot, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            logger.error(f"Ошибка записи журнала задач {self.path}: {e}")
+
+    def _slot(self, job: str, planned_at: float) -> dict:
+        key = slot_key(job, planned_at)
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = {'key': key, 'job': job, 'planned_at': planned_at, 'status': 'pending', 'attempts': 0}
+            self.slots[key] = slot
+        return slot
+
+    def plan(self, job: str, planned_at: float) -> dict:
+        """Записывает будущий слот как pending (если его еще нет в журнале)"""
+        with self.lock:
+            slot = self._slot(job, planned_at)
+            if 'updated_at' not in slot:
+                self._write(slot)
+            return dict(slot)
+
+    def begin(self, job: str, planned_at: float) -> Optional[str]:
+        """Отмечает запуск слота; None - слот уже отправлен, выполняется или исчерпал попытки"""
+        with self.lock:
+            slot = self._slot(job, planned_at)
+            if slot['status'] == 'sent' or slot['key'] in self.active or slot['attempts'] >= self.max_attempts:
+                return None
+            slot['status'] = 'running'
+            slot['attempts'] += 1
+            slot.pop('error', None)
+            self.active.add(slot['key'])
+            self._write(slot)
+            return slot['key']
+
+    def finish(self, key: str, ok: bool, error: str = ''):
+        """Отмечает завершение слота: sent или failed с текстом ошибки"""
+        with self.lock:
+            slot = self.slots.get(key)
+            self.active.discard(key)
+            if slot is None:
+                return
+            slot['status'] = 'sent' if ok else 'failed'
+            if error:
+                slot['error'] = error[:200]
+            self._write(slot)
+
+    def status(self, job: str, planned_at: float) -> Optional[str]:
+        with self.lock:
+            slot = self.slots.get(slot_key(job, planned_at))
+            return slot['status'] if slot else None
+
+    def missed(self, job: str, hours: Iterable[int], grace: float, now: Optional[float] = None) -> List[float]:
+        """Плановые моменты задачи за последние grace секунд, которые еще нужно выполнить.
+        Слоты, которых нет в журнале, не досылаются: без журнала (новый или потерянный
+        DATA_DIR) неизвестно, не отправил ли их прежний процесс."""
+        now = now if now is not None else time.time()
+        missed = []
+        with self.lock:
+            for planned_at in slot_times(hours, now - grace, now):
+                slot = self.slots.get(slot_key(job, planned_at))
+                if (slot is not None and slot['status'] != 'sent' and slot['key'] not in self.active
+                        and slot['attempts'] < self.max_attempts):
+                    missed.append(planned_at)
+        return missed
+
+    def recent(self, limit: int = 10) -> List[dict]:
+        """Последние слоты по плановому времени, новые первыми"""
+        with self.lock:
+            slots = sorted(self.slots.values(), key=lambda slot: slot['planned_at'], reverse=True)
+            return [dict(slot) for slot in slots[:limit]]
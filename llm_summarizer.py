@@ -0,0 +1,205 @@
+"""Пакетная суммаризация новостей через OpenAI-совместимый API с дисковым кэшем"""
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = (
+    "Ты редактор новостной сводки. Для каждой новости из списка напиши одно "
+    "предложение на русском языке, не длиннее {max_words} слов, без ссылок и эмодзи. "
+    "Ответь только JSON-объектом вида {{\"<id>\": \"<резюме>\"}}."
+)
+
+
+def normalize_text(text: str) -> str:
+    """Нормализует текст для ключа кэша: регистр и пробелы не влияют на ключ"""
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def text_key(text: str) -> str:
+    """Ключ кэша - SHA-256 от нормализованного текста"""
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов (для кириллицы ~3 символа на токен)"""
+    return max(1, len(text) // 3)
+
+
+class SummaryCache:
+    """Дисковый кэш резюме: хэш текста -> резюме, хранится в JSONL"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._data: Dict[str, str] = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        self._data[record['key']] = record['summary']
+                    except (ValueError, KeyError):
+                        continue
+            logger.info(f"Загружено {len(self._data)} резюме из кэша {self.path}")
+        except OSError as e:
+            logger.warning(f"Не удалось прочитать кэш резюме {self.path}: {e}")
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[str]:
+        return self._data.get(key)
+
+    def put_many(self, items: Dict[str, str]):
+        """Сохраняет резюме в память и дописывает их в файл"""
+        new_items = {k: v for k, v in items.items() if self._data.get(k) != v}
+        if not new_items:
+            return
+        self._data.update(new_items)
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for key, summary in new_items.items():
+                    f.write(json.dumps({'key': key, 'summary': summary}, ensure_ascii=False) + '\n')
+        except OSError as e:
+            logger.warning(f"Не удалось записать кэш резюме {self.path}: {e}")
+
+
+class LLMSummarizer:
+    """Суммаризатор: пачки новостей под бюджет токенов, параллельные запросы, кэш и fallback"""
+
+    def __init__(self, api_key: Optional[str], model: str, cache: SummaryCache,
+                 fallback: Callable[[str], str], base_url: Optional[str] = None,
+                 token_budget: int = 3000, max_concurrency: int = 4,
+                 timeout: float = 20.0, max_words: int = 12,
+                 max_story_chars: int = 1500, failure_cooldown: float = 300.0):
+        self.api_key = api_key
+        self.model = model
+        self.cache = cache
+        self.fallback = fallback
+        self.base_url = base_url
+        self.token_budget = token_budget
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_words = max_words
+        self.max_story_chars = max_story_chars
+        self.failure_cooldown = failure_cooldown
+        self._disabled_until = 0.0
+        self.stats = {'requests': 0, 'failures': 0, 'cache_hits': 0, 'llm_summaries': 0, 'fallbacks': 0}
+
+    def _make_batches(self, items: List[tuple]) -> List[List[tuple]]:
+        """Жадно собирает пачки (key, text) так, чтобы каждая укладывалась в бюджет токенов"""
+        overhead = estimate_tokens(SYSTEM_PROMPT) + 20
+        batches = []
+        current = []
+        current_tokens = overhead
+        for key, text in items:
+            # На вход уходит текст, на выход - резюме примерно из max_words слов
+            cost = estimate_tokens(text) + self.max_words * 3 + 10
+            if current and current_tokens + cost > self.token_budget:
+                batches.append(current)
+                current = []
+                current_tokens = overhead
+            current.append((key, text))
+            current_tokens += cost
+        if current:
+            batches.append(current)
+        return batches
+
+    async def _request(self, client, batch: List[tuple]) -> Dict[str, str]:
+        """Отправляет одну пачку в модель и возвращает {key: резюме}"""
+        ids = {str(i): key for i, (key, _) in enumerate(batch)}
+        payload = [{'id': str(i), 'text': text} for i, (_, text) in enumerate(batch)]
+        self.stats['requests'] += 1
+        response = await client.chat.completions.create(
+            model=self.model,
+            temperature=0,
+            messages=[
+                {'role': 'system', 'content': SYSTEM_PROMPT.format(max_words=self.max_words)},
+                {'role': 'user', 'content': json.dumps(payload, ensure_ascii=False)},
+            ],
+        )
+        content = response.choices[0].message.content or ''
+        # Модели иногда оборачивают JSON в markdown-блок
+        content = re.sub(r'^```(?:json)?\s*|\s*```$', '', content.strip())
+        answers = json.loads(content)
+
+        result = {}
+        for item_id, summary in answers.items():
+            key = ids.get(str(item_id))
+            if key and isinstance(summary, str) and summary.strip():
+                result[key] = ' '.join(summary.split())
+        return result
+
+    async def _run_batch(self, client, batch: List[tuple], semaphore: asyncio.Semaphore) -> Dict[str, str]:
+        async with semaphore:
+            if time.monotonic() < self._disabled_until:
+                return {}
+            try:
+                result = await asyncio.wait_for(self._request(client, batch), timeout=self.timeout)
+            except Exception as e:
+                # Модель недоступна или медленная - временно отключаем её, дальше работает fallback
+                self.stats['failures'] += 1
+                self._disabled_until = time.monotonic() + self.failure_cooldown
+                logger.warning(f"LLM-суммаризация недоступна ({type(e).__name__}: {e}), используем extractive fallback")
+                return {}
+        self.cache.put_many(result)
+        return result
+
+    def summarize_cached(self, texts: List[str]) -> List[str]:
+        """Резюме без обращения к модели: из кэша, иначе запасным способом. Статистику не трогает"""
+        output = []
+        for text in texts:
+            cached = self.cache.get(text_key(text))
+            output.append(cached if cached is not None else self.fallback(text))
+        return output
+
+    async def summarize_many(self, texts: List[str]) -> List[str]:
+        """Возвращает резюме для каждого текста в исходном порядке"""
+        keys = [text_key(text) for text in texts]
+        summaries: Dict[str, str] = {}
+        pending = {}
+
+        for key, text in zip(keys, texts):
+            cached = self.cache.get(key)
+            if cached is not None:
+                summaries[key] = cached
+                self.stats['cache_hits'] += 1
+            elif key not in pending:
+                pending[key] = text[:self.max_story_chars]
+
+        if pending and time.monotonic() >= self._disabled_until:
+            batches = self._make_batches(list(pending.items()))
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            # openai импортируется около 0.3-0.5 с, поэтому только при первом обращении к модели
+            import openai
+            # Клиент создаем на каждый вызов: планировщик запускает задачи в разных event loop
+            async with httpx.AsyncClient(timeout=self.timeout) as http_client:
+                client = openai.AsyncOpenAI(api_key=self.api_key or 'unused', base_url=self.base_url,
+                                            http_client=http_client, max_retries=0)
+                results = await asyncio.gather(*(self._run_batch(client, batch, semaphore) for batch in batches))
+            for result in results:
+                summaries.update(result)
+                self.stats['llm_summaries'] += len(result)
+
+        output = []
+        for key, text in zip(keys, texts):
+            summary = summaries.get(key)
+            if summary is None:
+                self.stats['fallbacks'] += 1
+                summary = self.fallback(text)
+            output.append(summary)
+        return output
@@ -1,21 +1,54 @@
 import os
+import io
+import csv
 import logging
 import json
 import time
 import asyncio
-import requests
-import schedule
+import signal
 import threading
+import secrets
+import contextlib
 from datetime import datetime, timedelta, timezone
 from typing import Dict, List, Optional
-from collections import defaultdict
+from collections import defaultdict, deque
 import re
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
-import openai
+from telegram import ChatMember, Update, InlineQueryResultArticle, InputTextMessageContent
+from telegram.ext import (Application, CallbackQueryHandler, ChatMemberHandler, CommandHandler, ContextTypes,
+                          InlineQueryHandler, MessageHandler, filters)
+from telegram.error import BadRequest
 from dotenv import load_dotenv
 
+from llm_summarizer import LLMSummarizer, SummaryCache
+from extractive_summarizer import smart_summarize
+from text_analysis import HIGH_RESONANCE_KEYWORDS, calculate_resonance_score, find_countries, is_promotional
+from trends import TrendStore, sparkline
+from burst_detector import BurstDetector
+from digest_engine import DigestSelection, WindowAnalysis, analyze_window
+from subscriptions import DIGEST_STYLES, SubscriptionStore
+from collector import extract_features, normalize_channel_ref, run_collection, validate_channels
+from profiler import PROFILE_TARGETS, Profiler
+import tracing
+from tracing import TraceStore, start_trace
+from metrics import COUNT_BUCKETS, registry as metrics_registry, start_metrics_server
+from webhook_server import WebhookServer
+from update_processor import PerChatUpdateProcessor
+from worker_pool import WorkerPool, check_cancelled
+from sharded_analysis import ShardedAnalyzer
+from novelty import NoveltyFilter
+from page_archive import PageArchive, reparse_archive
+from cluster import ClusterNode, ClusterStore
+from job_ledger import JobLedger, slot_key, slot_times
+from windows import RollingWindows
+from entities import KIND_LABELS, EntityIndex, get_gazetteer, top_by_kind
+from inline_cache import InlineAnswerCache
+import channel_menu
+from channel_menu import (decode_callback as decode_channel_callback, filter_channels, page_channels,
+                          render_menu as render_channel_menu, resolve_channel)
+from delivery import (DeliveryQueue, PRIORITY_ALERT, PRIORITY_BULK, PRIORITY_DIGEST, PRIORITY_INTERACTIVE,
+                      TELEGRAM_MESSAGE_LIMIT)
+
 # Загружаем переменные окружения
 load_dotenv()
 
@@ -31,14 +64,93 @@ TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 ADMIN_USER_ID = int(os.getenv('ADMIN_USER_ID', 0))
 DIGEST_CHANNEL_ID = os.getenv('DIGEST_CHANNEL_ID', '')  # ID канала для публикации дайджестов
+DATA_DIR = os.getenv('DATA_DIR', 'data')  # каталог для кэшей и служебных файлов
+
+# Настройки LLM-суммаризации (OpenAI или любой совместимый сервер)
+LLM_SUMMARIES_ENABLED = os.getenv('LLM_SUMMARIES_ENABLED', '1' if OPENAI_API_KEY else '0') == '1'
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None  # например, http://127.0.0.1:8089/v1 для локального сервера
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+LLM_BATCH_TOKEN_BUDGET = int(os.getenv('LLM_BATCH_TOKEN_BUDGET', 3000))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 4))
+LLM_TIMEOUT_SECONDS = float(os.getenv('LLM_TIMEOUT_SECONDS', 20))
+TREND_HOURS = int(os.getenv('TREND_HOURS', 168))  # глубина почасовых трендов (по умолчанию неделя)
+
+# Срочные алерты о всплесках между плановыми дайджестами
+BURST_ALERTS_ENABLED = os.getenv('BURST_ALERTS_ENABLED', '1') == '1'
+BURST_POLL_MINUTES = int(os.getenv('BURST_POLL_MINUTES', 10))  # как часто опрашивать каналы ради алертов
+BURST_COOLDOWN_MINUTES = int(os.getenv('BURST_COOLDOWN_MINUTES', 30))  # пауза между алертами по одной теме
+
+# Часы плановых дайджестов в канал и предварительный сбор перед ними
+DIGEST_HOURS = [7, 9, 11, 13, 15, 17, 19, 21]
+PREFETCH_LEAD_MINUTES = int(os.getenv('PREFETCH_LEAD_MINUTES', 5))  # за сколько минут до слота собирать сообщения
+PREFETCH_MAX_AGE_MINUTES = int(os.getenv('PREFETCH_MAX_AGE_MINUTES', 10))  # данные моложе этого считаются свежими
+SLOT_GRACE_MINUTES = int(os.getenv('SLOT_GRACE_MINUTES', 90))  # насколько давние пропущенные слоты досылать
+SLOT_MAX_ATTEMPTS = int(os.getenv('SLOT_MAX_ATTEMPTS', 3))  # попыток на слот, включая досылку
+
+# Конвейер сбора сообщений из веб-версии каналов
+TELEGRAM_WEB_BASE_URL = os.getenv('TELEGRAM_WEB_BASE_URL', 'https://t.me')
+COLLECT_CONCURRENCY = int(os.getenv('COLLECT_CONCURRENCY', 8))  # одновременных загрузок страниц
+COLLECT_QUEUE_SIZE = int(os.getenv('COLLECT_QUEUE_SIZE', 4))  # буфер между стадиями конвейера
+IMPORT_CONCURRENCY = int(os.getenv('IMPORT_CONCURRENCY', 32))  # одновременных проверок при импорте каналов
+MAX_IMPORT_CHANNELS = int(os.getenv('MAX_IMPORT_CHANNELS', 1000))  # каналов за один импорт
+MAX_IMPORT_FILE_BYTES = 256 * 1024
+
+# Очередь доставки исходящих сообщений
+DELIVERY_WORKERS = int(os.getenv('DELIVERY_WORKERS', 8))
+DELIVERY_GLOBAL_RATE = float(os.getenv('DELIVERY_GLOBAL_RATE', 30))  # сообщений в секунду на всего бота
+
+# Метрики в формате Prometheus (METRICS_PORT=0 - выключено)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9108))
+
+# Режим вебхука вместо опроса: включается, если задан публичный WEBHOOK_URL
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')  # например, https://bot.example.com
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', os.getenv('PORT', 8080)))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN') or secrets.token_urlsafe(32)
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL', '')  # свой Bot API, например http://127.0.0.1:8081
+
+# Параллельная обработка: обновления разных чатов идут одновременно, тяжелый анализ - в пуле потоков
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', 32))  # одновременно обрабатываемых обновлений
+DIGEST_WORKERS = int(os.getenv('DIGEST_WORKERS', 2))  # потоков для анализа и рендера дайджестов
+ANALYSIS_PROCESSES = int(os.getenv('ANALYSIS_PROCESSES', 0))  # процессов для больших окон (0 - выключено)
+PARALLEL_ANALYSIS_MIN_MESSAGES = int(os.getenv('PARALLEL_ANALYSIS_MIN_MESSAGES', 20000))  # с какого окна включать
+
+# Память опубликованных новостей: повторы опускаются в топе или помечаются 🔁
+NOVELTY_ENABLED = os.getenv('NOVELTY_ENABLED', '1') == '1'
+NOVELTY_MEMORY_HOURS = float(os.getenv('NOVELTY_MEMORY_HOURS', 48))  # сколько помнить опубликованное
+NOVELTY_REPEAT_PENALTY = float(os.getenv('NOVELTY_REPEAT_PENALTY', 0.5))  # множитель резонансности повтора
+
+# Архив сырых страниц каналов для повторного разбора (ARCHIVE_MAX_MB=0 - выключен)
+ARCHIVE_MAX_MB = float(os.getenv('ARCHIVE_MAX_MB', 200))
+ARCHIVE_CODEC = os.getenv('ARCHIVE_CODEC', 'auto')  # zstd (если установлен zstandard) или gzip
+ARCHIVE_RESTORE_HOURS = float(os.getenv('ARCHIVE_RESTORE_HOURS', 24))  # 0 - не восстанавливать при запуске
+
+# Кластер: несколько процессов делят сбор каналов через аренды в общей SQLite (пусто - один процесс)
+CLUSTER_DB = os.getenv('CLUSTER_DB', '')
+CLUSTER_WORKER_ID = os.getenv('CLUSTER_WORKER_ID', '')  # по умолчанию <хост>-<pid>
+CLUSTER_SHARDS = int(os.getenv('CLUSTER_SHARDS', 64))
+CLUSTER_LEASE_SECONDS = float(os.getenv('CLUSTER_LEASE_SECONDS', 30))
+CLUSTER_COLLECT_MINUTES = float(os.getenv('CLUSTER_COLLECT_MINUTES', 5))  # плановый сбор своих шардов
+CLUSTER_COLLECT_TIMEOUT = float(os.getenv('CLUSTER_COLLECT_TIMEOUT', 120))  # ожидание внеочередного сбора
+
+# Окна, которые хранилище поддерживает готовыми (остальные считаются перебором сообщений)
+ROLLING_WINDOW_HOURS = [int(hours) for hours in os.getenv('ROLLING_WINDOW_HOURS', '1,3,6,24').split(',') if hours.strip()]
+
+# Inline-режим: ответы из снимка, который пересобирается в фоне после изменения хранилища
+INLINE_STORIES = int(os.getenv('INLINE_STORIES', 2000))  # сколько новостей за сутки держать для поиска
+INLINE_REFRESH_DELAY = 2.0  # сбор меняет каналы по одному - снимок строим, когда изменения затихли
+
+# Сущности (страны, персоны, организации): блок «В ФОКУСЕ» в дайджестах и команда /who
+ENTITY_SECTION_SIZE = 3  # сущностей каждого вида в блоке дайджеста
+WHO_HOURS = 24  # окно для /who
+WHO_MENTIONS = 5  # последних упоминаний в ответе /who
 
 # Настройка часового пояса для Португалии
 # Португалия: WET (UTC+0) зимой, WEST (UTC+1) летом
 PORTUGAL_TIMEZONE = timezone(timedelta(hours=1))  # Используем UTC+1 как основной
 
-# Инициализация OpenAI
-openai.api_key = OPENAI_API_KEY
-
 # Хранилище данных
 class MessageStore:
     def __init__(self):
@@ -46,27 +158,62 @@ class MessageStore:
         self.channels = {}  # channel_id -> channel_info
         self.monitored_channels = set()  # каналы для мониторинга
         self.user_states = {}  # состояния пользователей для интерфейса
+        self.last_collected_at = None  # время последнего завершенного сбора (Unix)
+        self.windows = RollingWindows(ROLLING_WINDOW_HOURS, PORTUGAL_TIMEZONE)  # готовые окна по каналам
+        self.entities = EntityIndex(PORTUGAL_TIMEZONE)  # сущность -> упоминания по каналам
+        self.version = 0  # растет при каждом изменении сообщений или набора каналов
+        self.listeners = []  # функции без аргументов, вызываются после изменения (из любого потока)
+    
+    def _changed(self):
+        self.version += 1
+        for listener in self.listeners:
+            listener()
     
     def add_message(self, channel_id: str, message_data: dict):
         """Добавляет сообщение в хранилище"""
         self.messages[channel_id].append(message_data)
-    
-    def get_messages_for_period(self, hours: int = 24) -> Dict[str, List[dict]]:
-        """Получает сообщения за указанный период"""
+        self.windows.append(channel_id, message_data)
+        self.entities.append(channel_id, message_data)
+        self._changed()
+    
+    def set_channel_messages(self, channel_id: str, messages: List[dict]):
+        """Заменяет все сообщения канала и пересчитывает его окна и упоминания сущностей"""
+        self.messages[channel_id] = messages
+        self.windows.set_channel(channel_id, messages)
+        self.entities.set_channel(channel_id, messages)
+        self._changed()
+    
+    def count_messages_for_period(self, hours: int = 24, channel_ids=None) -> Dict[str, int]:
+        """Число сообщений за период по каналам, у которых они есть"""
+        if channel_ids is None:
+            channel_ids = self.monitored_channels
+        if self.windows.covers(hours):
+            return self.windows.counts(hours, channel_ids)
+        return {channel_id: len(messages)
+                for channel_id, messages in self.get_messages_for_period(hours, channel_ids).items()}
+    
+    def get_messages_for_period(self, hours: int = 24, channel_ids=None) -> Dict[str, List[dict]]:
+        """Получает сообщения за указанный период (по умолчанию - из отслеживаемых каналов).
+        Для окон из ROLLING_WINDOW_HOURS возвращает готовые списки - их нельзя изменять."""
+        if channel_ids is None:
+            channel_ids = self.monitored_channels
+        if self.windows.covers(hours):
+            return self.windows.select(hours, channel_ids)
+        
         # Используем португальское время
         now = datetime.now(PORTUGAL_TIMEZONE)
         cutoff_time = now - timedelta(hours=hours)
         filtered_messages = {}
         
         for channel_id, messages in self.messages.items():
-            if channel_id in self.monitored_channels:
+            if channel_id in channel_ids:
                 recent_messages = []
                 for msg in messages:
                     try:
-                        # Парсим время и приводим к naive datetime
+                        # Парсим время и приводим к naive datetime по португальскому времени
                         msg_time = datetime.fromisoformat(msg['timestamp'])
                         if msg_time.tzinfo is not None:
-                            msg_time = msg_time.replace(tzinfo=None)
+                            msg_time = msg_time.astimezone(PORTUGAL_TIMEZONE).replace(tzinfo=None)
                         
                         # Конвертируем в португальское время для сравнения
                         if msg_time > cutoff_time.replace(tzinfo=None):
@@ -85,10 +232,12 @@ class MessageStore:
         """Добавляет канал для мониторинга"""
         self.channels[channel_id] = channel_info
         self.monitored_channels.add(channel_id)
+        self._changed()
     
     def remove_channel(self, channel_id: str):
         """Удаляет канал из мониторинга"""
         self.monitored_channels.discard(channel_id)
+        self._changed()
     
     def get_monitored_channels(self) -> List[dict]:
         """Возвращает список отслеживаемых каналов"""
@@ -110,6 +259,160 @@ class MessageStore:
 # Глобальное хранилище
 message_store = MessageStore()
 
+# Почасовые тренды категорий, стран и ключевых слов
+trend_store = TrendStore(TREND_HOURS)
+
+# Детектор всплесков и события, ожидающие отправки алерта
+burst_detector = BurstDetector(
+    keywords=dict.fromkeys(HIGH_RESONANCE_KEYWORDS),
+    cooldown=BURST_COOLDOWN_MINUTES * 60,
+    global_cooldown=BURST_COOLDOWN_MINUTES * 60 / 2,
+)
+pending_burst_events = []
+
+# Файловые хранилища (подписки, журнал слотов, память опубликованных новостей) читаются
+# при первом обращении, а не при импорте: до первой команды бот не трогает диск
+lazy_stores_lock = threading.Lock()
+
+# Персональные подписки на дайджесты
+subscription_store: Optional[SubscriptionStore] = None
+
+def get_subscription_store() -> SubscriptionStore:
+    global subscription_store
+    with lazy_stores_lock:
+        if subscription_store is None:
+            subscription_store = SubscriptionStore(os.path.join(DATA_DIR, 'subscriptions.json'))
+    return subscription_store
+
+# Очередь доставки: лимиты Telegram, повторы и outbox, переживающий перезапуск
+delivery_queue = DeliveryQueue(
+    outbox_path=os.path.join(DATA_DIR, 'outbox.jsonl'),
+    workers=DELIVERY_WORKERS,
+    global_rate=DELIVERY_GLOBAL_RATE,
+)
+
+# Журнал плановых слотов: пропущенные при перезапуске досылаются, отправленные не повторяются
+job_ledger: Optional[JobLedger] = None
+
+def get_job_ledger() -> JobLedger:
+    """Журнал слотов; при создании он загружается и сжимается, поэтому - при первом обращении"""
+    global job_ledger
+    with lazy_stores_lock:
+        if job_ledger is None:
+            job_ledger = JobLedger(os.path.join(DATA_DIR, 'jobs.jsonl'), max_attempts=SLOT_MAX_ATTEMPTS)
+    return job_ledger
+SLOT_JOB_HOURS = {'digest': DIGEST_HOURS, 'subscribers': range(24)}
+SLOT_STATUS_LABELS = {'pending': 'ожидает', 'running': 'выполняется', 'sent': 'отправлен', 'failed': 'ошибка'}
+
+# Метрики бота; метрики сбора и доставки объявлены в collector.py и delivery.py
+DIGEST_BUILD_SECONDS = metrics_registry.histogram(
+    'digest_bot_digest_build_seconds', 'Время сборки дайджеста без отправки', ['type'])
+SCHEDULER_LAG_SECONDS = metrics_registry.histogram(
+    'digest_bot_scheduler_lag_seconds', 'Опоздание запуска задачи относительно плановой минуты', ['job'])
+SLOT_STAGE_SECONDS = metrics_registry.histogram(
+    'digest_bot_slot_stage_seconds', 'Время стадий планового слота', ['stage'])
+SUBSCRIBER_DIGESTS = metrics_registry.histogram(
+    'digest_bot_subscriber_digests', 'Личных дайджестов за одну рассылку', buckets=COUNT_BUCKETS)
+STORE_MESSAGES = metrics_registry.gauge('digest_bot_store_messages', 'Сообщений в хранилище')
+STORE_CHANNELS = metrics_registry.gauge('digest_bot_store_channels', 'Каналов в хранилище по состоянию', ['state'])
+DELIVERY_PENDING = metrics_registry.gauge('digest_bot_delivery_pending', 'Сообщений в очереди доставки')
+
+def update_store_metrics():
+    """Обновляет датчики хранилища и очереди перед выдачей метрик"""
+    STORE_MESSAGES.set(sum(len(messages) for messages in list(message_store.messages.values())))
+    STORE_CHANNELS.set(len(message_store.channels), state='known')
+    STORE_CHANNELS.set(len(message_store.monitored_channels), state='monitored')
+    DELIVERY_PENDING.set(delivery_queue.pending())
+
+metrics_registry.add_callback(update_store_metrics)
+
+def observe_scheduler_lag(job: str, planned_minute: int = 0, planned_at: Optional[float] = None) -> float:
+    """Записывает, на сколько секунд задача опоздала относительно своей минуты в часе
+    (или планового времени planned_at - для слотов из журнала задач)"""
+    if planned_at is not None:
+        lag = max(0.0, time.time() - planned_at)
+    else:
+        now = datetime.now(PORTUGAL_TIMEZONE)
+        lag = ((now.minute - planned_minute) * 60 + now.second + now.microsecond / 1e6) % 3600
+    SCHEDULER_LAG_SECONDS.observe(lag, job=job)
+    return lag
+
+# Трассы запусков дайджеста (JSONL), доступны администратору через /trace
+trace_store = TraceStore(os.path.join(DATA_DIR, 'traces.jsonl'))
+
+# Профилирование по команде /profile; полные профили сохраняются в DATA_DIR/profiles
+profiler = Profiler(os.path.join(DATA_DIR, 'profiles'))
+
+# Пул потоков для подсчета признаков и рендера, чтобы event loop успевал отвечать остальным
+digest_pool = WorkerPool(DIGEST_WORKERS)
+
+# Большие окна (сотни каналов за сутки) считаются шардами в пуле процессов
+sharded_analyzer = ShardedAnalyzer(ANALYSIS_PROCESSES, min_messages=PARALLEL_ANALYSIS_MIN_MESSAGES)
+
+# Опубликованные в канале новости (4 поколения фильтра Блума на NOVELTY_MEMORY_HOURS)
+novelty_filter: Optional[NoveltyFilter] = None
+
+def get_novelty_filter() -> Optional[NoveltyFilter]:
+    """Фильтр опубликованных новостей (None - выключен); novelty.bin читается при первом обращении"""
+    global novelty_filter
+    if not NOVELTY_ENABLED:
+        return None
+    with lazy_stores_lock:
+        if novelty_filter is None:
+            novelty_filter = NoveltyFilter(
+                os.path.join(DATA_DIR, 'novelty.bin'),
+                generation_hours=NOVELTY_MEMORY_HOURS / 4,
+                max_generations=4,
+            )
+    return novelty_filter
+
+# Архив сырых страниц каналов: индекс читается при первом сборе или восстановлении
+page_archive = PageArchive(
+    os.path.join(DATA_DIR, 'archive'),
+    max_bytes=int(ARCHIVE_MAX_MB * 1024 * 1024),
+    codec=ARCHIVE_CODEC,
+) if ARCHIVE_MAX_MB > 0 else None
+
+# Запросы сводки в работе: чат -> задача. Новый запрос из того же чата отменяет прежний
+digest_requests: Dict[int, asyncio.Task] = {}
+
+def start_digest_request(application: Application, chat_id: int, coroutine, update: Optional[Update] = None) -> asyncio.Task:
+    """Запускает сборку сводки в фоне, чтобы не держать очередь обновлений чата"""
+    previous = digest_requests.get(chat_id)
+    if previous is not None and not previous.done():
+        previous.cancel('replaced')
+        logger.info(f"Запрос сводки в чате {chat_id} заменен новым")
+    task = application.create_task(coroutine, update=update, name=f"digest-{chat_id}")
+    digest_requests[chat_id] = task
+    
+    def forget(done: asyncio.Task):
+        if digest_requests.get(chat_id) is done:
+            del digest_requests[chat_id]
+    
+    task.add_done_callback(forget)
+    return task
+
+def cancel_digest_request(chat_id: int, reason: str) -> bool:
+    task = digest_requests.get(chat_id)
+    if task is None or task.done():
+        return False
+    task.cancel(reason)
+    logger.info(f"Запрос сводки в чате {chat_id} отменен: {reason}")
+    return True
+
+async def send_profile_report(chat_id, report: str):
+    """Отправляет отчет профилирования тому, кто его запросил"""
+    await deliver(chat_id, report, PRIORITY_INTERACTIVE, persist=False)
+
+async def deliver(chat_id, text: str, priority: int = PRIORITY_DIGEST, key: Optional[str] = None, **kwargs):
+    """Отправляет сообщение через очередь доставки и ждет, пока уйдут все его части.
+    key - ключ идемпотентности: сообщение с уже принятым ключом повторно не ставится"""
+    return await delivery_queue.submit(chat_id, text, priority, key=key, **kwargs)
+
+async def reply_text(update: Update, text: str, **kwargs):
+    """Отвечает пользователю через очередь доставки с наивысшим приоритетом"""
+    return await delivery_queue.submit(update.effective_chat.id, text, PRIORITY_INTERACTIVE, persist=False, **kwargs)
+
 # Предустановленные каналы с веб-ссылками
 PREDEFINED_CHANNELS = {
     'meduza': {
@@ -191,111 +494,228 @@ PREDEFINED_CHANNELS = {
     }
 }
 
-async def scrape_channel_messages(channel_username: str) -> List[dict]:
-    """Скрапит сообщения из канала через веб-интерфейс"""
+def message_timestamp(msg: dict) -> float:
+    """Возвращает время сообщения в секундах Unix"""
     try:
-        # Формируем URL для веб-версии канала
-        web_url = f"https://t.me/s/{channel_username}"
-        
-        logger.info(f"Пытаюсь получить сообщения из: {web_url}")
-        
-        # Отправляем запрос
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'ru-RU,ru;q=0.8,en-US;q=0.5,en;q=0.3',
-            'Accept-Encoding': 'gzip, deflate',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-        }
-        
-        response = requests.get(web_url, headers=headers, timeout=15)
-        response.raise_for_status()
-        
-        # Парсим HTML
-        html_content = response.text
-        
-        logger.info(f"Получен HTML размером {len(html_content)} символов")
-        
-        # Ищем сообщения (несколько паттернов)
-        messages = []
-        
-        # Паттерн 1: основной паттерн для сообщений
-        message_pattern = r'<div class="tgme_widget_message_text js-message_text" dir="auto">(.*?)</div>'
-        time_pattern = r'<time datetime="([^"]+)"'
-        
-        # Паттерн 2: альтернативный паттерн
-        message_pattern2 = r'<div class="tgme_widget_message_text[^"]*">(.*?)</div>'
-        
-        # Паттерн 3: более общий паттерн
-        message_pattern3 = r'<div[^>]*class="[^"]*message_text[^"]*"[^>]*>(.*?)</div>'
-        
-        # Находим все сообщения с разными паттернами
-        message_matches = re.findall(message_pattern, html_content, re.DOTALL)
-        if not message_matches:
-            message_matches = re.findall(message_pattern2, html_content, re.DOTALL)
-        if not message_matches:
-            message_matches = re.findall(message_pattern3, html_content, re.DOTALL)
-        
-        time_matches = re.findall(time_pattern, html_content)
-        
-        logger.info(f"Найдено {len(message_matches)} сообщений и {len(time_matches)} временных меток")
-        
-        # Ограничиваем количество сообщений (увеличили с 5 до 15)
-        max_messages = min(15, len(message_matches))
-        
-        for i in range(max_messages):
-            if i < len(message_matches):
-                message_text = message_matches[i]
-                message_time = time_matches[i] if i < len(time_matches) else datetime.now(PORTUGAL_TIMEZONE).strftime('%Y-%m-%dT%H:%M:%S')
-                
-                # Очищаем HTML теги
-                clean_text = re.sub(r'<[^>]+>', '', message_text)
-                clean_text = re.sub(r'&nbsp;', ' ', clean_text)
-                clean_text = re.sub(r'&amp;', '&', clean_text)
-                clean_text = re.sub(r'&lt;', '<', clean_text)
-                clean_text = re.sub(r'&gt;', '>', clean_text)
-                clean_text = re.sub(r'&quot;', '"', clean_text)
-                clean_text = re.sub(r'&#39;', "'", clean_text)
-                
-                # Убираем лишние пробелы
-                clean_text = re.sub(r'\s+', ' ', clean_text).strip()
-                
-                if clean_text and len(clean_text) > 10:  # Минимальная длина сообщения
-                    messages.append({
-                        'text': clean_text,
-                        'from_user': 'Channel',
-                        'timestamp': message_time,
-                        'message_id': i + 1
-                    })
-        
-        logger.info(f"Собрано {len(messages)} сообщений из канала {channel_username}")
-        
-        # Если сообщений нет, возвращаем пустой список
-        if not messages:
-            logger.warning(f"Не удалось найти сообщения в канале {channel_username}")
-            return []
-        
-        return messages
-        
-    except Exception as e:
-        logger.error(f"Ошибка при скрапинге канала {channel_username}: {e}")
-        # Возвращаем пустой список в случае ошибки
-        return []
+        msg_time = datetime.fromisoformat(msg['timestamp'])
+        if msg_time.tzinfo is None:
+            msg_time = msg_time.replace(tzinfo=PORTUGAL_TIMEZONE)
+    except (KeyError, ValueError, TypeError):
+        msg_time = datetime.now(PORTUGAL_TIMEZONE)
+    return msg_time.timestamp()
 
-async def collect_real_messages():
-    """Собирает реальные сообщения из каналов"""
-    for channel_id in message_store.monitored_channels:
+def message_hour(msg: dict) -> int:
+    """Возвращает номер часа (часы с начала эпохи) для времени сообщения"""
+    return int(message_timestamp(msg)) // 3600
+
+def ingest_new_message(channel_id: str, msg: dict):
+    """Обрабатывает впервые увиденное сообщение: обновляет тренды и детектор всплесков"""
+    text = msg.get('text', '')
+    msg_ts = message_timestamp(msg)
+    # Признаки обычно уже посчитаны конвейером сбора
+    if 'category' not in msg:
+        extract_features(msg)
+    trend_store.record(int(msg_ts) // 3600, msg['category'], countries=msg['countries'], keywords=msg['keywords'])
+    if BURST_ALERTS_ENABLED:
+        pending_burst_events.extend(burst_detector.observe(channel_id, text, msg_ts, time.time()))
+
+def channels_to_collect() -> List[str]:
+    """Каналы для сбора: отслеживаемые и выбранные подписчиками"""
+    return list(message_store.monitored_channels | get_subscription_store().subscribed_channels())
+
+async def store_channel_messages(channel_id: str, messages: List[dict]):
+    """Последняя стадия конвейера: заменяет сообщения канала и учитывает новые"""
+    # Запоминаем уже виденные тексты, чтобы не учитывать их повторно
+    seen_texts = {msg.get('text') for msg in message_store.messages.get(channel_id, [])}
+    
+    # Заменяем сообщения канала целиком - окна канала пересчитываются один раз
+    message_store.set_channel_messages(channel_id, list(messages))
+    
+    # Учитываем новые сообщения
+    for msg in messages:
+        if msg.get('text') not in seen_texts:
+            ingest_new_message(channel_id, msg)
+
+async def collect_real_messages() -> dict:
+    """Собирает реальные сообщения из каналов и возвращает статистику сбора"""
+    if cluster_node is not None:
+        return await collect_from_cluster()
+    
+    channels = []
+    for channel_id in channels_to_collect():
         channel_info = message_store.channels.get(channel_id)
         if channel_info and channel_info.get('username'):
-            messages = await scrape_channel_messages(channel_info['username'])
-            
-            # Очищаем старые сообщения для этого канала
-            message_store.messages[channel_id] = []
-            
-            # Добавляем новые сообщения
-            for msg in messages:
-                message_store.add_message(channel_id, msg)
+            channels.append((channel_id, channel_info['username']))
+    
+    # Каждый канал проходит разбор и запись сразу после загрузки, не дожидаясь остальных.
+    # Если загрузка не удалась, прежние сообщения канала остаются в хранилище
+    async with profiler.profile('collect', send_profile_report):
+        stats = await run_collection(
+            channels,
+            store_channel_messages,
+            base_url=TELEGRAM_WEB_BASE_URL,
+            concurrency=COLLECT_CONCURRENCY,
+            queue_size=COLLECT_QUEUE_SIZE,
+            archive=page_archive,
+        )
+    
+    message_store.last_collected_at = time.time()
+    
+    # Если во время сбора заметили всплеск - сразу отправляем срочный алерт
+    if pending_burst_events:
+        await dispatch_burst_alerts()
+    return stats
+
+# Узел кластера (None - обычный режим одного процесса) и последняя загруженная версия результатов сбора
+cluster_node: Optional[ClusterNode] = None
+cluster_synced_version = 0
+cluster_collected_at: Dict[str, float] = {}
+
+def publish_cluster_channels():
+    """Лидер отдает узлам список каналов для сбора"""
+    channels = []
+    for channel_id in channels_to_collect():
+        channel_info = message_store.channels.get(channel_id)
+        if channel_info and channel_info.get('username'):
+            channels.append((channel_id, channel_info['username']))
+    cluster_node.store.publish_channels(channels)
+
+def collect_cluster_shard(channels: List[tuple]):
+    """Плановый сбор своих шардов в потоке узла: результаты уходят в общую базу"""
+    async def save(channel_id: str, messages: List[dict]):
+        cluster_node.save(channel_id, messages)
+    
+    try:
+        asyncio.run(run_collection(
+            channels,
+            save,
+            base_url=TELEGRAM_WEB_BASE_URL,
+            concurrency=COLLECT_CONCURRENCY,
+            queue_size=COLLECT_QUEUE_SIZE,
+            archive=page_archive,
+        ))
+    except Exception as e:
+        logger.error(f"Ошибка сбора шардов узла {cluster_node.worker_id}: {e}")
+
+async def sync_from_cluster() -> dict:
+    """Переносит в хранилище лидера каналы, собранные узлами после прошлой синхронизации"""
+    global cluster_synced_version
+    rows = await asyncio.to_thread(cluster_node.store.load_messages, cluster_synced_version)
+    message_count = 0
+    for channel_id, version, collected_at, messages in rows:
+        await store_channel_messages(channel_id, messages)
+        cluster_synced_version = max(cluster_synced_version, version)
+        cluster_collected_at[channel_id] = collected_at
+        message_count += len(messages)
+    # Возраст данных - по самому давно собранному из нужных каналов
+    collected = [cluster_collected_at[ch_id] for ch_id in channels_to_collect() if ch_id in cluster_collected_at]
+    if collected:
+        message_store.last_collected_at = min(collected)
+    return {'channels': len(rows), 'fetched': len(rows), 'failed': 0, 'messages': message_count}
+
+async def collect_from_cluster() -> dict:
+    """Лидер кластера: просит все узлы собрать свои шарды и забирает результаты из общей базы"""
+    started = time.perf_counter()
+    await asyncio.to_thread(publish_cluster_channels)
+    request = await asyncio.to_thread(cluster_node.store.request_collection)
+    cluster_node.wake_event.set()
+    completed = await asyncio.to_thread(cluster_node.wait_for_collection, request, CLUSTER_COLLECT_TIMEOUT)
+    if not completed:
+        logger.warning(f"Не все узлы кластера собрали каналы за {CLUSTER_COLLECT_TIMEOUT:.0f} с, берем что есть")
+    stats = await sync_from_cluster()
+    stats['wall_time'] = time.perf_counter() - started
+    if pending_burst_events:
+        await dispatch_burst_alerts()
+    return stats
+
+def start_cluster_node():
+    """Подключает процесс к кластеру и ждет лидерства; пока лидер другой, узел только собирает"""
+    global cluster_node
+    cluster_node = ClusterNode(
+        ClusterStore(CLUSTER_DB),
+        worker_id=CLUSTER_WORKER_ID or None,
+        shards=CLUSTER_SHARDS,
+        lease_seconds=CLUSTER_LEASE_SECONDS,
+        collect_interval=CLUSTER_COLLECT_MINUTES * 60,
+        collect=collect_cluster_shard,
+        on_leader_lost=lambda: os.kill(os.getpid(), signal.SIGTERM),
+    )
+    cluster_node.start()
+    logger.info(f"Узел кластера {cluster_node.worker_id} запущен, ожидаем лидерства...")
+    while not cluster_node.became_leader.wait(60):
+        leader = cluster_node.store.lease_owner('leader')
+        logger.info(f"Узел {cluster_node.worker_id} в резерве: собирает {len(cluster_node.owned)} шардов, лидер {leader}")
+
+def restore_messages_from_archive():
+    """После перезапуска заполняет хранилище последними страницами каналов из архива,
+    разобранными текущим парсером, чтобы первые сводки не ждали сбора"""
+    if page_archive is None or ARCHIVE_RESTORE_HOURS <= 0:
+        return
+    started = time.perf_counter()
+    try:
+        entries = page_archive.select(since=time.time() - ARCHIVE_RESTORE_HOURS * 3600,
+                                      channels=channels_to_collect(), latest_only=True)
+        restored = reparse_archive(page_archive, entries, processes=1)
+    except Exception as e:
+        logger.error(f"Ошибка восстановления сообщений из архива: {e}")
+        return
+    if not entries:
+        return
+    for channel_id, messages in restored.items():
+        message_store.set_channel_messages(channel_id, messages)
+    # Данные не новее самой старой из восстановленных страниц
+    message_store.last_collected_at = min(entry['fetched_at'] for entry in entries)
+    logger.info(f"Из архива восстановлено {sum(len(msgs) for msgs in restored.values())} сообщений "
+                f"{len(restored)} каналов за {time.perf_counter() - started:.2f} с")
+
+# Планировщик запускает задачи в разных потоках - не даем им собирать одновременно
+collection_lock = threading.Lock()
+COLLECTION_LOCK_POLL_SECONDS = 0.2
+last_collection_stats: dict = {}  # статистика последнего сбора - для запросов, дождавшихся чужого сбора
+
+async def acquire_collection_lock():
+    """Ждет collection_lock, не занимая поток: если ожидающую задачу отменят,
+    блокировка не останется захваченной навсегда"""
+    while not collection_lock.acquire(blocking=False):
+        await asyncio.sleep(COLLECTION_LOCK_POLL_SECONDS)
+
+def messages_age() -> Optional[float]:
+    """Сколько секунд прошло с последнего сбора (None - сбора еще не было)"""
+    if message_store.last_collected_at is None:
+        return None
+    return time.time() - message_store.last_collected_at
+
+async def ensure_fresh_messages(max_age_seconds: float, collected_after: Optional[float] = None) -> float:
+    """Собирает сообщения, только если данные старше max_age_seconds (или, если задан collected_after,
+    собраны раньше этого момента). Возвращает время сбора в секундах"""
+    global last_collection_stats
+    started = time.perf_counter()
+    with tracing.stage('collect') as trace_fields:
+        # Если сбор уже идет в другом потоке, дожидаемся его и переиспользуем результат
+        await acquire_collection_lock()
+        try:
+            if cluster_node is not None:
+                # Узлы собирают свои шарды по расписанию - возможно, свежие данные уже в базе
+                await sync_from_cluster()
+            age = messages_age()
+            trace_fields['data_age'] = round(age, 1) if age is not None else None
+            if collected_after is not None:
+                fresh = message_store.last_collected_at is not None and message_store.last_collected_at >= collected_after
+            else:
+                fresh = age is not None and age <= max_age_seconds
+            if fresh:
+                trace_fields['skipped'] = True
+                return 0.0
+            last_collection_stats = await collect_real_messages()
+        finally:
+            collection_lock.release()
+    return time.perf_counter() - started
+
+async def collect_on_request() -> dict:
+    """Сбор по команде пользователя. Если сбор уже идет, ждем его и отдаем его статистику
+    вместо второго полного обхода каналов"""
+    await ensure_fresh_messages(0, collected_after=time.time())
+    return last_collection_stats
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
@@ -309,7 +729,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 Доступные команды:
 • /digest - получить сводку сейчас
 • /manage_channels - управление каналами
-• /add_channel @username - добавить канал по username
+• /add_channel @a @b ... - добавить каналы (или пришлите .txt-файл со списком)
 • /collect_messages - собрать свежие сообщения из каналов
 • /help - справка
 
@@ -323,7 +743,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 Примечание: Бот собирает сообщения через веб-интерфейс Telegram. Автоматические дайджесты отправляются в канал каждые 2 часа (7:00 - 21:00) по португальскому времени
     """
     
-    await update.message.reply_text(welcome_text)
+    await reply_text(update, welcome_text)
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /help"""
@@ -333,11 +753,27 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 **Основные команды:**
 • `/start` - начать работу с ботом
 • `/digest` - получить сводку сейчас
-• `/manage_channels` - управление каналами
-• `/add_channel @username` - добавить канал по username
+• `/manage_channels [поиск]` - управление каналами (по страницам, с поиском)
+• `/add_channel @a t.me/b ...` - проверить и добавить каналы (или пришлите .txt/.csv-файл со списком)
 • `/collect_messages` - собрать свежие сообщения из каналов
 • `/status` - показать статус бота
 • `/version` - показать версию и время следующего дайджеста
+• `/trends [часы]` - почасовая динамика категорий, стран и ключевых слов
+• `/who Россия` - упоминания страны, персоны или организации за сутки
+
+**Личные дайджесты:**
+• `/subscribe` / `/unsubscribe` - включить или выключить личные дайджесты
+• `/my_channels канал ...` - выбрать каналы (`all` - все отслеживаемые)
+• `/schedule 7 13 19` - часы отправки
+• `/style resonance|short` - стиль дайджеста
+
+**Администратор:**
+• `/profile collect|digest [N]` - профилировать следующие N сборов или дайджестов (`/profile off` - отменить)
+• `/trace [run_id|last]` - трассы последних запусков дайджеста по стадиям
+
+**Inline-режим (в любом чате):**
+• `@бот дайджест` - отправить текущий дайджест
+• `@бот санкции` - найти новости за сутки по словам
 
 **Как добавить канал:**
 1. Используйте `/manage_channels` для выбора предустановленных каналов
@@ -350,117 +786,262 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 Бот собирает сообщения через веб-интерфейс Telegram каналов. Автоматические дайджесты отправляются в канал каждые 2 часа (7:00 - 21:00) по португальскому времени
     """
     
-    await update.message.reply_text(help_text)
+    await reply_text(update, help_text)
+
+CHANNEL_REF_SEPARATORS = re.compile(r'[\s,;]+')
+CSV_HEADER_NAMES = {'username', 'channel', 'link', 'url', 'канал', 'ссылка'}
+
+def channel_refs_from_file(content: str, file_name: str) -> List[str]:
+    """Каналы из файла: в .csv - первая колонка (заголовок пропускается), в .txt - все слова"""
+    if not file_name.lower().endswith('.csv'):
+        return CHANNEL_REF_SEPARATORS.split(content)
+    refs = []
+    for row in csv.reader(io.StringIO(content), delimiter=';' if ';' in content.split('\n', 1)[0] else ','):
+        if row and row[0].strip() and row[0].strip().lower() not in CSV_HEADER_NAMES:
+            refs.append(row[0].strip())
+    return refs
+
+async def import_channels(refs: List[str]) -> dict:
+    """Проверяет каналы из списка username и ссылок t.me и включает найденные в мониторинг.
+    Все каналы проверяются параллельно, одной загрузкой t.me/s/<username> на канал"""
+    usernames, failed, seen = [], {}, set()
+    duplicates = 0
+    for ref in refs:
+        username = normalize_channel_ref(ref)
+        if username is None:
+            failed[ref[:64]] = "некорректное имя или ссылка"
+        elif username.lower() in seen:
+            duplicates += 1
+        else:
+            seen.add(username.lower())
+            usernames.append(username)
+    skipped = len(usernames[MAX_IMPORT_CHANNELS:])
+    usernames = usernames[:MAX_IMPORT_CHANNELS]
+    
+    result = await validate_channels(usernames, base_url=TELEGRAM_WEB_BASE_URL, concurrency=IMPORT_CONCURRENCY)
+    failed.update({f"@{username}": reason for username, reason in result['failed'].items()})
+    
+    # Канал, уже известный под другим id (например, meduza -> @meduzaproject), обновляется на месте
+    known = {(info.get('username') or '').lower(): channel_id for channel_id, info in message_store.channels.items()}
+    added, updated = [], []
+    for username, meta in result['valid'].items():
+        channel_id = known.get(username.lower()) or known.get(meta['username'].lower()) or meta['username'].lower()
+        is_known = channel_id in message_store.channels
+        channel_info = dict(message_store.channels.get(channel_id, {}))
+        channel_info.update({
+            'id': channel_id,
+            'title': meta['title'],
+            'username': meta['username'],
+            'type': 'channel',
+            'web_url': f"https://t.me/{meta['username']}",
+            'photo_url': meta['photo_url'],
+            'subscribers': meta['subscribers'],
+            'validated_at': time.time(),
+        })
+        message_store.add_channel(channel_id, channel_info)
+        (updated if is_known else added).append(channel_info)
+    
+    logger.info(f"Импорт каналов: добавлено {len(added)}, обновлено {len(updated)}, ошибок {len(failed)}, "
+                f"повторов {duplicates}, за {result['wall_time']:.1f} с")
+    return {'added': added, 'updated': updated, 'failed': failed, 'duplicates': duplicates,
+            'skipped': skipped, 'wall_time': result['wall_time']}
+
+def format_import_report(result: dict, limit: int = 20) -> str:
+    """Итог импорта каналов для пользователя"""
+    text = f"📥 Импорт каналов за {result['wall_time']:.1f} с\n\n"
+    text += f"✅ Добавлено и включено в анализ: {len(result['added'])}\n"
+    if result['updated']:
+        text += f"🔄 Уже были, данные обновлены: {len(result['updated'])}\n"
+    if result['duplicates']:
+        text += f"♻️ Повторов в списке: {result['duplicates']}\n"
+    if result['skipped']:
+        text += f"⏭ Пропущено сверх лимита {MAX_IMPORT_CHANNELS}: {result['skipped']}\n"
+    
+    for channel_info in result['added'][:limit]:
+        subscribers = channel_info.get('subscribers')
+        audience = f" - {subscribers:,} подписчиков".replace(',', ' ') if subscribers else ""
+        text += f"• {channel_info['title']} (@{channel_info['username']}){audience}\n"
+    if len(result['added']) > limit:
+        text += f"… и еще {len(result['added']) - limit}\n"
+    
+    if result['failed']:
+        text += f"\n⚠️ Не удалось добавить: {len(result['failed'])}\n"
+        for ref, reason in list(result['failed'].items())[:limit]:
+            text += f"• {ref} - {reason}\n"
+        if len(result['failed']) > limit:
+            text += f"… и еще {len(result['failed']) - limit}\n"
+    return text
+
+async def run_channel_import(update: Update, refs: List[str]):
+    refs = [ref for ref in refs if ref]
+    if not refs:
+        await reply_text(update, "❌ Укажите канал: /add_channel @channel_name")
+        return
+    await reply_text(update, f"🔄 Проверяю каналы: {len(refs)}...")
+    try:
+        result = await import_channels(refs)
+    except Exception as e:
+        logger.error(f"Ошибка импорта каналов: {e}")
+        await reply_text(update, "❌ Ошибка при проверке каналов")
+        return
+    await reply_text(update, format_import_report(result))
 
 async def add_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /add_channel"""
-    if not context.args:
-        await update.message.reply_text("❌ Укажите канал: /add_channel @channel_name")
+    """Обработчик команды /add_channel @a t.me/b ... - проверяет каналы и включает их в анализ"""
+    await run_channel_import(update, CHANNEL_REF_SEPARATORS.split(' '.join(context.args or [])))
+
+async def import_channels_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Файл .txt или .csv со списком каналов (по одному или через запятую) - тот же импорт"""
+    document = update.message.document
+    if document.file_size and document.file_size > MAX_IMPORT_FILE_BYTES:
+        await reply_text(update, f"❌ Файл больше {MAX_IMPORT_FILE_BYTES // 1024} КБ")
         return
-    
-    channel_username = context.args[0].lstrip('@')
-    
-    # Создаем информацию о канале
-    channel_info = {
-        'id': channel_username,
-        'title': f"@{channel_username}",
-        'username': channel_username,
-        'type': 'channel',
-        'web_url': f"https://t.me/{channel_username}"
-    }
-    
-    # Добавляем канал в хранилище
-    message_store.channels[channel_username] = channel_info
-    
-    await update.message.reply_text(
-        f"✅ Канал @{channel_username} добавлен!\n\n"
-        f"Используйте /manage_channels для включения его в анализ."
-    )
+    try:
+        telegram_file = await document.get_file()
+        content = bytes(await telegram_file.download_as_bytearray()).decode('utf-8-sig', errors='replace')
+    except Exception as e:
+        logger.error(f"Ошибка загрузки файла со списком каналов: {e}")
+        await reply_text(update, "❌ Не удалось прочитать файл")
+        return
+    await run_channel_import(update, channel_refs_from_file(content, document.file_name or ''))
+
+def channel_menu_query(user_id: int) -> str:
+    """Строка поиска, с которой пользователь сейчас листает меню каналов"""
+    return message_store.get_user_state(user_id)['data'].get('channel_query', '')
+
+async def show_channel_menu(update: Update, query: str = '', page: int = 0, notice: str = ''):
+    """Показывает страницу меню каналов: из кнопки - одной правкой сообщения, из команды - новым"""
+    text, reply_markup = render_channel_menu(message_store.channels, message_store.monitored_channels,
+                                             query, page, notice)
+    if not update.callback_query:
+        await reply_text(update, text, reply_markup=reply_markup)
+        return
+    try:
+        await update.callback_query.edit_message_text(text, reply_markup=reply_markup)
+    except BadRequest as e:
+        # «Обновить» без изменений: Telegram отказывается править сообщение на то же самое
+        if 'not modified' not in str(e).lower():
+            raise
 
 async def manage_channels(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /manage_channels - показывает интерфейс управления каналами"""
+    """Обработчик команды /manage_channels [поиск] - показывает интерфейс управления каналами"""
     user_id = update.effective_user.id
     
     # Добавляем предустановленные каналы в хранилище
     for channel_id, channel_info in PREDEFINED_CHANNELS.items():
         message_store.channels[channel_id] = channel_info
     
-    all_channels = message_store.get_all_channels()
-    monitored_channels = message_store.get_monitored_channels()
-    monitored_ids = {channel['id'] for channel in monitored_channels}
-    
-    if not all_channels:
-        await update.message.reply_text(
+    if not message_store.channels:
+        await reply_text(update, 
             "📭 Пока нет каналов для анализа.\n\n"
             "Используйте `/add_channel @username` для добавления каналов!"
         )
         return
     
-    # Создаем клавиатуру с каналами
-    keyboard = []
-    for channel in all_channels:
-        channel_id = channel['id']
-        channel_title = channel['title']
-        is_monitored = channel_id in monitored_ids
-        
-        # Создаем кнопку с индикатором статуса
-        status_emoji = "✅" if is_monitored else "❌"
-        button_text = f"{status_emoji} {channel_title}"
-        
-        keyboard.append([InlineKeyboardButton(
-            button_text, 
-            callback_data=f"toggle_channel:{channel_id}"
-        )])
-    
-    # Добавляем кнопки управления
-    keyboard.append([
-        InlineKeyboardButton("🔄 Обновить", callback_data="refresh_channels"),
-        InlineKeyboardButton("✅ Выбрать все", callback_data="select_all_channels"),
-        InlineKeyboardButton("❌ Снять все", callback_data="deselect_all_channels")
-    ])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    status_text = f"📋 Управление каналами для анализа\n\n"
-    status_text += f"Отслеживается: {len(monitored_channels)} из {len(all_channels)} каналов\n\n"
-    status_text += "Нажмите на канал, чтобы включить/выключить его анализ:"
-    
-    # Проверяем, откуда вызвана функция
-    if update.callback_query:
-        await update.callback_query.edit_message_text(status_text, reply_markup=reply_markup)
+    # /manage_channels рбк - сразу открыть меню с поиском
+    if not update.callback_query and context.args:
+        message_store.set_user_state(user_id, 'channel_menu', {'channel_query': ' '.join(context.args)})
+    await show_channel_menu(update, channel_menu_query(user_id))
+
+async def channel_search_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Текст после кнопки «🔍 Поиск» в меню каналов - строка поиска"""
+    user_id = update.effective_user.id
+    if message_store.get_user_state(user_id)['state'] != 'channel_search':
+        return
+    channel_query = update.message.text.strip()[:64]
+    message_store.set_user_state(user_id, 'channel_menu', {'channel_query': channel_query})
+    await show_channel_menu(update, channel_query)
+
+async def handle_channel_menu(update: Update, action: str, page: int, token: Optional[str]):
+    """Кнопка меню каналов: действие и одна правка сообщения с обновленной страницей"""
+    user_id = update.effective_user.id
+    channel_query = channel_menu_query(user_id)
+    channels = message_store.channels
+    notice = ''
+    
+    if action == channel_menu.TOGGLE:
+        channel_id = resolve_channel(token or '', channels)
+        if channel_id is None:
+            notice = "❌ Канал не найден"
+        else:
+            channel_info = channels[channel_id]
+            if channel_id in message_store.monitored_channels:
+                message_store.remove_channel(channel_id)
+                notice = f"Канал {channel_info['title']} ❌ отключен для анализа"
+            else:
+                message_store.add_channel(channel_id, channel_info)
+                notice = f"Канал {channel_info['title']} ✅ включен для анализа"
+            logger.info(f"Канал {channel_id}: {notice}")
+            # Кнопка из старого сообщения могла указывать не ту страницу - показываем страницу канала
+            found = filter_channels(channels, channel_query)
+            if channel_id in found and channel_id not in page_channels(found, page):
+                page = found.index(channel_id) // channel_menu.PAGE_SIZE
+    
+    elif action in (channel_menu.PAGE_ON, channel_menu.PAGE_OFF, channel_menu.FOUND_ON, channel_menu.FOUND_OFF):
+        selected = filter_channels(channels, channel_query)
+        if action in (channel_menu.PAGE_ON, channel_menu.PAGE_OFF):
+            selected = page_channels(selected, page)
+        enable = action in (channel_menu.PAGE_ON, channel_menu.FOUND_ON)
+        changed = [channel_id for channel_id in selected if (channel_id in message_store.monitored_channels) != enable]
+        for channel_id in changed:
+            if enable:
+                message_store.add_channel(channel_id, channels[channel_id])
+            else:
+                message_store.remove_channel(channel_id)
+        notice = f"{'Включено' if enable else 'Отключено'} каналов: {len(changed)} из {len(selected)} {'✅' if enable else '❌'}"
+        logger.info(f"Меню каналов: {notice} (поиск '{channel_query}')")
+    
+    elif action == channel_menu.SEARCH:
+        message_store.set_user_state(user_id, 'channel_search', {'channel_query': channel_query})
+        await update.callback_query.edit_message_text(
+            "🔍 Отправьте часть названия или username канала.\n\n"
+            "Можно и сразу: /manage_channels <поиск>"
+        )
+        return
+    
+    elif action == channel_menu.CLEAR:
+        message_store.set_user_state(user_id, 'channel_menu', {'channel_query': ''})
+        channel_query = ''
+    
+    await show_channel_menu(update, channel_query, page, notice)
+
+def format_collection_report(stats: dict, hint: str, limit: int = 20) -> str:
+    """Итог сбора для пользователя. Каналов может быть до MAX_IMPORT_CHANNELS, поэтому
+    по каналам показываются первые limit - ответ должен уложиться в одно сообщение"""
+    monitored_channels = message_store.get_monitored_channels()
+    total_messages = sum(len(message_store.messages.get(channel['id'], [])) for channel in monitored_channels)
+    
+    text = f"✅ Сбор сообщений завершен!\n\n"
+    text += f"📋 Отслеживаемых каналов: {len(monitored_channels)}\n"
+    text += f"📨 Всего сообщений: {total_messages}\n"
+    if stats.get('wall_time') is not None:
+        text += f"⏱ Время сбора: {stats['wall_time']:.1f} с\n"
+    text += "\n"
+    
+    if monitored_channels:
+        text += "📊 По каналам:\n"
+        for channel in monitored_channels[:limit]:
+            message_count = len(message_store.messages.get(channel['id'], []))
+            text += f"• {channel['title']}: {message_count} сообщений\n"
+        if len(monitored_channels) > limit:
+            text += f"… и еще {len(monitored_channels) - limit}\n"
     else:
-        await update.message.reply_text(status_text, reply_markup=reply_markup)
+        text += "❌ Нет отслеживаемых каналов\n"
+        text += hint
+    return text
 
 async def collect_messages_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /collect_messages"""
-    await update.message.reply_text("🔄 Собираю свежие сообщения из каналов...")
+    await reply_text(update, "🔄 Собираю свежие сообщения из каналов...")
     
     try:
-        await collect_real_messages()
-        
-        # Подсчитываем результаты
-        total_messages = sum(len(messages) for messages in message_store.messages.values())
-        monitored_channels = message_store.get_monitored_channels()
-        
-        result_text = f"✅ Сбор сообщений завершен!\n\n"
-        result_text += f"📋 Отслеживаемых каналов: {len(monitored_channels)}\n"
-        result_text += f"📨 Всего сообщений: {total_messages}\n\n"
-        
-        if monitored_channels:
-            result_text += "📊 По каналам:\n"
-            for channel in monitored_channels:
-                channel_id = channel['id']
-                message_count = len(message_store.messages.get(channel_id, []))
-                result_text += f"• {channel['title']}: {message_count} сообщений\n"
-        else:
-            result_text += "❌ Нет отслеживаемых каналов\n"
-            result_text += "Используйте `/manage_channels` для добавления каналов"
-        
-        await update.message.reply_text(result_text)
+        stats = await collect_on_request()
+        result_text = format_collection_report(stats, "Используйте `/manage_channels` для добавления каналов")
+        await reply_text(update, result_text)
         
     except Exception as e:
         logger.error(f"Ошибка при сборе сообщений: {e}")
-        await update.message.reply_text("❌ Ошибка при сборе сообщений")
+        await reply_text(update, "❌ Ошибка при сборе сообщений")
 
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик нажатий на кнопки управления"""
@@ -476,65 +1057,15 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     logger.info(f"handle_callback: получен callback {data} от пользователя {user_id}")
     
-    # Обработка каналов
-    if data.startswith("toggle_channel:"):
-        channel_id = data.split(":")[1]
-        channel_info = message_store.channels.get(channel_id)
-        
-        if not channel_info:
-            await query.edit_message_text("❌ Канал не найден")
-            return
-        
-        # Переключаем статус канала
-        logger.info(f"Переключаем канал {channel_id} ({channel_info['title']})")
-        logger.info(f"Текущие отслеживаемые каналы: {list(message_store.monitored_channels)}")
-        
-        if channel_id in message_store.monitored_channels:
-            message_store.remove_channel(channel_id)
-            status = "❌ отключен"
-            logger.info(f"Канал {channel_id} отключен")
-        else:
-            message_store.add_channel(channel_id, channel_info)
-            status = "✅ включен"
-            logger.info(f"Канал {channel_id} включен")
-        
-        logger.info(f"После изменения отслеживаемые каналы: {list(message_store.monitored_channels)}")
-        
-        await query.edit_message_text(f"Канал {channel_info['title']} {status} для анализа")
-        
-        # Показываем обновленный интерфейс
-        await manage_channels(update, context)
-    
-    elif data == "refresh_channels":
-        await manage_channels(update, context)
-    
-    elif data == "select_all_channels":
-        # Включаем все каналы
-        for channel_id, channel_info in message_store.channels.items():
-            message_store.add_channel(channel_id, channel_info)
-        
-        await query.edit_message_text("✅ Все каналы включены для анализа")
-        await manage_channels(update, context)
-    
-    elif data == "deselect_all_channels":
-        # Отключаем все каналы
-        message_store.monitored_channels.clear()
-        
-        await query.edit_message_text("❌ Все каналы отключены от анализа")
-        await manage_channels(update, context)
+    # Меню каналов (и кнопки старых сообщений с прежним форматом callback data)
+    menu_action = decode_channel_callback(data)
+    if menu_action:
+        await handle_channel_menu(update, *menu_action)
     
     # Обработка новых кнопок
     elif data == "digest":
         await query.edit_message_text("🔄 Создаю сводку...")
-        try:
-            digest_text = await create_resonance_digest()
-            if digest_text:
-                await query.edit_message_text(digest_text)
-            else:
-                await query.edit_message_text("📭 Нет новых сообщений для создания сводки")
-        except Exception as e:
-            logger.error(f"Ошибка при создании сводки: {e}")
-            await query.edit_message_text(f"❌ Ошибка при создании сводки: {str(e)}")
+        start_digest_request(context.application, update.effective_chat.id, button_digest(update), update)
     
     elif data == "manage_channels":
         await manage_channels(update, context)
@@ -542,23 +1073,8 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif data == "collect_messages":
         await query.edit_message_text("🔄 Собираю свежие сообщения из каналов...")
         try:
-            await collect_real_messages()
-            monitored_channels = message_store.get_monitored_channels()
-            total_messages = sum(len(message_store.messages.get(channel['id'], [])) for channel in monitored_channels)
-            
-            response = f"✅ Сбор сообщений завершен!\n"
-            response += f"📋 Отслеживаемых каналов: {len(monitored_channels)}\n"
-            response += f"📨 Всего сообщений: {total_messages}\n\n"
-            
-            if monitored_channels:
-                response += f"📊 По каналам:\n"
-                for channel in monitored_channels:
-                    message_count = len(message_store.messages.get(channel['id'], []))
-                    response += f"• {channel['title']}: {message_count} сообщений\n"
-            else:
-                response += f"❌ Нет отслеживаемых каналов\n"
-                response += f"Используйте кнопку 'Управление каналами' для добавления каналов\n"
-            
+            stats = await collect_on_request()
+            response = format_collection_report(stats, "Используйте кнопку 'Управление каналами' для добавления каналов\n")
             await query.edit_message_text(response)
         except Exception as e:
             logger.error(f"Ошибка при сборе сообщений: {e}")
@@ -570,11 +1086,15 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.edit_message_text("📋 Список отслеживаемых каналов пуст")
             return
         
+        # Правка сообщения не делится на части - показываем начало списка, полный - в /list_channels
+        limit = 20
         response_text = "📋 Отслеживаемые каналы:\n\n"
-        for i, channel in enumerate(channels, 1):
+        for i, channel in enumerate(channels[:limit], 1):
             username = f"@{channel.get('username', 'private')}" if channel.get('username') else "Приватный канал"
             message_count = len(message_store.messages.get(channel['id'], []))
             response_text += f"{i}. {channel['title']} ({username}) - {message_count} сообщений\n"
+        if len(channels) > limit:
+            response_text += f"… и еще {len(channels) - limit} (полный список - /list_channels)\n"
         
         await query.edit_message_text(response_text)
     
@@ -586,10 +1106,13 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • /start - начать работу с ботом
 • /digest - получить сводку сейчас
 • /manage_channels - управление каналами для анализа
-• /add_channel @username - добавить канал по username
+• /add_channel @a @b ... - добавить каналы (или пришлите .txt-файл со списком)
 • /collect_messages - собрать свежие сообщения из каналов
 • /status - показать статус бота
 • /list_channels - список отслеживаемых каналов
+• /trends [часы] - почасовая динамика повестки
+• /who Россия - упоминания страны, персоны или организации
+• /subscribe - личные дайджесты по своему расписанию
 
 Как добавить канал:
 1. Используйте /manage_channels для выбора предустановленных каналов
@@ -608,7 +1131,7 @@ async def list_channels(update: Update, context: ContextTypes.DEFAULT_TYPE):
     channels = message_store.get_monitored_channels()
     
     if not channels:
-        await update.message.reply_text("📋 Список отслеживаемых каналов пуст")
+        await reply_text(update, "📋 Список отслеживаемых каналов пуст")
         return
     
     response_text = "📋 **Отслеживаемые каналы:**\n\n"
@@ -617,12 +1140,12 @@ async def list_channels(update: Update, context: ContextTypes.DEFAULT_TYPE):
         message_count = len(message_store.messages.get(channel['id'], []))
         response_text += f"{i}. {channel['title']} ({username}) - {message_count} сообщений\n"
     
-    await update.message.reply_text(response_text)
+    await reply_text(update, response_text)
 
 async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /status - показывает статус бота"""
     monitored_channels = message_store.get_monitored_channels()
-    all_messages = message_store.get_messages_for_period(24)
+    message_counts = message_store.count_messages_for_period(24)
     
     # Получаем текущее время по португальскому времени
     now = datetime.now(PORTUGAL_TIMEZONE)
@@ -630,20 +1153,54 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     status_text = f"📊 Статус бота:\n\n"
     status_text += f"🕐 Время (Португалия): {now.strftime('%d.%m.%Y %H:%M')}\n"
     status_text += f"📋 Каналов в мониторинге: {len(monitored_channels)}\n"
-    status_text += f"📨 Каналов с сообщениями: {len(all_messages)}\n"
-    status_text += f"💬 Всего сообщений: {sum(len(msgs) for msgs in all_messages.values())}\n\n"
+    status_text += f"📨 Каналов с сообщениями: {len(message_counts)}\n"
+    status_text += f"💬 Всего сообщений: {sum(message_counts.values())}\n\n"
     
     # Информация о расписании
     status_text += f"⏰ Расписание дайджестов:\n"
     status_text += f"Каждые 2 часа: 7:00, 9:00, 11:00, 13:00, 15:00, 17:00, 19:00, 21:00\n"
     status_text += f"(по португальскому времени)\n\n"
     
+    # Тайминги последнего планового слота
+    if slot_timings:
+        last_slot = slot_timings[-1]
+        data_age = f"{last_slot['data_age'] / 60:.0f} мин" if last_slot['data_age'] is not None else "нет данных"
+        status_text += f"⏱ Последний слот {last_slot['slot']}: возраст данных {data_age}, "
+        status_text += f"сбор {last_slot['collect']:.1f} с, анализ {last_slot['analysis']:.2f} с, "
+        status_text += f"отправка {last_slot['send']:.2f} с\n\n"
+    
+    # Журнал слотов: последний наступивший слот дайджеста и что осталось дослать
+    digest_slots = [slot for slot in get_job_ledger().recent(100)
+                    if slot['job'] == 'digest' and slot['planned_at'] <= time.time()]
+    if digest_slots:
+        slot = digest_slots[0]
+        missed = sum(len(get_job_ledger().missed(job, hours, SLOT_GRACE_MINUTES * 60)) for job, hours in SLOT_JOB_HOURS.items())
+        status_text += (f"🗓 Слот дайджеста {datetime.fromtimestamp(slot['planned_at'], PORTUGAL_TIMEZONE).strftime('%d.%m %H:%M')}: "
+                        f"{SLOT_STATUS_LABELS[slot['status']]} (попыток {slot['attempts']}), к досылке {missed}\n\n")
+    
     # Информация о канале
     if DIGEST_CHANNEL_ID:
         status_text += f"📢 Канал для публикации: {DIGEST_CHANNEL_ID}\n"
         status_text += f"📤 Автоматические дайджесты отправляются только в канал\n"
+        novelty = get_novelty_filter()
+        if novelty:
+            novelty_stats = novelty.stats()
+            status_text += (f"🧠 Память опубликованного: {novelty_stats['items']} отпечатков, "
+                            f"{novelty_stats['memory_bytes'] // 1024} КБ\n")
     else:
         status_text += f"📢 Канал для публикации: не настроен\n"
+    if page_archive:
+        archive_stats = page_archive.stats()
+        status_text += (f"🗄 Архив страниц: {archive_stats['pages']} страниц ({archive_stats['fetches']} загрузок), "
+                        f"{archive_stats['stored_bytes'] / 1024 / 1024:.1f} МБ\n")
+    if inline_cache.built_at is not None:
+        state = "актуален" if inline_cache.is_current(message_store.version) else "обновляется"
+        status_text += (f"🔎 Inline-ответы: снимок {time.time() - inline_cache.built_at:.0f} с назад ({state}), "
+                        f"{len(inline_cache.stories)} новостей, запросов из кэша {inline_cache.stats['hits']}\n")
+    if cluster_node is not None:
+        workers = await asyncio.to_thread(cluster_node.store.live_workers, CLUSTER_LEASE_SECONDS)
+        status_text += (f"🕸 Кластер: лидер {cluster_node.worker_id}, узлов {len(workers)}, "
+                        f"у лидера {len(cluster_node.owned)} из {CLUSTER_SHARDS} шардов\n")
     status_text += f"\n"
     
     if monitored_channels:
@@ -656,79 +1213,448 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         status_text += f"❌ Нет отслеживаемых каналов\n"
         status_text += f"Бот должен автоматически подписаться на каналы при запуске\n"
     
-    await update.message.reply_text(status_text)
+    await reply_text(update, status_text)
 
-async def version_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /version - показывает версию и время следующего дайджеста"""
-    now = datetime.now(PORTUGAL_TIMEZONE)
-    current_hour = now.hour
-    
-    # Определяем время следующего дайджеста
-    digest_times = [7, 9, 11, 13, 15, 17, 19, 21]
-    next_digest = None
+def format_subscription(subscription: dict) -> str:
+    """Описание настроек подписки для ответа пользователю"""
+    if subscription['channels']:
+        channel_titles = [message_store.channels.get(ch_id, {}).get('title', ch_id) for ch_id in subscription['channels']]
+        channels_text = ", ".join(channel_titles)
+    else:
+        channels_text = "все отслеживаемые каналы"
+    hours_text = ", ".join(f"{hour}:00" for hour in subscription['hours'])
+    
+    text = f"📬 Подписка: {'✅ активна' if subscription['active'] else '❌ отключена'}\n"
+    text += f"📋 Каналы: {channels_text}\n"
+    text += f"⏰ Время: {hours_text} (по португальскому времени)\n"
+    text += f"🎨 Стиль: {subscription['style']} - {DIGEST_STYLES[subscription['style']]}\n"
+    return text
+
+async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /subscribe - личные дайджесты по расписанию"""
+    subscription = get_subscription_store().subscribe(update.effective_user.id, update.effective_chat.id)
+    
+    response = "✅ Вы подписаны на личные дайджесты!\n\n"
+    response += format_subscription(subscription)
+    response += "\nНастройки: /my_channels, /schedule, /style. Отписаться: /unsubscribe"
+    await reply_text(update, response)
+
+async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /unsubscribe"""
+    if get_subscription_store().unsubscribe(update.effective_user.id):
+        await reply_text(update, "❌ Личные дайджесты отключены. Настройки сохранены - /subscribe включит их снова")
+    else:
+        await reply_text(update, "📭 У вас нет активной подписки. Используйте /subscribe")
+
+async def my_channels_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /my_channels [канал ...|all] - выбор каналов для личного дайджеста"""
+    user_id = update.effective_user.id
+    subscription = get_subscription_store().get(user_id)
+    if not subscription:
+        await reply_text(update, "📭 Сначала подпишитесь: /subscribe")
+        return
     
-    for time in digest_times:
-        if time > current_hour:
-            next_digest = time
-            break
+    if not context.args:
+        available = ", ".join(sorted(message_store.channels)) or "нет"
+        response = format_subscription(subscription)
+        response += f"\nДоступные каналы: {available}\n"
+        response += "Выбрать: /my_channels meduza tass\nВсе отслеживаемые: /my_channels all"
+        await reply_text(update, response)
+        return
     
-    if next_digest is None:
-        # Если сейчас после 21:00, следующий дайджест завтра в 7:00
-        next_digest = 7
-        next_digest_date = (now + timedelta(days=1)).strftime('%d.%m.%Y')
+    if context.args[0].lower() == 'all':
+        channels = []
     else:
-        next_digest_date = now.strftime('%d.%m.%Y')
-    
-    version_text = f"🤖 Версия бота: v2.0 (обновлено 28.08.2024)\n\n"
-    version_text += f"🕐 Текущее время (Португалия): {now.strftime('%d.%m.%Y %H:%M')}\n"
-    version_text += f"⏰ Следующий дайджест: {next_digest:02d}:00 {next_digest_date}\n\n"
-    version_text += f"📅 Расписание: каждые 2 часа (7:00-21:00)\n"
-    version_text += f"🌍 Часовой пояс: Португалия (UTC+1)\n"
-    version_text += f"📊 Статус: Активен и работает\n\n"
-    version_text += f"💡 Используйте /status для подробной информации"
+        channels = []
+        unknown = []
+        for arg in context.args:
+            channel_id = arg.lstrip('@')
+            if channel_id in message_store.channels:
+                channels.append(channel_id)
+            else:
+                unknown.append(arg)
+        if unknown:
+            await reply_text(update, 
+                f"❌ Неизвестные каналы: {', '.join(unknown)}\n"
+                f"Добавьте их командой /add_channel или посмотрите список: /my_channels"
+            )
+            return
     
-    await update.message.reply_text(version_text)
+    subscription = get_subscription_store().update(user_id, channels=list(dict.fromkeys(channels)))
+    await reply_text(update, "✅ Каналы обновлены\n\n" + format_subscription(subscription))
 
-async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /digest"""
-    await update.message.reply_text("🔄 Создаю сводку...")
+async def schedule_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /schedule 7 13 19 - часы отправки личного дайджеста"""
+    user_id = update.effective_user.id
+    if not get_subscription_store().get(user_id):
+        await reply_text(update, "📭 Сначала подпишитесь: /subscribe")
+        return
     
     try:
-        digest_text = await create_resonance_digest()
-        if digest_text:
-            # Отправляем в канал (если настроен)
-            if DIGEST_CHANNEL_ID:
-                try:
-                    await application_global.bot.send_message(
-                        chat_id=DIGEST_CHANNEL_ID,
-                        text=f"📰 СВОДКА ПО ЗАПРОСУ\n\n{digest_text}"
-                    )
-                    await update.message.reply_text(f"✅ Сводка отправлена в канал {DIGEST_CHANNEL_ID}")
-                except Exception as e:
-                    logger.error(f"Ошибка отправки в канал {DIGEST_CHANNEL_ID}: {e}")
-                    await update.message.reply_text(f"❌ Ошибка отправки в канал: {str(e)}")
-            else:
-                # Если канал не настроен, отправляем лично
-                await update.message.reply_text(digest_text)
-        else:
-            await update.message.reply_text("📭 Нет новых сообщений для создания сводки")
-    except Exception as e:
-        logger.error(f"Ошибка при создании сводки: {e}")
-        await update.message.reply_text(f"❌ Ошибка при создании сводки: {str(e)}")
-
-# СТАРАЯ ФУНКЦИЯ ПОЛНОГО ДАЙДЖЕСТА (ЗАКОММЕНТИРОВАНА, НО НЕ УДАЛЕНА)
-async def create_digest() -> str:
-    """Создает сводку в стиле 'что происходит в мире' для человека, который только проснулся"""
-    # ФУНКЦИЯ ОТКЛЮЧЕНА - ИСПОЛЬЗУЕТСЯ create_short_summary()
-    return "Функция отключена"
+        hours = sorted({int(arg.split(':')[0]) for arg in context.args})
+    except ValueError:
+        hours = []
+    if not hours or any(hour < 0 or hour > 23 for hour in hours):
+        await reply_text(update, "❌ Укажите часы от 0 до 23: /schedule 7 13 19")
+        return
     
-    # Получаем сообщения за последние 3 часа
-    all_messages = []
+    subscription = get_subscription_store().update(user_id, hours=hours)
+    await reply_text(update, "✅ Расписание обновлено\n\n" + format_subscription(subscription))
+
+async def style_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /style resonance|short - стиль личного дайджеста"""
+    user_id = update.effective_user.id
+    if not get_subscription_store().get(user_id):
+        await reply_text(update, "📭 Сначала подпишитесь: /subscribe")
+        return
     
-    # Добавляем отладочную информацию
-    logger.info(f"Создание сводки. Мониторинг каналов: {list(message_store.monitored_channels)}")
-    logger.info(f"Все каналы с сообщениями: {list(message_store.messages.keys())}")
-    logger.info(f"Всего каналов в хранилище: {len(message_store.channels)}")
+    style = context.args[0].lower() if context.args else ''
+    if style not in DIGEST_STYLES:
+        styles_text = "\n".join(f"• {name} - {description}" for name, description in DIGEST_STYLES.items())
+        await reply_text(update, f"❌ Укажите стиль: /style resonance\n\n{styles_text}")
+        return
+    
+    subscription = get_subscription_store().update(user_id, style=style)
+    await reply_text(update, "✅ Стиль обновлен\n\n" + format_subscription(subscription))
+
+CATEGORY_LABELS = {
+    'development': '🟢 Развитие/Сотрудничество',
+    'tension': '🔴 Напряженность/Конфликты',
+    'administrative': '⚪ Административные/Новости',
+}
+
+async def trends_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /trends [часы] - почасовая динамика повестки"""
+    hours = 12
+    if context.args:
+        try:
+            hours = int(context.args[0])
+        except ValueError:
+            await reply_text(update, "❌ Укажите число часов: /trends 12")
+            return
+    hours = max(1, min(hours, TREND_HOURS))
+    
+    now_hour = int(datetime.now(PORTUGAL_TIMEZONE).timestamp()) // 3600
+    
+    trends_text = f"📈 Тренды за последние {hours} ч\n\n"
+    
+    # Категории: сумма за период, изменение к предыдущему периоду и почасовой график
+    for category, label in CATEGORY_LABELS.items():
+        current = trend_store.total('category', category, hours, now_hour)
+        trends_text += f"{label}: {current}"
+        if hours * 2 <= TREND_HOURS:
+            previous = trend_store.total('category', category, hours, now_hour, offset=hours)
+            delta = current - previous
+            if delta:
+                trends_text += f" ({'▲' if delta > 0 else '▼'}{abs(delta)})"
+        trends_text += f"\n{sparkline(trend_store.hourly('category', category, hours, now_hour))}\n\n"
+    
+    top_countries = trend_store.top('country', hours, now_hour)
+    if top_countries:
+        trends_text += "🌍 Страны: " + ", ".join(
+            f"{get_gazetteer().name(country)} {count}" for country, count in top_countries
+        ) + "\n"
+    
+    top_keywords = trend_store.top('keyword', hours, now_hour, limit=8)
+    if top_keywords:
+        trends_text += "🔑 Ключевые слова: " + ", ".join(f"{keyword} {count}" for keyword, count in top_keywords) + "\n"
+    
+    if not top_countries and not top_keywords and not any(
+        trend_store.total('category', category, hours, now_hour) for category in CATEGORY_LABELS
+    ):
+        trends_text += "📭 Пока нет данных. Соберите сообщения командой /collect_messages"
+    
+    await reply_text(update, trends_text)
+
+def format_entity_counts(counts: Dict[str, int], limit: int = 5) -> str:
+    return ", ".join(f"{get_gazetteer().name(entity_id)} {count}" for entity_id, count in
+                     sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:limit])
+
+async def who_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /who <сущность> - упоминания страны, персоны или организации"""
+    channel_ids = set(message_store.monitored_channels)
+    query = ' '.join(context.args or [])
+    entity_id = get_gazetteer().resolve(query)
+    
+    if entity_id is None:
+        # Без аргумента или с незнакомым именем - самые упоминаемые сущности за сутки
+        counts = message_store.entities.counts(WHO_HOURS, channel_ids)
+        who_text = f"❓ Не знаю «{query}»\n\n" if query else ""
+        who_text += (describe_entities(counts, limit=5, title=f"🧭 Чаще всего за {WHO_HOURS} ч:")
+                     or "📭 Пока нет упоминаний\n\n")
+        who_text += "Подробнее: /who Россия, /who Путин, /who НАТО"
+        await reply_text(update, who_text)
+        return
+    
+    entity = get_gazetteer().entities[entity_id]
+    who_text = f"🔎 {entity['name']} ({KIND_LABELS[entity['kind']]})\n\n"
+    windows = sorted(set(ROLLING_WINDOW_HOURS) | {WHO_HOURS})
+    window_counts = [(hours, sum(message_store.entities.channel_counts(entity_id, hours, channel_ids).values()))
+                     for hours in windows]
+    who_text += "Упоминаний: " + " · ".join(f"{hours} ч - {count}" for hours, count in window_counts) + "\n"
+    
+    mentions = message_store.entities.mentions(entity_id, WHO_HOURS, channel_ids)
+    if not mentions:
+        who_text += f"\n📭 За {WHO_HOURS} ч упоминаний нет"
+        await reply_text(update, who_text)
+        return
+    
+    by_channel = message_store.entities.channel_counts(entity_id, WHO_HOURS, channel_ids)
+    titles = {ch_id: message_store.channels.get(ch_id, {}).get('title', ch_id) for ch_id in by_channel}
+    who_text += "📍 Источники: " + ", ".join(
+        f"{titles[ch_id]} {count}" for ch_id, count in sorted(by_channel.items(), key=lambda item: -item[1])[:5]) + "\n"
+    
+    # С кем упоминается вместе - по уже найденным сущностям тех же сообщений
+    related = defaultdict(int)
+    for _, _, msg in mentions:
+        for other_id in msg.get('entities') or get_gazetteer().extract(msg.get('text', '')):
+            if other_id != entity_id:
+                related[other_id] += 1
+    if related:
+        who_text += f"🔗 Рядом: {format_entity_counts(related)}\n"
+    
+    who_text += "\n📰 Последние упоминания:\n"
+    for ts, channel_id, msg in mentions[:WHO_MENTIONS]:
+        words = msg.get('text', '').split()
+        snippet = ' '.join(words[:20]) + ('...' if len(words) > 20 else '')
+        posted = datetime.fromtimestamp(ts, PORTUGAL_TIMEZONE).strftime('%H:%M') if ts != float('inf') else '--:--'
+        who_text += f"• {posted} {message_store.channels.get(channel_id, {}).get('title', channel_id)}: {snippet}\n"
+    await reply_text(update, who_text)
+
+def is_admin(update: Update) -> bool:
+    """Команда пришла от администратора из ADMIN_USER_ID"""
+    return bool(ADMIN_USER_ID) and update.effective_user.id == ADMIN_USER_ID
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /profile collect|digest [N] - профилирование следующих запусков"""
+    if not is_admin(update):
+        await reply_text(update, "⛔ Команда доступна только администратору")
+        return
+    
+    args = [arg.lower() for arg in context.args]
+    if args and args[0] in ('off', 'stop', 'cancel'):
+        if profiler.cancel():
+            await reply_text(update, "🛑 Профилирование отменено")
+        else:
+            await reply_text(update, "ℹ️ Профилирование не было включено")
+        return
+    
+    if not args or args[0] not in PROFILE_TARGETS:
+        session = profiler.status()
+        status_line = (
+            f"Сейчас: {PROFILE_TARGETS[session['target']]}, осталось запусков {session['remaining']}\n\n"
+            if session else ""
+        )
+        targets = "\n".join(f"• {target} - {label}" for target, label in PROFILE_TARGETS.items())
+        await reply_text(
+            update,
+            f"🔬 {status_line}Использование: /profile collect|digest [N]\n{targets}\n\n/profile off - отменить"
+        )
+        return
+    
+    try:
+        runs = int(args[1]) if len(args) > 1 else 1
+    except ValueError:
+        await reply_text(update, "❌ Число запусков должно быть целым числом")
+        return
+    runs = max(1, min(runs, 20))
+    
+    profiler.arm(args[0], runs, update.effective_chat.id)
+    logger.info(f"Профилирование {args[0]} включено на {runs} запусков пользователем {update.effective_user.id}")
+    await reply_text(
+        update,
+        f"🔬 Профилирую {PROFILE_TARGETS[args[0]]}: следующие {runs} запусков. "
+        f"Отчет (топ функций и мест выделения памяти) придет сюда"
+    )
+# Стадии, которые повторяются для каждого канала - в отчете сворачиваются в одну строку
+PER_CHANNEL_STAGES = ('fetch', 'parse', 'store')
+
+def format_trace_summary(record: dict) -> str:
+    """Одна строка о запуске для списка /trace"""
+    meta = record.get('meta', {})
+    window = f"окно {meta['window_hours']} ч" if meta.get('window_hours') else "без окна"
+    status = {'ok': "✅", 'cancelled': "⏹"}.get(record.get('status'), "❌")
+    return (
+        f"{status} {record['run_id']} {record['started_at'][5:16].replace('T', ' ')} {record['kind']}: "
+        f"{record.get('duration') or 0:.2f} с, {window}, сообщений {record.get('counts', {}).get('messages', 0)}"
+    )
+
+def format_trace(record: dict) -> str:
+    """Подробный отчет по трассе: стадии с таймингами, окно и причины отбрасывания"""
+    meta = record.get('meta', {})
+    counts = record.get('counts', {})
+    lines = [
+        f"🧵 Трасса {record['run_id']} ({record['kind']})",
+        f"🕐 {record['started_at']}, всего {record.get('duration') or 0:.2f} с, статус {record.get('status')}",
+    ]
+    if record.get('error'):
+        lines.append(f"❌ {record['error']}")
+    if meta.get('window_hours'):
+        fallback = f" (окно {DIGEST_WINDOWS[0]} ч было пустым)" if meta.get('fallback') else ""
+        lines.append(f"🪟 Окно {meta['window_hours']} ч{fallback}")
+    if counts:
+        lines.append("🔢 " + ", ".join(f"{key} {value}" for key, value in counts.items()))
+    if meta.get('top_news'):
+        scores = ", ".join(
+            f"{news['score']} ({news['channel']}){' 🔁' if news.get('repeat') else ''}" for news in meta['top_news'])
+        lines.append(f"🔥 Топ по резонансности: {scores}; порог входа {meta.get('cutoff_score')}")
+    drops = {reason: value for reason, value in record.get('drops', {}).items() if value}
+    if drops:
+        lines.append("🗑 Отброшено: " + ", ".join(f"{reason} {value}" for reason, value in drops.items()))
+    
+    lines.append("")
+    lines.append("⏱ Стадии (начало +с, длительность):")
+    per_channel = defaultdict(list)
+    for stage in record.get('stages', []):
+        if stage['stage'] in PER_CHANNEL_STAGES:
+            per_channel[stage['stage']].append(stage)
+            continue
+        fields = ", ".join(
+            f"{key}={value}" for key, value in stage.items() if key not in ('stage', 'start', 'duration')
+        )
+        lines.append(f"+{stage['start']:.3f} {stage['stage']}: {stage['duration']:.3f} с" + (f" ({fields})" if fields else ""))
+    for name in PER_CHANNEL_STAGES:
+        stages = per_channel.get(name)
+        if not stages:
+            continue
+        slowest = sorted(stages, key=lambda stage: stage['duration'], reverse=True)[:3]
+        failed = sum(1 for stage in stages if stage.get('error'))
+        lines.append(
+            f"  {name}: {len(stages)} каналов, сумма {sum(stage['duration'] for stage in stages):.3f} с"
+            + (f", ошибок {failed}" if failed else "")
+            + "; дольше всех: " + ", ".join(f"{stage['channel']} {stage['duration']:.3f} с" for stage in slowest)
+        )
+    return "\n".join(lines)
+
+async def trace_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /trace [run_id|last] - трассы последних запусков дайджеста"""
+    if not is_admin(update):
+        await reply_text(update, "⛔ Команда доступна только администратору")
+        return
+    
+    if not context.args:
+        records = trace_store.recent(10)
+        if not records:
+            await reply_text(update, "📭 Трасс пока нет - они появляются после каждого дайджеста")
+            return
+        trace_text = "🧵 Последние запуски дайджеста:\n\n" + "\n".join(format_trace_summary(record) for record in records)
+        trace_text += "\n\nПодробно: /trace <run_id> или /trace last"
+        await reply_text(update, trace_text)
+        return
+    
+    run_id = context.args[0].strip()
+    if run_id.lower() == 'last':
+        records = trace_store.recent(1)
+        record = records[0] if records else None
+    else:
+        record = trace_store.get(run_id)
+    if record is None:
+        await reply_text(update, f"❌ Трасса {run_id} не найдена")
+        return
+    await reply_text(update, format_trace(record))
+
+async def version_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /version - показывает версию и время следующего дайджеста"""
+    now = datetime.now(PORTUGAL_TIMEZONE)
+    current_hour = now.hour
+    
+    # Определяем время следующего дайджеста
+    next_digest = None
+    
+    for hour in DIGEST_HOURS:
+        if hour > current_hour:
+            next_digest = hour
+            break
+    
+    if next_digest is None:
+        # Если сейчас после 21:00, следующий дайджест завтра в 7:00
+        next_digest = 7
+        next_digest_date = (now + timedelta(days=1)).strftime('%d.%m.%Y')
+    else:
+        next_digest_date = now.strftime('%d.%m.%Y')
+    
+    version_text = f"🤖 Версия бота: v2.0 (обновлено 28.08.2024)\n\n"
+    version_text += f"🕐 Текущее время (Португалия): {now.strftime('%d.%m.%Y %H:%M')}\n"
+    version_text += f"⏰ Следующий дайджест: {next_digest:02d}:00 {next_digest_date}\n\n"
+    version_text += f"📅 Расписание: каждые 2 часа (7:00-21:00)\n"
+    version_text += f"🌍 Часовой пояс: Португалия (UTC+1)\n"
+    version_text += f"📊 Статус: Активен и работает\n\n"
+    version_text += f"💡 Используйте /status для подробной информации"
+    
+    await reply_text(update, version_text)
+
+async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /digest: сводка собирается в фоне, чат тем временем отвечает на другие команды"""
+    await reply_text(update, "🔄 Создаю сводку...")
+    start_digest_request(context.application, update.effective_chat.id, command_digest(update), update)
+
+async def command_digest(update: Update):
+    """Собирает и отправляет сводку по /digest"""
+    with start_trace(trace_store, 'command', user_id=update.effective_user.id):
+        try:
+            digest_text = await create_resonance_digest(publish=bool(DIGEST_CHANNEL_ID))
+            if digest_text:
+                # Отправляем в канал (если настроен)
+                if DIGEST_CHANNEL_ID:
+                    try:
+                        with tracing.stage('send', chat=DIGEST_CHANNEL_ID):
+                            await deliver(DIGEST_CHANNEL_ID, f"📰 СВОДКА ПО ЗАПРОСУ\n\n{digest_text}", PRIORITY_DIGEST)
+                        await reply_text(update, f"✅ Сводка отправлена в канал {DIGEST_CHANNEL_ID}")
+                    except Exception as e:
+                        logger.error(f"Ошибка отправки в канал {DIGEST_CHANNEL_ID}: {e}")
+                        tracing.fail(e)
+                        await reply_text(update, f"❌ Ошибка отправки в канал: {str(e)}")
+                else:
+                    # Если канал не настроен, отправляем лично
+                    with tracing.stage('send', chat=update.effective_chat.id):
+                        await reply_text(update, digest_text)
+            else:
+                await reply_text(update, "📭 Нет новых сообщений для создания сводки")
+        except Exception as e:
+            logger.error(f"Ошибка при создании сводки: {e}")
+            tracing.fail(e)
+            await reply_text(update, f"❌ Ошибка при создании сводки: {str(e)}")
+
+async def button_digest(update: Update):
+    """Собирает сводку по кнопке и показывает ее вместо сообщения с кнопками"""
+    query = update.callback_query
+    with start_trace(trace_store, 'button', user_id=update.effective_user.id):
+        try:
+            digest_text = await create_resonance_digest()
+            if digest_text:
+                with tracing.stage('send', chat=query.message.chat_id if query.message else None):
+                    await query.edit_message_text(digest_text)
+            else:
+                await query.edit_message_text("📭 Нет новых сообщений для создания сводки")
+        except asyncio.CancelledError as e:
+            # Сообщение "Создаю сводку..." иначе так и останется висеть
+            if 'replaced' in e.args:
+                await query.edit_message_text("⏹ Запрос заменен новым")
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при создании сводки: {e}")
+            tracing.fail(e)
+            await query.edit_message_text(f"❌ Ошибка при создании сводки: {str(e)}")
+
+async def bot_membership_changed(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Пользователь заблокировал бота или бота удалили из чата - сводку для него больше не собираем"""
+    member = update.my_chat_member
+    if member.new_chat_member.status in (ChatMember.LEFT, ChatMember.BANNED):
+        cancel_digest_request(member.chat.id, 'left')
+
+# СТАРАЯ ФУНКЦИЯ ПОЛНОГО ДАЙДЖЕСТА (ЗАКОММЕНТИРОВАНА, НО НЕ УДАЛЕНА)
+async def create_digest() -> str:
+    """Создает сводку в стиле 'что происходит в мире' для человека, который только проснулся"""
+    # ФУНКЦИЯ ОТКЛЮЧЕНА - ИСПОЛЬЗУЕТСЯ create_short_summary()
+    return "Функция отключена"
+    
+    # Получаем сообщения за последние 3 часа
+    all_messages = []
+    
+    # Добавляем отладочную информацию
+    logger.info(f"Создание сводки. Каналов в мониторинге: {len(message_store.monitored_channels)}")
+    logger.info(f"Каналов с сообщениями: {len(message_store.messages)}")
+    logger.info(f"Всего каналов в хранилище: {len(message_store.channels)}")
     
     # Получаем сообщения за последние 3 часа
     recent_messages = message_store.get_messages_for_period(3)
@@ -890,7 +1816,7 @@ async def create_digest() -> str:
         
         # Извлекаем ключевые факты из текста
         # Ищем упоминания стран, действий, цифр
-        if any(country in text.lower() for country in ['россия', 'украина', 'сша', 'китай', 'европа', 'германия', 'франция', 'великобритания', 'япония', 'индия', 'бразилия', 'канада', 'австралия', 'иран']):
+        if find_countries(text):
             # Сокращаем до ключевой информации
             words = text.split()
             if len(words) > 8:
@@ -929,203 +1855,112 @@ async def create_digest() -> str:
     
     return digest_text
 
-def calculate_resonance_score(text: str) -> int:
-    """Вычисляет резонансность новости (0-100)"""
-    text_lower = text.lower()
-    score = 0
-    
-    # Высокая резонансность - ключевые события
-    high_resonance_keywords = [
-        'война', 'конфликт', 'атака', 'нападение', 'санкции', 'кризис',
-        'президент', 'премьер', 'министр', 'решение', 'заявление',
-        'смерть', 'убийство', 'теракт', 'взрыв', 'пожар', 'катастрофа',
-        'выборы', 'референдум', 'голосование', 'отставка', 'назначение',
-        'суд', 'приговор', 'арест', 'задержание', 'розыск',
-        'экономика', 'инфляция', 'безработица', 'кризис', 'рецессия'
-    ]
-    
-    # Средняя резонансность - важные события
-    medium_resonance_keywords = [
-        'соглашение', 'договор', 'встреча', 'переговоры', 'саммит',
-        'инвестиции', 'проект', 'программа', 'реформа', 'закон',
-        'протест', 'демонстрация', 'забастовка', 'митинг',
-        'технологии', 'инновации', 'разработка', 'запуск'
-    ]
-    
-    # Подсчитываем очки
-    for keyword in high_resonance_keywords:
-        if keyword in text_lower:
-            score += 10
-    
-    for keyword in medium_resonance_keywords:
-        if keyword in text_lower:
-            score += 5
-    
-    # Бонус за упоминание стран/лидеров
-    countries = ['россия', 'украина', 'сша', 'китай', 'европа', 'германия', 'франция']
-    for country in countries:
-        if country in text_lower:
-            score += 3
-    
-    # Бонус за цифры (важные данные)
-    if re.search(r'\d+', text):
-        score += 2
-    
-    return min(score, 100)  # Максимум 100
-
-def smart_summarize(text: str) -> str:
-    """Умно сокращает новость, сохраняя смысл - ПОЛНОСТЬЮ ПЕРЕРАБОТАННАЯ ВЕРСИЯ"""
-    # Очищаем текст
-    text = text.strip()
-    
-    # Если текст короткий, возвращаем как есть
-    if len(text.split()) <= 12:
-        if not text.endswith(('.', '!', '?')):
-            text += '.'
-        return text
-    
-    # Ищем полные предложения в тексте
-    sentences = []
-    
-    # Разбиваем по знакам препинания, сохраняя их
-    parts = re.split(r'([.!?]+)', text)
-    
-    current_sentence = ""
-    for i in range(0, len(parts), 2):
-        if i < len(parts):
-            current_sentence += parts[i]
-            if i + 1 < len(parts):
-                current_sentence += parts[i + 1]
-                sentences.append(current_sentence.strip())
-                current_sentence = ""
-    
-    # Если есть остаток, добавляем его
-    if current_sentence.strip():
-        sentences.append(current_sentence.strip())
-    
-    # Если есть полные предложения, берем ПЕРВОЕ ПОЛНОЕ предложение
-    if sentences:
-        first_sentence = sentences[0].strip()
-        # Если первое предложение не слишком длинное (до 25 слов), берем его
-        if len(first_sentence.split()) <= 25:
-            return first_sentence
-        # Если слишком длинное, ищем более короткое предложение
-        for sentence in sentences:
-            if len(sentence.split()) <= 20:
-                return sentence
-    
-    # Если нет полных предложений или все слишком длинные, 
-    # берем первые 15 слов и добавляем точку
-    words = text.split()
-    if len(words) > 15:
-        result = ' '.join(words[:15])
-        if not result.endswith(('.', '!', '?')):
-            result += '.'
-        return result
-    else:
-        # Если слов меньше 15, возвращаем как есть
-        if not text.endswith(('.', '!', '?')):
-            text += '.'
-        return text
+# LLM-суммаризатор создается при первой сводке: клиент OpenAI и дисковый кэш резюме
+# не нужны, чтобы начать отвечать на команды (если выключен - работает только smart_summarize)
+llm_summarizer: Optional[LLMSummarizer] = None
+llm_summarizer_lock = threading.Lock()
 
-async def create_short_summary() -> str:
-    """Создает короткую сводку 'ЧТО ПРОИСХОДИТ В МИРЕ?' на основе последних новостей"""
-    all_messages = []
+def get_llm_summarizer() -> Optional[LLMSummarizer]:
+    """Возвращает LLM-суммаризатор, создавая его при первом обращении"""
+    global llm_summarizer
+    if not LLM_SUMMARIES_ENABLED:
+        return None
+    with llm_summarizer_lock:
+        if llm_summarizer is None:
+            llm_summarizer = LLMSummarizer(
+                api_key=OPENAI_API_KEY,
+                model=OPENAI_MODEL,
+                base_url=OPENAI_BASE_URL,
+                cache=SummaryCache(os.path.join(DATA_DIR, 'summary_cache.jsonl')),
+                fallback=smart_summarize,
+                token_budget=LLM_BATCH_TOKEN_BUDGET,
+                max_concurrency=LLM_MAX_CONCURRENCY,
+                timeout=LLM_TIMEOUT_SECONDS,
+            )
+    return llm_summarizer
 
-    logger.info(f"Создание короткой сводки. Мониторинг каналов: {list(message_store.monitored_channels)}")
-    logger.info(f"Все каналы с сообщениями: {list(message_store.messages.keys())}")
-    logger.info(f"Всего каналов в хранилище: {len(message_store.channels)}")
-    
-    # Получаем сообщения за последние 3 часа
-    recent_messages = message_store.get_messages_for_period(3)
-    
-    # Проверяем все каналы в мониторинге
-    for channel_id, messages in recent_messages.items():
-        channel_info = message_store.channels.get(channel_id, {})
-        channel_title = channel_info.get('title', f'Channel {channel_id}')
-        
-        logger.info(f"Канал {channel_id}: {len(messages)} сообщений за последние 3 часа")
-        
-        for msg in messages:
-            all_messages.append({
-                'channel': channel_title,
-                'text': msg.get('text', ''),
-                'author': msg.get('from_user', 'Unknown')
-            })
-    
-    # Если сообщений за 3 часа нет, попробуем за 6 часов
-    if not all_messages:
-        logger.info("Сообщений за 3 часа нет, пробуем за 6 часов")
-        recent_messages = message_store.get_messages_for_period(6)
-        
-        for channel_id, messages in recent_messages.items():
-            channel_info = message_store.channels.get(channel_id, {})
-            channel_title = channel_info.get('title', f'Channel {channel_id}')
-            
-            logger.info(f"Канал {channel_id}: {len(messages)} сообщений за последние 6 часов")
-            
-            for msg in messages:
-                all_messages.append({
-                    'channel': channel_title,
-                    'text': msg.get('text', ''),
-                    'author': msg.get('from_user', 'Unknown')
-                })
-    
-    logger.info(f"Всего собрано сообщений для сводки: {len(all_messages)}")
-    
-    if not all_messages:
-        return "📭 Нет сообщений для создания сводки. Попробуйте сначала собрать сообщения командой /collect_messages"
-    
-    # Создаем заголовок
-    summary_text = "🌍 ЧТО ПРОИСХОДИТ В МИРЕ?\n"
-    summary_text += f"📅 {datetime.now(PORTUGAL_TIMEZONE).strftime('%d.%m.%Y %H:%M')}\n\n"
-    
-    # Добавляем семантический анализ событий ПЕРВЫМ
-    summary_text += "📊 АНАЛИЗ СОБЫТИЙ:\n\n"
-    
-    # Анализируем тональность всех сообщений
-    development_count = 0
-    tension_count = 0
-    administrative_count = 0
-    
-    # Ключевые слова для анализа
-    development_keywords = [
-        'соглашение', 'договор', 'сотрудничество', 'партнерство', 'развитие', 'рост', 
-        'успех', 'достижение', 'мир', 'переговоры', 'диалог', 'встреча', 'саммит',
-        'инвестиции', 'проект', 'программа', 'инициатива', 'реформа', 'модернизация'
-    ]
-    
-    tension_keywords = [
-        'конфликт', 'война', 'нападение', 'атака', 'санкции', 'кризис', 'напряженность',
-        'противостояние', 'спор', 'разногласия', 'угроза', 'опасность', 'эскалация',
-        'блокада', 'изоляция', 'протест', 'беспорядки', 'столкновения', 'обстрел'
-    ]
-    
-    administrative_keywords = [
-        'объявил', 'сообщил', 'заявил', 'планирует', 'рассматривает', 'принял решение',
-        'назначил', 'отправил', 'получил', 'подписал', 'утвердил', 'одобрил', 'отклонил',
-        'заседание', 'совещание', 'конференция', 'пресс-релиз', 'официально', 'формально'
-    ]
-    
-    # Анализируем каждое сообщение
-    for msg in all_messages:
-        text_lower = msg['text'].lower()
-        
-        # Подсчитываем ключевые слова
-        dev_score = sum(1 for keyword in development_keywords if keyword in text_lower)
-        tension_score = sum(1 for keyword in tension_keywords if keyword in text_lower)
-        admin_score = sum(1 for keyword in administrative_keywords if keyword in text_lower)
-        
-        # Определяем категорию по максимальному счету
-        if dev_score > tension_score and dev_score > admin_score:
-            development_count += 1
-        elif tension_score > dev_score and tension_score > admin_score:
-            tension_count += 1
-        elif admin_score > 0:
-            administrative_count += 1
-        else:
-            # Если нет четких ключевых слов, считаем административным
-            administrative_count += 1
+async def summarize_stories(texts: List[str], cached_only: bool = False) -> List[str]:
+    """Сокращает пачку новостей через LLM, при недоступности модели - через smart_summarize.
+    cached_only: не обращаться к модели, брать резюме из кэша или smart_summarize"""
+    if not texts:
+        return []
+    summarizer = get_llm_summarizer()
+    if summarizer is None:
+        return [smart_summarize(text) for text in texts]
+    if cached_only:
+        return summarizer.summarize_cached(texts)
+    return await summarizer.summarize_many(texts)
+
+NO_MESSAGES_TEXT = "📭 Нет сообщений для создания сводки. Попробуйте сначала собрать сообщения командой /collect_messages"
+
+# Окна для дайджеста: если за 3 часа сообщений нет, берем 6 часов
+DIGEST_WINDOWS = (3, 6)
+
+async def get_window_analysis(hours: int, channel_ids=None) -> WindowAnalysis:
+    """Считает признаки каналов за окно один раз - из них собираются все дайджесты"""
+    with tracing.stage('window_query', hours=hours) as trace_fields:
+        window = message_store.get_messages_for_period(hours, channel_ids)
+        in_window = sum(len(messages) for messages in window.values())
+        scope = message_store.monitored_channels if channel_ids is None else channel_ids
+        stored = sum(len(message_store.messages.get(ch_id, [])) for ch_id in scope)
+        trace_fields.update(channels=len(window), messages=in_window, out_of_window=stored - in_window)
+    titles = {ch_id: message_store.channels.get(ch_id, {}).get('title', f'Channel {ch_id}') for ch_id in window}
+    with tracing.stage('scoring', hours=hours, channels=len(window)) as trace_fields:
+        if sharded_analyzer.should_use(in_window):
+            trace_fields['processes'] = sharded_analyzer.processes
+            return await digest_pool.run(sharded_analyzer.analyze_window, hours, window, titles, cancellable=True)
+        return await digest_pool.run(analyze_window, hours, window, titles, cancellable=True)
+
+async def select_digest(analyses: Dict[int, WindowAnalysis], scope, channel_ids=None,
+                        novelty: Optional[NoveltyFilter] = None) -> Optional[DigestSelection]:
+    """Выбирает окно с сообщениями для набора каналов; анализ окна считается лениво и переиспользуется"""
+    for hours in DIGEST_WINDOWS:
+        if hours not in analyses:
+            if hours != DIGEST_WINDOWS[0]:
+                logger.info(f"Сообщений за {DIGEST_WINDOWS[0]} часа нет, пробуем за {hours} часов")
+            analyses[hours] = await get_window_analysis(hours, scope)
+        if analyses[hours].has_messages(channel_ids):
+            selection = analyses[hours].select(
+                channel_ids,
+                is_published=novelty.is_published if novelty else None,
+                repeat_penalty=NOVELTY_REPEAT_PENALTY,
+            )
+            # Упоминания сущностей за то же окно - из индекса, без прохода по сообщениям
+            entity_scope = channel_ids if channel_ids is not None else (
+                scope if scope is not None else message_store.monitored_channels)
+            selection.entity_counts = message_store.entities.counts(hours, set(entity_scope))
+            return selection
+    return None
+
+def trace_selection(selection: Optional[DigestSelection], analyses: Dict[int, WindowAnalysis]):
+    """Записывает в трассу окно, причины отбрасывания и почему новости не прошли в топ"""
+    trace = tracing.current_trace()
+    if trace is None:
+        return
+    trace.set(windows_tried=sorted(analyses))
+    if selection is None:
+        trace.drop('no_messages')
+        return
+    # Только выбранное окно и каналы получателя - не сумма по всем пробованным окнам
+    for reason, count in selection.drops.items():
+        trace.drop(reason, count)
+    trace.count('messages', selection.message_count)
+    trace.count('candidates', selection.candidate_count)
+    trace.drop('below_top', selection.candidate_count - len(selection.top_news))
+    trace.drop('repeat', selection.repeats_demoted)
+    trace.set(
+        window_hours=max(analyses),
+        fallback=len(analyses) > 1,
+        top_news=[{'channel': news['channel'], 'score': news['score'], 'repeat': news['repeat']}
+                  for news in selection.top_news],
+        cutoff_score=selection.top_news[-1]['score'] if selection.top_news else None,
+    )
+
+def describe_agenda(category_counts: Dict[str, int]) -> str:
+    """Формирует блок 'АНАЛИЗ СОБЫТИЙ' по числу сообщений в каждой категории"""
+    development_count = category_counts['development']
+    tension_count = category_counts['tension']
+    administrative_count = category_counts['administrative']
     
     # Вычисляем общую метрику (0-10)
     total_analyzed = development_count + tension_count + administrative_count
@@ -1146,328 +1981,100 @@ async def create_short_summary() -> str:
     else:
         agenda_character = "Сбалансированный"
     
-    # Добавляем метрики в сводку
-    summary_text += f"📈 {world_score}/10\n\n"
-    summary_text += f"🟢 Развитие/Сотрудничество: {development_count}\n"
-    summary_text += f"🔴 Напряженность/Конфликты: {tension_count}\n"
-    summary_text += f"⚪ Административные/Новости: {administrative_count}\n\n"
-    summary_text += f"💭 Характер повестки: {agenda_character}\n\n"
-    
-    # Создаем краткое резюме на основе всех новостей
-    summary_facts = []
-    countries_mentioned = set()
+    agenda_text = "📊 АНАЛИЗ СОБЫТИЙ:\n\n"
+    agenda_text += f"📈 {world_score}/10\n\n"
+    agenda_text += f"🟢 Развитие/Сотрудничество: {development_count}\n"
+    agenda_text += f"🔴 Напряженность/Конфликты: {tension_count}\n"
+    agenda_text += f"⚪ Административные/Новости: {administrative_count}\n\n"
+    agenda_text += f"💭 Характер повестки: {agenda_character}\n\n"
+    return agenda_text
+
+ENTITY_KIND_EMOJI = {'country': '🌍', 'person': '👤', 'org': '🏛'}
+ENTITY_KIND_TITLES = {'country': 'Страны', 'person': 'Персоны', 'org': 'Организации'}
+
+def describe_entities(entity_counts: Dict[str, int], limit: int = ENTITY_SECTION_SIZE,
+                      title: str = "🧭 В ФОКУСЕ:") -> str:
+    """Блок 'В ФОКУСЕ': самые упоминаемые страны, персоны и организации окна"""
+    grouped = top_by_kind(entity_counts, limit)
+    lines = [
+        f"{ENTITY_KIND_EMOJI[kind]} {ENTITY_KIND_TITLES[kind]}: "
+        + ", ".join(f"{get_gazetteer().name(entity_id)} {count}" for entity_id, count in top)
+        for kind, top in grouped.items() if top
+    ]
+    if not lines:
+        return ""
+    return f"{title}\n" + "\n".join(lines) + "\n\n"
+
+def stories_to_summarize(selection: DigestSelection, style: str) -> List[str]:
+    """Тексты, которые нужно сократить для дайджеста данного стиля"""
+    if style == 'short':
+        return selection.fact_texts
+    return [news['text'] for news in selection.top_news]
+
+# Чистка склеенных фактов короткой сводки: шаблоны компилируются один раз при импорте
+SUMMARY_CLEANUP_PATTERNS = (
+    # Убираем двойные точки и делаем переходы плавными
+    (re.compile(r'\.\.+'), '.'),
+    (re.compile(r'\.\s*\.'), '. '),
+    # Убираем повторяющиеся числа с единицами измерения
+    (re.compile(r'(\b\d+\s*(тыс\.|млн|млрд|%|пунктов?|рублей?|долларов?))\s+\1'), r'\1'),
+    # Убираем повторяющиеся фразы из 2-3 слов
+    (re.compile(r'(\b\w+\s+\w+\s+\w+)\s+\1'), r'\1'),
+    (re.compile(r'(\b\w+\s+\w+)\s+\1'), r'\1'),
+    # Убираем повторяющиеся отдельные слова
+    (re.compile(r'(\b\w+)\s+\1'), r'\1'),
+    # Убираем лишние пробелы
+    (re.compile(r'\s+'), ' '),
+)
+
+def render_short_summary(selection: DigestSelection, summaries: Dict[str, str]) -> str:
+    """Собирает короткую сводку 'ЧТО ПРОИСХОДИТ В МИРЕ?' из готовых данных"""
+    summary_text = "🌍 ЧТО ПРОИСХОДИТ В МИРЕ?\n"
+    summary_text += f"📅 {datetime.now(PORTUGAL_TIMEZONE).strftime('%d.%m.%Y %H:%M')}\n\n"
     
-    for msg in all_messages:
-        text = msg['text']
-        
-        # Очищаем текст от рекламных фраз и мусора
-        # Если текст содержит рекламные фразы - ПРОПУСКАЕМ ЕГО ВООБЩЕ
-        text_lower = text.lower()
-        skip_phrases = [
-            'подписаться на', 'подпишись на', 'читать далее', 
-            'источник:', 'ссылка:', 'фото:', 'изображение:', 
-            'картинка:', 'снимок:', 'видео:', 'ролик:',
-            'подписывайтесь', 'подписывайся', 'читайте далее',
-            'больше новостей', 'следите за', 'следите за новостями',
-            'канал:', 'телеграм:', 't.me/', 'https://',
-            'реклама', 'рекламный', 'партнер', 'партнерский'
-        ]
-        
-        if any(phrase in text_lower for phrase in skip_phrases):
-            continue  # ПРОПУСКАЕМ ЭТУ НОВОСТЬ ВООБЩЕ
-        
-        # Очищаем от URL
-        text = re.sub(r'https?://[^\s]+', '', text)
-        text = re.sub(r'www\.[^\s]+', '', text)
-        text = re.sub(r'[^\w\s.,!?\-]', ' ', text)
-        text = re.sub(r'\s+', ' ', text)
-        
-        # Извлекаем ключевые факты из текста
-        country_keywords = ['россия', 'украина', 'сша', 'китай', 'европа', 'германия', 'франция', 
-                          'великобритания', 'япония', 'индия', 'бразилия', 'канада', 'австралия', 
-                          'иран', 'израиль', 'палестина', 'турция', 'саудовская аравия', 'египет',
-                          'норвегия', 'польша', 'чехия', 'словакия', 'венгрия', 'румыния', 'болгария',
-                          'греция', 'италия', 'испания', 'португалия', 'нидерланды', 'бельгия',
-                          'швейцария', 'австрия', 'швеция', 'финляндия', 'норвегия', 'дания']
-        
-        text_lower = text.lower()
-        mentioned_countries = [country for country in country_keywords if country in text_lower]
-        
-        # КАРДИНАЛЬНО УПРОЩЕННЫЕ ФИЛЬТРЫ: берем ВСЕ новости длиннее 3 слов
-        if len(text.strip()) > 3:
-            countries_mentioned.update(mentioned_countries)
-            
-            # Умно сокращаем новость, сохраняя смысл
-            fact = smart_summarize(text)
-            
-            # Если функция вернула None, пропускаем эту новость
-            if fact is None:
-                continue
-            
-            # Добавляем факт (убрали лишние проверки длины)
-            summary_facts.append(fact)
+    # Добавляем семантический анализ событий ПЕРВЫМ
+    summary_text += describe_agenda(selection.category_counts)
     
     # Создаем резюме в стиле "кто что делает"
+    summary_facts = [summaries[text] for text in selection.fact_texts if summaries.get(text)]
     if summary_facts:
-        # Берем оптимальное количество фактов для читаемости
-        selected_facts = summary_facts[:6]
-        
         # Объединяем в один читаемый абзац с правильными переходами
-        summary_content = ". ".join(selected_facts)
-        
-        # Убираем двойные точки и делаем переходы плавными
-        summary_content = re.sub(r'\.\.+', '.', summary_content)
-        summary_content = re.sub(r'\.\s*\.', '. ', summary_content)
+        summary_content = ". ".join(summary_facts)
         
-        # Убираем дублирование фраз (КАРДИНАЛЬНО УЛУЧШЕННАЯ ВЕРСИЯ)
-        # Убираем повторяющиеся числа с единицами измерения
-        summary_content = re.sub(r'(\b\d+\s*(тыс\.|млн|млрд|%|пунктов?|рублей?|долларов?))\s+\1', r'\1', summary_content)
-        # Убираем повторяющиеся фразы из 2-3 слов
-        summary_content = re.sub(r'(\b\w+\s+\w+\s+\w+)\s+\1', r'\1', summary_content)
-        summary_content = re.sub(r'(\b\w+\s+\w+)\s+\1', r'\1', summary_content)
-        # Убираем повторяющиеся отдельные слова
-        summary_content = re.sub(r'(\b\w+)\s+\1', r'\1', summary_content)
-        # Убираем лишние пробелы
-        summary_content = re.sub(r'\s+', ' ', summary_content)
+        for pattern, replacement in SUMMARY_CLEANUP_PATTERNS:
+            summary_content = pattern.sub(replacement, summary_content)
         
         summary_text += summary_content + "\n\n"
     else:
-        # Fallback: если нет фактов с упоминанием стран, берем любые значимые сообщения
-        fallback_facts = []
-        for msg in all_messages:
-            text = msg['text']
-            
-            # Очищаем текст от рекламных фраз и мусора
-            # Если текст содержит рекламные фразы - ПРОПУСКАЕМ ЕГО ВООБЩЕ
-            text_lower = text.lower()
-            skip_phrases = [
-                'подписаться на', 'подпишись на', 'читать далее', 
-                'источник:', 'ссылка:', 'фото:', 'изображение:', 
-                'картинка:', 'снимок:', 'видео:', 'ролик:',
-                'подписывайтесь', 'подписывайся', 'читайте далее',
-                'больше новостей', 'следите за', 'следите за новостями',
-                'канал:', 'телеграм:', 't.me/', 'https://',
-                'реклама', 'рекламный', 'партнер', 'партнерский'
-            ]
-            
-            if any(phrase in text_lower for phrase in skip_phrases):
-                continue  # ПРОПУСКАЕМ ЭТУ НОВОСТЬ ВООБЩЕ
-            
-            # Очищаем от URL
-            text = re.sub(r'https?://[^\s]+', '', text)
-            text = re.sub(r'www\.[^\s]+', '', text)
-            text = re.sub(r'[^\w\s.,!?\-]', ' ', text)
-            text = re.sub(r'\s+', ' ', text)
-            
-            if len(text.strip()) > 3:  # Снизили планку с 5 до 3 слов
-                fact = smart_summarize(text)
-                
-                # Если функция вернула None, пропускаем эту новость
-                if fact is None:
-                    continue
-                
-                fact = fact.strip()
-                if len(fact) > 5:  # Снизили планку с 8 до 5 символов
-                    fallback_facts.append(fact)
-                    if len(fallback_facts) >= 3:  # Уменьшили с 5 до 3 фактов для читаемости
-                        break
-        
-        if fallback_facts:
-            # Объединяем в один читаемый абзац
-            summary_content = ". ".join(fallback_facts)
-            summary_content = re.sub(r'\.\.+', '.', summary_content)
-            summary_content = re.sub(r'\.\s*\.', '. ', summary_content)
-            
-            # Убираем дублирование фраз (КАРДИНАЛЬНО УЛУЧШЕННАЯ ВЕРСИЯ)
-            # Убираем повторяющиеся числа с единицами измерения
-            summary_content = re.sub(r'(\b\d+\s*(тыс\.|млн|млрд|%|пунктов?|рублей?|долларов?))\s+\1', r'\1', summary_content)
-            # Убираем повторяющиеся фразы из 2-3 слов
-            summary_content = re.sub(r'(\b\w+\s+\w+\s+\w+)\s+\1', r'\1', summary_content)
-            summary_content = re.sub(r'(\b\w+\s+\w+)\s+\1', r'\1', summary_content)
-            # Убираем повторяющиеся отдельные слова
-            summary_content = re.sub(r'(\b\w+)\s+\1', r'\1', summary_content)
-            # Убираем лишние пробелы
-            summary_content = re.sub(r'\s+', ' ', summary_content)
-            summary_text += summary_content + "\n\n"
-        else:
-            # Если совсем нет фактов, добавляем общее резюме
-            summary_text += "Геополитическая ситуация остается сложной, страны принимают решения по ключевым вопросам.\n\n"
+        # Если совсем нет фактов, добавляем общее резюме
+        summary_text += "Геополитическая ситуация остается сложной, страны принимают решения по ключевым вопросам.\n\n"
     
-    # Добавляем краткую статистику
-    total_channels = len(set(msg['channel'] for msg in all_messages))
-    total_messages = len(all_messages)
+    summary_text += describe_entities(selection.entity_counts)
     
-    summary_text += f"📊 {total_channels} источников, {total_messages} сообщений за последние 3 часа"
+    # Добавляем краткую статистику
+    summary_text += f"📊 {selection.channel_count} источников, {selection.message_count} сообщений за последние 3 часа"
     
     return summary_text
 
-async def create_resonance_digest() -> str:
-    """Создает резонансный дайджест: метрики + 2-3 самые важные новости"""
-    all_messages = []
-
-    logger.info(f"Создание резонансного дайджеста. Мониторинг каналов: {list(message_store.monitored_channels)}")
-    
-    # Получаем сообщения за последние 3 часа
-    recent_messages = message_store.get_messages_for_period(3)
-    
-    # Проверяем все каналы в мониторинге
-    for channel_id, messages in recent_messages.items():
-        channel_info = message_store.channels.get(channel_id, {})
-        channel_title = channel_info.get('title', f'Channel {channel_id}')
-        
-        for msg in messages:
-            all_messages.append({
-                'channel': channel_title,
-                'text': msg.get('text', ''),
-                'author': msg.get('from_user', 'Unknown')
-            })
-    
-    # Если сообщений за 3 часа нет, попробуем за 6 часов
-    if not all_messages:
-        logger.info("Сообщений за 3 часа нет, пробуем за 6 часов")
-        recent_messages = message_store.get_messages_for_period(6)
-        
-        for channel_id, messages in recent_messages.items():
-            channel_info = message_store.channels.get(channel_id, {})
-            channel_title = channel_info.get('title', f'Channel {channel_id}')
-            
-            for msg in messages:
-                all_messages.append({
-                    'channel': channel_title,
-                    'text': msg.get('text', ''),
-                    'author': msg.get('from_user', 'Unknown')
-                })
-    
-    if not all_messages:
-        return "📭 Нет сообщений для создания сводки. Попробуйте сначала собрать сообщения командой /collect_messages"
-    
-    # Создаем заголовок
+def render_resonance_digest(selection: DigestSelection, summaries: Dict[str, str]) -> str:
+    """Собирает резонансный дайджест из готовых данных: метрики + 2-3 самые важные новости"""
     digest_text = "🌍 ЧТО ПРОИСХОДИТ В МИРЕ?\n"
     digest_text += f"📅 {datetime.now(PORTUGAL_TIMEZONE).strftime('%d.%m.%Y %H:%M')}\n\n"
     
     # Добавляем семантический анализ событий
-    digest_text += "📊 АНАЛИЗ СОБЫТИЙ:\n\n"
-    
-    # Анализируем тональность всех сообщений
-    development_count = 0
-    tension_count = 0
-    administrative_count = 0
-    
-    # Ключевые слова для анализа
-    development_keywords = [
-        'соглашение', 'договор', 'сотрудничество', 'партнерство', 'развитие', 'рост', 
-        'успех', 'достижение', 'мир', 'переговоры', 'диалог', 'встреча', 'саммит',
-        'инвестиции', 'проект', 'программа', 'инициатива', 'реформа', 'модернизация'
-    ]
-    
-    tension_keywords = [
-        'конфликт', 'война', 'нападение', 'атака', 'санкции', 'кризис', 'напряженность',
-        'противостояние', 'спор', 'разногласия', 'угроза', 'опасность', 'эскалация',
-        'блокада', 'изоляция', 'протест', 'беспорядки', 'столкновения', 'обстрел'
-    ]
-    
-    administrative_keywords = [
-        'объявил', 'сообщил', 'заявил', 'планирует', 'рассматривает', 'принял решение',
-        'назначил', 'отправил', 'получил', 'подписал', 'утвердил', 'одобрил', 'отклонил',
-        'заседание', 'совещание', 'конференция', 'пресс-релиз', 'официально', 'формально'
-    ]
-    
-    # Анализируем каждое сообщение
-    for msg in all_messages:
-        text_lower = msg['text'].lower()
-        
-        # Подсчитываем ключевые слова
-        dev_score = sum(1 for keyword in development_keywords if keyword in text_lower)
-        tension_score = sum(1 for keyword in tension_keywords if keyword in text_lower)
-        admin_score = sum(1 for keyword in administrative_keywords if keyword in text_lower)
-        
-        # Определяем категорию по максимальному счету
-        if dev_score > tension_score and dev_score > admin_score:
-            development_count += 1
-        elif tension_score > dev_score and tension_score > admin_score:
-            tension_count += 1
-        elif admin_score > 0:
-            administrative_count += 1
-        else:
-            administrative_count += 1
-    
-    # Вычисляем общую метрику (0-10)
-    total_analyzed = development_count + tension_count + administrative_count
-    if total_analyzed > 0:
-        world_score = ((development_count * 2 + administrative_count * 1 + tension_count * 0) / total_analyzed) * 5
-        world_score = round(world_score, 1)
-    else:
-        world_score = 5.0
-    
-    # Определяем характер повестки
-    if development_count > tension_count and development_count > administrative_count:
-        agenda_character = "Развитие"
-    elif tension_count > development_count and tension_count > administrative_count:
-        agenda_character = "Напряженный"
-    elif administrative_count > development_count and administrative_count > tension_count:
-        agenda_character = "Административный"
-    else:
-        agenda_character = "Сбалансированный"
-    
-    # Добавляем метрики в сводку
-    digest_text += f"📈 {world_score}/10\n\n"
-    digest_text += f"🟢 Развитие/Сотрудничество: {development_count}\n"
-    digest_text += f"🔴 Напряженность/Конфликты: {tension_count}\n"
-    digest_text += f"⚪ Административные/Новости: {administrative_count}\n\n"
-    digest_text += f"💭 Характер повестки: {agenda_character}\n\n"
+    digest_text += describe_agenda(selection.category_counts)
     
     # НОВАЯ СЕКЦИЯ: Топ-3 резонансные новости
     digest_text += "🔥 ТОП-3 РЕЗОНАНСНЫЕ НОВОСТИ:\n\n"
     
-    # Фильтруем и оцениваем новости по резонансности
-    resonance_news = []
-    
-    for msg in all_messages:
-        text = msg['text']
-        
-        # Очищаем текст от рекламных фраз и мусора
-        text_lower = text.lower()
-        skip_phrases = [
-            'подписаться на', 'подпишись на', 'читать далее', 
-            'источник:', 'ссылка:', 'фото:', 'изображение:', 
-            'картинка:', 'снимок:', 'видео:', 'ролик:',
-            'подписывайтесь', 'подписывайся', 'читайте далее',
-            'больше новостей', 'следите за', 'следите за новостями',
-            'канал:', 'телеграм:', 't.me/', 'https://',
-            'реклама', 'рекламный', 'партнер', 'партнерский'
-        ]
-        
-        if any(phrase in text_lower for phrase in skip_phrases):
-            continue  # Пропускаем рекламные сообщения
-        
-        # Очищаем от URL
-        clean_text = re.sub(r'https?://[^\s]+', '', text)
-        clean_text = re.sub(r'www\.[^\s]+', '', clean_text)
-        clean_text = re.sub(r'[^\w\s.,!?\-]', ' ', clean_text)
-        clean_text = re.sub(r'\s+', ' ', clean_text)
-        
-        if len(clean_text.strip()) > 10:  # Минимальная длина
-            # Вычисляем резонансность
-            resonance_score = calculate_resonance_score(clean_text)
-            
+    if selection.top_news:
+        for news in selection.top_news:
             # Умно сокращаем до 8-10 слов максимум
-            short_text = smart_summarize(clean_text)
+            short_text = summaries.get(news['text']) or smart_summarize(news['text'])
             words = short_text.split()
             if len(words) > 10:
                 short_text = ' '.join(words[:10]) + '...'
             
-            resonance_news.append({
-                'text': short_text,
-                'score': resonance_score,
-                'channel': msg['channel']
-            })
-    
-    # Сортируем по резонансности и берем топ-3
-    resonance_news.sort(key=lambda x: x['score'], reverse=True)
-    top_news = resonance_news[:3]
-    
-    if top_news:
-        for i, news in enumerate(top_news, 1):
             # Добавляем эмодзи в зависимости от резонансности
             if news['score'] >= 30:
                 emoji = "🚨"  # Высокая резонансность
@@ -1476,56 +2083,394 @@ async def create_resonance_digest() -> str:
             else:
                 emoji = "📢"  # Низкая резонансность
             
-            digest_text += f"{emoji} {news['text']}\n"
+            # Уже опубликованная новость, которая все равно осталась в топе, - обновление
+            marker = "🔁 " if news.get('repeat') else ""
+            digest_text += f"{emoji} {marker}{short_text}\n"
             digest_text += f"   📍 {news['channel']}\n\n"
     else:
         digest_text += "📭 Нет резонансных новостей за период\n\n"
     
-    # Добавляем краткую статистику
-    total_channels = len(set(msg['channel'] for msg in all_messages))
-    total_messages = len(all_messages)
+    digest_text += describe_entities(selection.entity_counts)
     
-    digest_text += f"📊 {total_channels} источников, {total_messages} сообщений за последние 3 часа"
+    # Добавляем краткую статистику
+    digest_text += f"📊 {selection.channel_count} источников, {selection.message_count} сообщений за последние 3 часа"
     
     return digest_text
 
+DIGEST_RENDERERS = {
+    'resonance': render_resonance_digest,
+    'short': render_short_summary,
+}
+
+def render_digests(selections: Dict, summaries: Dict[str, str], cancel_event=None) -> Dict:
+    """Рендерит готовые дайджесты; выполняется в пуле воркеров"""
+    digests = {}
+    for key, (style, selection) in selections.items():
+        check_cancelled(cancel_event)
+        if selection is None:
+            digests[key] = NO_MESSAGES_TEXT
+        else:
+            digests[key] = DIGEST_RENDERERS.get(style, render_resonance_digest)(selection, summaries)
+    return digests
+
+async def build_digests(requests_by_key: Dict, scope=None, novelty: Optional[NoveltyFilter] = None,
+                        background: bool = False) -> Dict:
+    """Собирает дайджесты для многих получателей из одного общего анализа.
+    
+    requests_by_key: ключ -> (набор каналов или None, стиль). Признаки каналов
+    считаются один раз на окно, новости сокращаются одной пачкой без повторов,
+    а на каждого получателя остается только дешевое слияние и рендер.
+    novelty: учитывать уже опубликованные новости и запомнить попавшие в топ.
+    background: фоновая сборка (inline-снимок) - без LLM и без сессий /profile digest.
+    """
+    profiling = contextlib.nullcontext() if background else profiler.profile('digest', send_profile_report)
+    async with profiling:
+        analyses = {}
+        selections = {}
+        for key, (channel_ids, style) in requests_by_key.items():
+            selections[key] = (style, await select_digest(analyses, scope, channel_ids, novelty))
+        if len(selections) == 1:
+            trace_selection(next(iter(selections.values()))[1], analyses)
+        else:
+            tracing.count('digests', len(selections))
+        
+        texts = []
+        for style, selection in selections.values():
+            if selection is not None:
+                texts.extend(stories_to_summarize(selection, style))
+        texts = list(dict.fromkeys(texts))
+        with tracing.stage('summarization', stories=len(texts), mode='cached' if background else 'llm' if LLM_SUMMARIES_ENABLED else 'extractive'):
+            summaries = dict(zip(texts, await summarize_stories(texts, cached_only=background)))
+        
+        with tracing.stage('render', digests=len(selections)):
+            digests = await digest_pool.run(render_digests, selections, summaries, cancellable=True)
+        if novelty is not None:
+            # Запоминаем при сборке: дайджест для канала уходит через outbox и будет доставлен
+            novelty.remember(news['text'] for _, selection in selections.values() if selection
+                             for news in selection.top_news)
+        return digests
+
+async def create_short_summary() -> str:
+    """Создает короткую сводку 'ЧТО ПРОИСХОДИТ В МИРЕ?' на основе последних новостей"""
+    logger.info(f"Создание короткой сводки. Каналов в мониторинге: {len(message_store.monitored_channels)}")
+    with DIGEST_BUILD_SECONDS.time(type='short'):
+        digests = await build_digests({'short': (None, 'short')})
+    return digests['short']
+
+async def create_resonance_digest(publish: bool = False) -> str:
+    """Создает резонансный дайджест: метрики + 2-3 самые важные новости.
+    
+    publish=True - дайджест для канала: недавно опубликованные новости опускаются
+    в топе, а вошедшие в него запоминаются.
+    """
+    logger.info(f"Создание резонансного дайджеста. Каналов в мониторинге: {len(message_store.monitored_channels)}")
+    with DIGEST_BUILD_SECONDS.time(type='resonance'):
+        digests = await build_digests({'resonance': (None, 'resonance')},
+                                      novelty=get_novelty_filter() if publish else None)
+    return digests['resonance']
+
+# Готовые ответы inline-режима и фоновая задача, которая их пересобирает
+inline_cache = InlineAnswerCache()
+inline_refresh_task: Optional[asyncio.Task] = None
+
+def rank_inline_stories(window: Dict[str, List[dict]], titles: Dict[str, str], limit: int) -> List[dict]:
+    """Новости окна для inline-поиска: без рекламы и повторов, самые резонансные первыми"""
+    stories = []
+    seen_texts = set()
+    for channel_id, messages in window.items():
+        for msg in messages:
+            text = msg.get('text', '')
+            if not text or text in seen_texts or is_promotional(text):
+                continue
+            seen_texts.add(text)
+            score = msg.get('resonance')
+            stories.append({
+                'channel': titles.get(channel_id, f'Channel {channel_id}'),
+                'text': text,
+                'lower': text.lower(),
+                'score': score if score is not None else calculate_resonance_score(text),
+                'timestamp': msg.get('timestamp', ''),
+            })
+    stories.sort(key=lambda story: (story['score'], story['timestamp']), reverse=True)
+    return stories[:limit]
+
+def inline_expires_at() -> float:
+    """Когда хранилище, скорее всего, изменится: следующий опрос для алертов или следующий слот"""
+    collected_at = message_store.last_collected_at or time.time()
+    interval = BURST_POLL_MINUTES * 60 if BURST_ALERTS_ENABLED else 2 * 3600
+    return collected_at + interval
+
+async def refresh_inline_answers():
+    """Пересобирает снимок inline-ответов, пока хранилище не перестанет меняться"""
+    version = None
+    while version != message_store.version:
+        version = message_store.version
+        await asyncio.sleep(INLINE_REFRESH_DELAY)
+        if version != message_store.version:
+            continue  # сбор еще идет
+        try:
+            with DIGEST_BUILD_SECONDS.time(type='inline'):
+                digests = await build_digests({'resonance': (None, 'resonance'), 'short': (None, 'short')},
+                                              background=True)
+                window = message_store.get_messages_for_period(24)
+                titles = {ch_id: message_store.channels.get(ch_id, {}).get('title', f'Channel {ch_id}') for ch_id in window}
+                stories = await digest_pool.run(rank_inline_stories, window, titles, INLINE_STORIES)
+            digests = {style: text for style, text in digests.items() if text != NO_MESSAGES_TEXT}
+            inline_cache.update(version, digests, stories, inline_expires_at())
+            logger.info(f"Inline-ответы обновлены: {len(digests)} дайджестов, {len(stories)} новостей")
+        except Exception as e:
+            logger.error(f"Ошибка обновления inline-ответов: {e}")
+            return
+
+def _start_inline_refresh():
+    global inline_refresh_task
+    if inline_refresh_task is None or inline_refresh_task.done():
+        inline_refresh_task = asyncio.create_task(refresh_inline_answers())
+
+def schedule_inline_refresh():
+    """Просит пересобрать inline-ответы в loop бота; можно вызывать из любого потока"""
+    loop = delivery_queue.loop
+    if loop is not None and not loop.is_closed():
+        loop.call_soon_threadsafe(_start_inline_refresh)
+
+message_store.listeners.append(schedule_inline_refresh)
+
+INLINE_DIGEST_QUERIES = {'', 'digest', 'дайджест', 'сводка'}
+
+async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Inline-запрос: дайджест или поиск новостей - только из готового снимка в памяти"""
+    query = update.inline_query
+    text = query.query.strip()
+    version = message_store.version
+    snapshot = inline_cache.version
+    results = []
+    if text.lower() in INLINE_DIGEST_QUERIES:
+        titles = {'resonance': ('📰 Резонансный дайджест', 'Метрики и топ новостей'),
+                  'short': ('🌍 Что происходит в мире', 'Короткая сводка одним абзацем')}
+        for style, digest_text in inline_cache.digests.items():
+            title, description = titles[style]
+            results.append(InlineQueryResultArticle(
+                id=f"{snapshot}:{style}",
+                title=title,
+                description=description,
+                input_message_content=InputTextMessageContent(digest_text[:TELEGRAM_MESSAGE_LIMIT]),
+            ))
+    else:
+        for index, story in enumerate(inline_cache.search(text)):
+            results.append(InlineQueryResultArticle(
+                id=f"{snapshot}:{index}",
+                title=story['text'][:64],
+                description=f"📍 {story['channel']}",
+                input_message_content=InputTextMessageContent(
+                    f"{story['text']}\n\n📍 {story['channel']}"[:TELEGRAM_MESSAGE_LIMIT]),
+            ))
+    try:
+        await query.answer(results, cache_time=inline_cache.cache_time(version), is_personal=False)
+    except Exception as e:
+        logger.error(f"Ошибка ответа на inline-запрос: {e}")
+
 # Глобальная переменная для приложения
 application_global = None
+bot_started = threading.Event()  # очередь доставки запущена, планировщик может досылать слоты
+
+
 
+# Тайминги последних плановых слотов (для /status)
+slot_timings = deque(maxlen=50)
+
+async def prefetch_for_slot():
+    """Заранее собирает сообщения перед плановым дайджестом"""
+    observe_scheduler_lag('prefetch', -PREFETCH_LEAD_MINUTES % 60)
+    try:
+        collect_seconds = await ensure_fresh_messages(PREFETCH_MAX_AGE_MINUTES * 60 / 2)
+        logger.info(f"Предварительный сбор перед дайджестом: {collect_seconds:.1f} с")
+    except Exception as e:
+        logger.error(f"Ошибка предварительного сбора: {e}")
 
+async def send_scheduled_digest(planned_at: Optional[float] = None, key: Optional[str] = None) -> bool:
+    """Отправляет автоматическую сводку по расписанию из уже собранных данных.
+    key - ключ слота из журнала задач: с ним повторный запуск слота не отправит сводку дважды.
+    Возвращает False, если сводку не удалось создать или отправить."""
+    if not application_global:
+        logger.error("Приложение не инициализировано")
+        return False
+    
+    started = time.perf_counter()
+    ok = True
+    slot_time = datetime.fromtimestamp(planned_at, PORTUGAL_TIMEZONE) if planned_at else datetime.now(PORTUGAL_TIMEZONE)
+    timing = {
+        'slot': slot_time.strftime('%d.%m %H:00'),
+        'lag': observe_scheduler_lag('digest', planned_at=planned_at),
+        'data_age': messages_age(),
+        'collect': 0.0,
+        'analysis': 0.0,
+        'send': 0.0,
+    }
+    
+    with start_trace(trace_store, 'scheduled', slot=timing['slot'], lag=round(timing['lag'], 1)) as trace:
+        timing['run_id'] = trace.run_id
+        try:
+            # Данные обычно уже собраны prefetch-задачей; если нет - собираем сейчас
+            timing['collect'] = await ensure_fresh_messages(PREFETCH_MAX_AGE_MINUTES * 60)
+            
+            # Создаем короткую сводку
+            analysis_started = time.perf_counter()
+            digest_text = await create_resonance_digest(publish=bool(DIGEST_CHANNEL_ID))
+            timing['analysis'] = time.perf_counter() - analysis_started
+            
+            # Отправляем дайджест в канал (если настроен)
+            if DIGEST_CHANNEL_ID:
+                send_started = time.perf_counter()
+                try:
+                    with tracing.stage('send', chat=DIGEST_CHANNEL_ID):
+                        await deliver(DIGEST_CHANNEL_ID, f"🌅 ЕЖЕДНЕВНАЯ СВОДКА\n\n{digest_text}", PRIORITY_DIGEST,
+                                      key=f"{key}:{DIGEST_CHANNEL_ID}" if key else None)
+                    logger.info(f"Автоматическая сводка отправлена в канал {DIGEST_CHANNEL_ID}")
+                except Exception as e:
+                    logger.error(f"Ошибка отправки в канал {DIGEST_CHANNEL_ID}: {e}")
+                    tracing.fail(e)
+                    ok = False
+                timing['send'] = time.perf_counter() - send_started
+            else:
+                logger.warning("DIGEST_CHANNEL_ID не настроен, автоматическая сводка не отправлена")
+            
+        except Exception as e:
+            logger.error(f"Ошибка при отправке автоматической сводки: {e}")
+            tracing.fail(e)
+            ok = False
+    
+    timing['total'] = time.perf_counter() - started
+    slot_timings.append(timing)
+    for stage in ('collect', 'analysis', 'send', 'total'):
+        SLOT_STAGE_SECONDS.observe(timing[stage], stage=stage)
+    logger.info(
+        f"Слот {timing['slot']}: сбор {timing['collect']:.1f} с, анализ {timing['analysis']:.2f} с, "
+        f"отправка {timing['send']:.2f} с, всего {timing['total']:.1f} с"
+    )
+    return ok
 
-async def send_scheduled_digest():
-    """Отправляет автоматическую сводку в 19:00"""
+async def send_subscriber_digests(hour: Optional[int] = None, planned_at: Optional[float] = None,
+                                  key: Optional[str] = None) -> bool:
+    """Рассылает личные дайджесты подписчикам, у которых в этот час стоит отправка.
+    С ключом слота key каждому чату уходит не больше одного дайджеста за слот.
+    Возвращает False, если дайджесты не удалось построить."""
     if not application_global:
         logger.error("Приложение не инициализировано")
+        return False
+    
+    if hour is None:
+        observe_scheduler_lag('subscribers', planned_at=planned_at)
+        slot_time = datetime.fromtimestamp(planned_at, PORTUGAL_TIMEZONE) if planned_at else datetime.now(PORTUGAL_TIMEZONE)
+        hour = slot_time.hour
+    due = get_subscription_store().due(hour)
+    if not due:
+        return True
+    
+    with start_trace(trace_store, 'subscribers', hour=hour, recipients=len(due)):
+        try:
+            await ensure_fresh_messages(PREFETCH_MAX_AGE_MINUTES * 60)
+            
+            # Один общий анализ на всех подписчиков, на каждого - только слияние и рендер
+            monitored = set(message_store.monitored_channels)
+            scope = monitored | get_subscription_store().subscribed_channels()
+            requests_by_key = {
+                subscription['user_id']: (subscription['channels'] or monitored, subscription['style'])
+                for subscription in due
+            }
+            with DIGEST_BUILD_SECONDS.time(type='subscribers'):
+                digests = await build_digests(requests_by_key, scope)
+            SUBSCRIBER_DIGESTS.observe(len(digests))
+        except Exception as e:
+            logger.error(f"Ошибка при создании личных дайджестов: {e}")
+            tracing.fail(e)
+            return False
+        
+        # Ставим все сообщения в очередь сразу - она сама соблюдает лимиты Telegram
+        with tracing.stage('send', recipients=len(due)):
+            results = await asyncio.gather(*(
+                deliver(subscription['chat_id'], f"📬 ВАШ ДАЙДЖЕСТ\n\n{digests[subscription['user_id']]}", PRIORITY_BULK,
+                        key=f"{key}:{subscription['chat_id']}" if key else None)
+                for subscription in due
+            ), return_exceptions=True)
+        sent = 0
+        for subscription, result in zip(due, results):
+            if isinstance(result, Exception):
+                logger.error(f"Ошибка отправки личного дайджеста пользователю {subscription['user_id']}: {result}")
+            else:
+                sent += 1
+        
+        tracing.count('sent', sent)
+        logger.info(f"Личные дайджесты отправлены: {sent} из {len(due)}")
+    
+    # Недоставленные (бот заблокирован и т.п.) не делают слот неудачным - повтор их не исправит
+    return True
+
+async def dispatch_burst_alerts():
+    """Отбирает накопленные всплески с учетом cooldown и отправляет срочный алерт"""
+    events = burst_detector.filter_alerts(pending_burst_events, time.time())
+    pending_burst_events.clear()
+    if not events:
+        return
+    
+    logger.info(f"Обнаружены всплески: {events}")
+    
+    if not DIGEST_CHANNEL_ID or not application_global:
+        logger.warning("DIGEST_CHANNEL_ID не настроен, срочный алерт не отправлен")
         return
     
     try:
-        # Собираем свежие сообщения
-        await collect_real_messages()
-        
-        # Создаем короткую сводку
-        digest_text = await create_resonance_digest()
-        
-        # Отправляем дайджест в канал (если настроен)
-        if DIGEST_CHANNEL_ID:
-            try:
-                await application_global.bot.send_message(
-                    chat_id=DIGEST_CHANNEL_ID,
-                    text=f"🌅 ЕЖЕДНЕВНАЯ СВОДКА\n\n{digest_text}"
-                )
-                logger.info(f"Автоматическая сводка отправлена в канал {DIGEST_CHANNEL_ID}")
-            except Exception as e:
-                logger.error(f"Ошибка отправки в канал {DIGEST_CHANNEL_ID}: {e}")
-        
-        # Отправляем только в канал (не дублируем в бота)
-        if DIGEST_CHANNEL_ID:
-            logger.info(f"Автоматическая сводка отправлена в канал {DIGEST_CHANNEL_ID}")
-        else:
-            logger.warning("DIGEST_CHANNEL_ID не настроен, автоматическая сводка не отправлена")
-            
+        with DIGEST_BUILD_SECONDS.time(type='alert'):
+            alert_text = await create_breaking_alert(events)
+        if alert_text:
+            await deliver(DIGEST_CHANNEL_ID, alert_text, PRIORITY_ALERT)
+            logger.info(f"Срочный алерт отправлен в канал {DIGEST_CHANNEL_ID}")
     except Exception as e:
-        logger.error(f"Ошибка при отправке автоматической сводки: {e}")
+        logger.error(f"Ошибка при отправке срочного алерта: {e}")
+
+async def create_breaking_alert(events) -> Optional[str]:
+    """Создает короткий срочный дайджест по обнаруженным всплескам"""
+    recent_messages = message_store.get_messages_for_period(1)
+    keywords = [event.key for event in events if event.kind == 'keyword']
+    channels = {event.key for event in events if event.kind == 'channel'}
+    
+    candidates = []
+    for channel_id, messages in recent_messages.items():
+        channel_title = message_store.channels.get(channel_id, {}).get('title', f'Channel {channel_id}')
+        for msg in messages:
+            text = msg.get('text', '')
+            if is_promotional(text):
+                continue
+            text_lower = text.lower()
+            if channel_id in channels or any(keyword in text_lower for keyword in keywords):
+                candidates.append({
+                    'text': text,
+                    'score': calculate_resonance_score(text),
+                    'channel': channel_title
+                })
+    
+    if not candidates:
+        return None
+    
+    candidates.sort(key=lambda x: x['score'], reverse=True)
+    top_news = candidates[:3]
+    summaries = await summarize_stories([news['text'] for news in top_news])
+    
+    alert_text = "🚨 СРОЧНО\n"
+    alert_text += f"📅 {datetime.now(PORTUGAL_TIMEZONE).strftime('%d.%m.%Y %H:%M')}\n\n"
+    
+    for event in events:
+        if event.kind == 'keyword':
+            alert_text += f"📈 «{event.key}»: {event.channels} каналов за последние минуты\n"
+        else:
+            channel_title = message_store.channels.get(event.key, {}).get('title', event.key)
+            alert_text += f"📈 {channel_title}: всплеск публикаций ({event.value:.0f}/ч)\n"
+    alert_text += "\n"
+    
+    for news, short_text in zip(top_news, summaries):
+        alert_text += f"⚡ {short_text}\n"
+        alert_text += f"   📍 {news['channel']}\n\n"
+    
+    return alert_text.rstrip()
 
 async def send_test_digest():
     """Отправляет тестовую сводку"""
@@ -1535,17 +2480,14 @@ async def send_test_digest():
     
     try:
         # Собираем свежие сообщения
-        await collect_real_messages()
+        await collect_on_request()
         
         # Создаем сводку
         digest_text = await create_resonance_digest()
         
         # Отправляем тестовую сводку
         if ADMIN_USER_ID:
-            await application_global.bot.send_message(
-                chat_id=ADMIN_USER_ID,
-                text=f"🧪 **ТЕСТОВАЯ СВОДКА** (проверка работы)\n\n{digest_text}"
-            )
+            await deliver(ADMIN_USER_ID, f"🧪 **ТЕСТОВАЯ СВОДКА** (проверка работы)\n\n{digest_text}", PRIORITY_DIGEST)
             logger.info(f"Тестовая сводка отправлена пользователю {ADMIN_USER_ID}")
         else:
             logger.warning("ADMIN_USER_ID не настроен, тестовая сводка не отправлена")
@@ -1556,51 +2498,219 @@ async def send_test_digest():
     except Exception as e:
         logger.error(f"Ошибка при отправке автоматической сводки: {e}")
 
+def plan_slots(hours_ahead: float = 24):
+    """Записывает в журнал слоты на ближайшие часы: после перезапуска по ним видно пропущенные"""
+    now = time.time()
+    for job, hours in SLOT_JOB_HOURS.items():
+        for planned_at in slot_times(hours, now, now + hours_ahead * 3600):
+            get_job_ledger().plan(job, planned_at)
+
+def run_slot(job: str, planned_at: Optional[float] = None):
+    """Выполняет плановый слот через журнал задач; отправленный или уже идущий слот пропускается"""
+    if planned_at is None:
+        # Последний наступивший слот задачи - даже если планировщик опоздал больше чем на час
+        now = time.time()
+        planned_at = slot_times(SLOT_JOB_HOURS[job], now - 86400, now)[-1]
+    key = get_job_ledger().begin(job, planned_at)
+    if key is None:
+        logger.info(f"Слот {slot_key(job, planned_at)} уже выполнен, выполняется или исчерпал попытки")
+        return
+    
+    ok, error = False, ''
+    try:
+        if job == 'digest':
+            ok = asyncio.run(send_scheduled_digest(planned_at, key))
+        else:
+            ok = asyncio.run(send_subscriber_digests(planned_at=planned_at, key=key))
+    except Exception as e:
+        logger.error(f"Ошибка слота {key}: {e}")
+        error = str(e)
+    get_job_ledger().finish(key, ok, error)
+
+def catch_up_missed_slots():
+    """Досылает слоты не старше SLOT_GRACE_MINUTES, пропущенные из-за перезапуска, простоя или ошибки"""
+    for job, hours in SLOT_JOB_HOURS.items():
+        for planned_at in get_job_ledger().missed(job, hours, SLOT_GRACE_MINUTES * 60):
+            logger.warning(f"Досылаем пропущенный слот {slot_key(job, planned_at)}")
+            run_slot(job, planned_at)
+
 def run_scheduler():
     """Запускает планировщик задач"""
-    # Сводки каждые 2 часа с 7:00 до 21:00 по португальскому времени
-    schedule.every().day.at("07:00").do(lambda: asyncio.run(send_scheduled_digest()))
-    schedule.every().day.at("09:00").do(lambda: asyncio.run(send_scheduled_digest()))
-    schedule.every().day.at("11:00").do(lambda: asyncio.run(send_scheduled_digest()))
-    schedule.every().day.at("13:00").do(lambda: asyncio.run(send_scheduled_digest()))
-    schedule.every().day.at("15:00").do(lambda: asyncio.run(send_scheduled_digest()))
-    schedule.every().day.at("17:00").do(lambda: asyncio.run(send_scheduled_digest()))
-    schedule.every().day.at("19:00").do(lambda: asyncio.run(send_scheduled_digest()))
-    schedule.every().day.at("21:00").do(lambda: asyncio.run(send_scheduled_digest()))
+    import schedule  # нужен только потоку планировщика
+    
+    # Сводки каждые 2 часа с 7:00 до 21:00 по португальскому времени,
+    # сообщения собираются заранее, чтобы в сам слот оставалось только отрендерить дайджест
+    for hour in DIGEST_HOURS:
+        prefetch_minutes = (hour * 60 - PREFETCH_LEAD_MINUTES) % (24 * 60)
+        schedule.every().day.at(f"{prefetch_minutes // 60:02d}:{prefetch_minutes % 60:02d}").do(
+            lambda: asyncio.run(prefetch_for_slot())
+        )
+        schedule.every().day.at(f"{hour:02d}:00").do(run_slot, 'digest')
+    
+    # Личные дайджесты подписчиков - каждый час по их расписанию
+    schedule.every().hour.at(":00").do(run_slot, 'subscribers')
+    
+    # Журнал слотов: планируем сутки вперед и досылаем пропущенное
+    schedule.every().hour.at(":30").do(plan_slots)
+    schedule.every(5).minutes.do(catch_up_missed_slots)
+    
+    # Частый опрос каналов для срочных алертов (в том числе ночью)
+    if BURST_ALERTS_ENABLED:
+        schedule.every(BURST_POLL_MINUTES).minutes.do(
+            lambda: asyncio.run(ensure_fresh_messages(BURST_POLL_MINUTES * 60 / 2))
+        )
     
     # Тестовая сводка через 2 минуты после запуска (только для проверки)
     # schedule.every(2).minutes.do(lambda: asyncio.run(send_test_digest()))
     
+    # Слоты, пропущенные пока бот не работал, - как только очередь доставки запущена
+    if not bot_started.wait(120):
+        logger.warning("Бот не запустился за 120 с, пропущенные слоты будут досланы позже")
+    plan_slots()
+    catch_up_missed_slots()
+    
     while True:
         schedule.run_pending()
-        time.sleep(60)  # Проверяем каждую минуту
+        time.sleep(1)  # Проверяем каждую секунду, чтобы слоты не опаздывали
 
-def main():
-    """Основная функция"""
-    if not TELEGRAM_BOT_TOKEN:
-        logger.error("TELEGRAM_BOT_TOKEN не настроен")
-        return
-    
-    # Создаем приложение
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-    
-    # Сохраняем глобальную ссылку на приложение
-    global application_global
-    application_global = application
+async def on_startup(application: Application):
+    """Запускает фоновые подсистемы в event loop бота"""
+    await delivery_queue.start(application.bot)
+    if cluster_node is not None:
+        # Лидер берет то, что узлы уже собрали, до первого обновления пользователей
+        await sync_from_cluster()
+    bot_started.set()
+    _start_inline_refresh()
+
+async def on_shutdown(application: Application):
+    """Досылает очередь сообщений перед остановкой"""
+    await delivery_queue.stop()
+
+def build_application() -> Application:
+    """Создает приложение бота и регистрирует все обработчики"""
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .concurrent_updates(PerChatUpdateProcessor(UPDATE_CONCURRENCY))
+    )
+    if TELEGRAM_API_BASE_URL:
+        # Локальный или фейковый Bot API (например, tools/fake_bot_api.py)
+        base_url = TELEGRAM_API_BASE_URL.rstrip('/')
+        builder = builder.base_url(f"{base_url}/bot").base_file_url(f"{base_url}/file/bot")
+    application = builder.build()
     
     # Добавляем обработчики команд
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("digest", digest_command))
+    application.add_handler(ChatMemberHandler(bot_membership_changed, ChatMemberHandler.MY_CHAT_MEMBER))
     application.add_handler(CommandHandler("manage_channels", manage_channels))
     application.add_handler(CommandHandler("add_channel", add_channel))
     application.add_handler(CommandHandler("collect_messages", collect_messages_command))
     application.add_handler(CommandHandler("status", status))
     application.add_handler(CommandHandler("list_channels", list_channels))
     application.add_handler(CommandHandler("version", version_command))
-    
-    # Обработчик callback'ов для кнопок (только для manage_channels)
+    application.add_handler(CommandHandler("trends", trends_command))
+    application.add_handler(CommandHandler("who", who_command))
+    application.add_handler(CommandHandler("subscribe", subscribe_command))
+    application.add_handler(CommandHandler("unsubscribe", unsubscribe_command))
+    application.add_handler(CommandHandler("my_channels", my_channels_command))
+    application.add_handler(CommandHandler("schedule", schedule_command))
+    application.add_handler(CommandHandler("style", style_command))
+    application.add_handler(CommandHandler("profile", profile_command))
+    application.add_handler(CommandHandler("trace", trace_command))
+    
+    # Обработчик callback'ов для кнопок
     application.add_handler(CallbackQueryHandler(handle_callback))
+    # Файл со списком каналов для импорта
+    application.add_handler(MessageHandler(
+        filters.Document.FileExtension('txt') | filters.Document.FileExtension('csv'), import_channels_file))
+    
+    # Строка поиска после кнопки «🔍 Поиск» в меню каналов
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, channel_search_input))
+    
+    # Inline-режим (@bot дайджест, @bot <слово>) - нужно включить в @BotFather командой /setinline
+    application.add_handler(InlineQueryHandler(inline_query_handler))
+    return application
+
+async def run_webhook(application: Application, stop_event: Optional[asyncio.Event] = None):
+    """Работа через вебхук: свой HTTP-сервер, без опроса getUpdates.
+    
+    Останавливается по SIGTERM/SIGINT (или stop_event): сначала сервер перестает
+    принимать запросы и дожидается начатых, затем приложение обрабатывает все
+    принятые обновления, и только после этого досылается очередь доставки.
+    """
+    if stop_event is None:
+        stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows или не главный поток
+    
+    server = WebhookServer(
+        application,
+        host=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        path=WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET_TOKEN,
+        health_info=lambda: {
+            'delivery_pending': delivery_queue.pending(),
+            'digest_requests': len(digest_requests),
+            'data_age': messages_age(),
+        },
+    )
+    
+    await application.initialize()
+    await on_startup(application)
+    await application.start()
+    try:
+        await server.start()
+        webhook_url = WEBHOOK_URL.rstrip('/') + server.path
+        await application.bot.set_webhook(
+            url=webhook_url,
+            secret_token=WEBHOOK_SECRET_TOKEN,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=True,
+        )
+        logger.info(f"Бот запущен в режиме вебхука: {webhook_url}")
+        await stop_event.wait()
+        logger.info("Получен сигнал остановки, завершаем обработку обновлений...")
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+        await on_shutdown(application)
+        await application.shutdown()
+
+def main():
+    """Основная функция"""
+    if not TELEGRAM_BOT_TOKEN:
+        logger.error("TELEGRAM_BOT_TOKEN не настроен")
+        return
+    
+    # Создаем приложение
+    application = build_application()
+    
+    # Процессы анализа создаются fork'ом - до запуска остальных потоков
+    sharded_analyzer.start()
+    
+    if METRICS_PORT:
+        try:
+            start_metrics_server(METRICS_HOST, METRICS_PORT)
+        except OSError as e:
+            logger.error(f"Не удалось запустить эндпоинт метрик на {METRICS_HOST}:{METRICS_PORT}: {e}")
+    
+    # В кластере бота, расписание и доставку запускает только лидер, остальные узлы только собирают
+    if CLUSTER_DB:
+        start_cluster_node()
+    
+    # Сохраняем глобальную ссылку на приложение
+    global application_global
+    application_global = application
     
     # Автоматически подписываемся на все предустановленные каналы
     logger.info("Автоматически подписываемся на все предустановленные каналы...")
@@ -1611,20 +2721,34 @@ def main():
     
     logger.info(f"Всего подписано на {len(PREDEFINED_CHANNELS)} каналов")
     
+    if cluster_node is not None:
+        # Лидер раздает узлам свой список каналов, собранное забирает в on_startup
+        publish_cluster_channels()
+    else:
+        # Последние страницы каналов из архива - сводки доступны до первого сбора
+        restore_messages_from_archive()
+    
     # Запускаем планировщик в отдельном потоке
     scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
     scheduler_thread.start()
     logger.info("Планировщик автоматических сводок запущен (7:00, 9:00, 11:00, 13:00, 15:00, 17:00, 19:00, 21:00 каждый день по португальскому времени)")
     
-    # Запускаем бота с обработкой ошибок
-    logger.info("Бот запущен")
-    try:
-        application.run_polling(drop_pending_updates=True)
-    except Exception as e:
-        logger.error(f"Ошибка при запуске бота: {e}")
-        # Пробуем перезапустить через 5 секунд
-        time.sleep(5)
-        application.run_polling(drop_pending_updates=True)
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook(application))
+    else:
+        # Запускаем бота с обработкой ошибок
+        logger.info("Бот запущен")
+        try:
+            application.run_polling(drop_pending_updates=True)
+        except Exception as e:
+            logger.error(f"Ошибка при запуске бота: {e}")
+            # Пробуем перезапустить через 5 секунд
+            time.sleep(5)
+            application.run_polling(drop_pending_updates=True)
+    
+    if cluster_node is not None:
+        # Отпускаем аренды, чтобы другой узел сразу стал лидером
+        cluster_node.stop()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,193 @@
+"""Реестр метрик в текстовом формате Prometheus и HTTP-эндпоинт для их выдачи"""
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы по умолчанию - в секундах, от быстрых стадий до медленной загрузки
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 131072, 262144, 524288, 1048576, 4194304)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 15, 20, 50, 100)
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """Общая часть метрик: имя, описание, набор меток и значения по наборам меток"""
+
+    kind = 'untyped'
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, documentation: str, labels: Sequence[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labels}, получены {tuple(labels)}")
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _label_text(self, key: Tuple[str, ...], extra: Sequence[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{label}="{escape_label(value)}"' for label, value in pairs) + '}'
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{self._label_text(key)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.values[key] = float(value)
+
+
+class Histogram(Metric):
+    """Гистограмма с фиксированными границами: счетчики по корзинам, сумма и количество"""
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labels=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][index] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет длительность блока with в секундах"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, state in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state['counts']):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self._label_text(key, [('le', format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(key)} {format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{self._label_text(key)} {state['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """Набор метрик процесса; безопасен для вызовов из разных потоков"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.metrics: Dict[str, Metric] = {}
+        self.callbacks: List[Callable[[], None]] = []
+
+    def _register(self, metric: Metric) -> Metric:
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self, name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(self, name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(self, name, documentation, labels, buckets))
+
+    def add_callback(self, callback: Callable[[], None]):
+        """Функция, которая обновляет датчики перед каждой выдачей метрик"""
+        self.callbacks.append(callback)
+
+    def render(self) -> str:
+        for callback in self.callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Ошибка обновления метрик: {e}")
+        with self.lock:
+            lines = []
+            for name in sorted(self.metrics):
+                lines.extend(self.metrics[name].render())
+        return '\n'.join(lines) + '\n'
+
+
+# Реестр по умолчанию: модули объявляют в нем свои метрики при импорте
+registry = MetricsRegistry()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Отдает метрики на GET /metrics"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0].rstrip('/') not in ('', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(host: str = '127.0.0.1', port: int = 9108,
+                         metrics_registry: Optional[MetricsRegistry] = None) -> ThreadingHTTPServer:
+    """Запускает HTTP-эндпоинт метрик в фоновом потоке"""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.registry = metrics_registry or registry
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f"Метрики доступны на http://{host}:{server.server_address[1]}/metrics")
+    return server
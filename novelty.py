@@ -0,0 +1,196 @@
+"""Память опубликованных новостей: вращающийся фильтр Блума с затуханием по времени.
+
+Каждое поколение фильтра живет generation_hours часов; самое старое поколение
+выбрасывается целиком, поэтому память ограничена max_generations поколениями
+фиксированного размера, сколько бы бот ни работал. Проверка новости - несколько
+хешей по ограниченному числу шинглов, то есть O(1) на кандидата.
+"""
+import os
+import re
+import math
+import time
+import struct
+import hashlib
+import logging
+import threading
+from collections import deque
+from typing import Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = re.compile(r'\w+')
+SHINGLE_SIZE = 3  # слов в шингле
+MAX_SHINGLES = 12  # шинглов на новость - ограничивает время проверки
+STEM_LENGTH = 6  # грубая основа слова: "санкции" и "санкций" совпадают
+FILE_MAGIC = b'NBF1'
+FILE_HEADER = struct.Struct('<4sIIH')  # magic, бит в поколении, хешей, поколений
+GENERATION_HEADER = struct.Struct('<dI')  # время создания, элементов
+
+
+def story_shingles(text: str) -> List[bytes]:
+    """Отпечатки новости: перекрывающиеся тройки основ значимых слов"""
+    stems = [word[:STEM_LENGTH] for word in WORD_PATTERN.findall(text.lower()) if len(word) > 2]
+    if len(stems) < SHINGLE_SIZE:
+        return [' '.join(stems).encode('utf-8')] if stems else []
+    shingles = []
+    for start in range(min(len(stems) - SHINGLE_SIZE + 1, MAX_SHINGLES)):
+        shingles.append(' '.join(stems[start:start + SHINGLE_SIZE]).encode('utf-8'))
+    return shingles
+
+
+class BloomFilter:
+    """Фильтр Блума на bytearray; k позиций из одного blake2b двойным хешированием"""
+
+    __slots__ = ('size', 'hashes', 'bits', 'count', 'created_at')
+
+    def __init__(self, size: int, hashes: int, created_at: Optional[float] = None, bits: Optional[bytearray] = None):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bits if bits is not None else bytearray((size + 7) // 8)
+        self.count = 0
+        self.created_at = created_at if created_at is not None else time.time()
+
+    def _positions(self, key: bytes):
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key: bytes):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: bytes) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RotatingBloomFilter:
+    """Несколько поколений фильтра Блума: запись в новое, проверка по всем"""
+
+    def __init__(self, capacity: int = 5000, error_rate: float = 0.01,
+                 generation_hours: float = 12, max_generations: int = 4):
+        # Оптимальные размер и число хешей для capacity элементов в поколении
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.capacity = capacity
+        self.generation_seconds = generation_hours * 3600
+        self.generations = deque(maxlen=max_generations)
+        self.generations.append(BloomFilter(self.size, self.hashes))
+
+    def _rotate_if_needed(self, now: float):
+        current = self.generations[-1]
+        if now - current.created_at >= self.generation_seconds or current.count >= self.capacity:
+            # deque с maxlen сам выбросит самое старое поколение
+            self.generations.append(BloomFilter(self.size, self.hashes, created_at=now))
+
+    def expire(self, now: Optional[float] = None):
+        """Выбрасывает поколения старше max_generations * generation_hours"""
+        now = now if now is not None else time.time()
+        horizon = self.generation_seconds * self.generations.maxlen
+        while len(self.generations) > 1 and now - self.generations[0].created_at > horizon:
+            self.generations.popleft()
+        self._rotate_if_needed(now)
+
+    def add(self, key: bytes):
+        self._rotate_if_needed(time.time())
+        self.generations[-1].add(key)
+
+    def __contains__(self, key: bytes) -> bool:
+        return any(key in generation for generation in self.generations)
+
+    def memory_bytes(self) -> int:
+        return sum(len(generation.bits) for generation in self.generations)
+
+    def dump(self) -> bytes:
+        parts = [FILE_HEADER.pack(FILE_MAGIC, self.size, self.hashes, len(self.generations))]
+        for generation in self.generations:
+            parts.append(GENERATION_HEADER.pack(generation.created_at, generation.count))
+            parts.append(bytes(generation.bits))
+        return b''.join(parts)
+
+    def restore(self, data: bytes):
+        """Загружает поколения из dump(); при другом размере фильтра старые данные игнорируются"""
+        magic, size, hashes, count = FILE_HEADER.unpack_from(data)
+        if magic != FILE_MAGIC or size != self.size or hashes != self.hashes:
+            raise ValueError("параметры фильтра изменились")
+        position = FILE_HEADER.size
+        generations = []
+        for _ in range(count):
+            created_at, items = GENERATION_HEADER.unpack_from(data, position)
+            position += GENERATION_HEADER.size
+            length = (size + 7) // 8
+            generation = BloomFilter(size, hashes, created_at, bytearray(data[position:position + length]))
+            generation.count = items
+            generations.append(generation)
+            position += length
+        self.generations.clear()
+        self.generations.extend(generations)
+        if not self.generations:
+            self.generations.append(BloomFilter(self.size, self.hashes))
+        self.expire()
+
+
+class NoveltyFilter:
+    """Отвечает, публиковалась ли уже новость (или ее почти дословный пересказ)"""
+
+    def __init__(self, path: Optional[str], match_ratio: float = 0.6, **filter_options):
+        self.path = path
+        self.match_ratio = match_ratio
+        self.filter = RotatingBloomFilter(**filter_options)
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                self.filter.restore(f.read())
+            logger.info(f"Загружена память опубликованных новостей: {len(self.filter.generations)} поколений")
+        except (OSError, ValueError, struct.error) as e:
+            logger.error(f"Ошибка загрузки памяти новостей из {self.path}: {e}")
+
+    def save(self):
+        """Атомарно сохраняет фильтр на диск"""
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with self.lock:
+                data = self.filter.dump()
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Ошибка сохранения памяти новостей в {self.path}: {e}")
+
+    def is_published(self, text: str) -> bool:
+        """Новость считается опубликованной, если в фильтре есть большая часть ее шинглов"""
+        shingles = story_shingles(text)
+        if not shingles:
+            return False
+        with self.lock:
+            self.filter.expire()
+            found = sum(1 for shingle in shingles if shingle in self.filter)
+        return found >= len(shingles) * self.match_ratio
+
+    def remember(self, texts: Iterable[str]):
+        """Запоминает опубликованные новости и сохраняет фильтр"""
+        added = 0
+        with self.lock:
+            for text in texts:
+                for shingle in story_shingles(text):
+                    self.filter.add(shingle)
+                added += 1
+        if added:
+            self.save()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'generations': len(self.filter.generations),
+                'items': sum(generation.count for generation in self.filter.generations),
+                'memory_bytes': self.filter.memory_bytes(),
+            }
@@ -0,0 +1,267 @@
+"""Архив сырых страниц каналов: повторный разбор без повторной загрузки.
+
+Каждая загруженная страница t.me/s/<канал> сохраняется сжатой (zstd, если установлен
+zstandard, иначе gzip) и адресуется хешем содержимого: одинаковые страницы хранятся
+один раз, а в индексе index.jsonl остается запись (канал, время загрузки, хеш) на
+каждую загрузку. Когда архив превышает max_bytes, удаляются страницы, которые дольше
+всех не встречались при сборе. reparse_archive() заново разбирает страницы текущим
+парсером на всех ядрах и собирает из них сообщения каналов.
+"""
+import os
+import gzip
+import json
+import zlib
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+from collector import parse_page_features
+
+try:
+    import zstandard
+except ImportError:  # zstd необязателен, без него страницы сжимаются gzip
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+CODEC_EXTENSIONS = {'zstd': '.html.zst', 'gzip': '.html.gz'}
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 10
+EVICT_TO = 0.9  # после вытеснения архив занимает не больше этой доли max_bytes
+
+
+def compress_page(data: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def decompress_page(data: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("страница сжата zstd, а пакет zstandard не установлен")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def read_page(path: str, codec: str) -> str:
+    with open(path, 'rb') as f:
+        return decompress_page(f.read(), codec).decode('utf-8')
+
+
+def parse_archived_page(task) -> List[dict]:
+    """Точка входа процесса-воркера: разбор одной страницы архива с признаками сообщений"""
+    path, codec, username = task
+    try:
+        html_content = read_page(path, codec)
+    except (OSError, RuntimeError, EOFError, ValueError, zlib.error) as e:
+        logger.error(f"Ошибка чтения страницы архива {path}: {e}")
+        return []
+    return parse_page_features(html_content, username)
+
+
+class PageArchive:
+    """Хранилище сжатых страниц с индексом по каналу и времени загрузки"""
+
+    def __init__(self, path: str, max_bytes: int = 200 * 1024 * 1024, codec: str = 'auto'):
+        self.path = path
+        self.max_bytes = max_bytes
+        if codec == 'auto':
+            codec = 'zstd' if zstandard is not None else 'gzip'
+        elif codec == 'zstd' and zstandard is None:
+            logger.warning("Пакет zstandard не установлен, архив страниц сжимается gzip")
+            codec = 'gzip'
+        self.codec = codec
+        self.index_path = os.path.join(path, 'index.jsonl')
+        self.lock = threading.Lock()
+        self.entries: List[dict] = []  # записи о загрузках в порядке времени
+        self.blobs: Dict[str, dict] = {}  # хеш -> {'codec', 'stored', 'raw', 'last_seen'}
+        self.stored_bytes = 0
+        self.loaded = False
+
+    def _blob_path(self, digest: str, codec: str) -> str:
+        return os.path.join(self.path, 'pages', digest[:2], digest + CODEC_EXTENSIONS[codec])
+
+    def _load(self):
+        """Читает индекс при первом обращении; записи без файла страницы пропускаются"""
+        if self.loaded:
+            return
+        self.loaded = True
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # строка, недописанная при остановке
+                    self._add_entry(entry)
+        except OSError as e:
+            logger.error(f"Ошибка чтения индекса архива {self.index_path}: {e}")
+            return
+        missing = [digest for digest, blob in self.blobs.items()
+                   if not os.path.exists(self._blob_path(digest, blob['codec']))]
+        if missing:
+            self._drop_blobs(missing)
+            self._rewrite_index()
+        logger.info(f"Архив страниц: {len(self.entries)} загрузок, {len(self.blobs)} уникальных страниц, "
+                    f"{self.stored_bytes / 1024 / 1024:.1f} МБ")
+
+    def _add_entry(self, entry: dict):
+        self.entries.append(entry)
+        blob = self.blobs.get(entry['hash'])
+        if blob is None:
+            self.blobs[entry['hash']] = {'codec': entry['codec'], 'stored': entry['stored'],
+                                         'raw': entry['raw'], 'last_seen': entry['fetched_at']}
+            self.stored_bytes += entry['stored']
+        else:
+            blob['last_seen'] = max(blob['last_seen'], entry['fetched_at'])
+
+    def _write_blob(self, digest: str, data: bytes, codec: str) -> int:
+        """Сжимает и атомарно записывает страницу; возвращает размер файла"""
+        compressed = compress_page(data, codec)
+        blob_path = self._blob_path(digest, codec)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        tmp_path = f"{blob_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(compressed)
+        os.replace(tmp_path, blob_path)
+        return len(compressed)
+
+    def store(self, channel_id: str, username: str, html_content: str, fetched_at: Optional[float] = None) -> bool:
+        """Сохраняет загруженную страницу; возвращает False, если такая страница уже есть.
+        Блокирующий вызов (сжатие и запись на диск) - для потоков конвейера сбора."""
+        fetched_at = fetched_at if fetched_at is not None else time.time()
+        data = html_content.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            self._load()
+            blob = self.blobs.get(digest)
+        is_new = blob is None
+        codec = self.codec if is_new else blob['codec']
+        stored = blob['stored'] if blob else 0
+
+        # Сжатие и запись новой страницы - без блокировки, чтобы не задерживать другие загрузки
+        if is_new:
+            stored = self._write_blob(digest, data, codec)
+
+        with self.lock:
+            # Пока блокировка была отпущена, другой поток мог вытеснить эту страницу
+            # (и уже известную, и только что записанную нами, если ее успел добавить он)
+            if digest not in self.blobs and not os.path.exists(self._blob_path(digest, codec)):
+                codec = self.codec
+                stored = self._write_blob(digest, data, codec)
+                is_new = True
+            entry = {'channel': channel_id, 'username': username, 'fetched_at': round(fetched_at, 3),
+                     'hash': digest, 'codec': codec, 'raw': len(data), 'stored': stored}
+            self._add_entry(entry)
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            if self.max_bytes and self.stored_bytes > self.max_bytes:
+                self._evict()
+        return is_new
+
+    def _evict(self):
+        """Удаляет страницы, дольше всех не встречавшиеся при сборе, и переписывает индекс"""
+        target = self.max_bytes * EVICT_TO
+        freed = []
+        size = self.stored_bytes
+        for digest, blob in sorted(self.blobs.items(), key=lambda item: item[1]['last_seen']):
+            if size <= target or len(self.blobs) - len(freed) <= 1:
+                break
+            freed.append(digest)
+            size -= blob['stored']
+        for digest in freed:
+            try:
+                os.remove(self._blob_path(digest, self.blobs[digest]['codec']))
+            except OSError as e:
+                logger.error(f"Ошибка удаления страницы {digest} из архива: {e}")
+        self._drop_blobs(freed)
+        self._rewrite_index()
+        logger.info(f"Из архива страниц вытеснено {len(freed)} страниц, осталось {self.stored_bytes / 1024 / 1024:.1f} МБ")
+
+    def _drop_blobs(self, digests: Iterable[str]):
+        dropped = set(digests)
+        for digest in dropped:
+            self.stored_bytes -= self.blobs.pop(digest)['stored']
+        self.entries = [entry for entry in self.entries if entry['hash'] not in dropped]
+
+    def _rewrite_index(self):
+        tmp_path = self.index_path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for entry in self.entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            logger.error(f"Ошибка записи индекса архива {self.index_path}: {e}")
+
+    def select(self, since: Optional[float] = None, channels: Optional[Iterable[str]] = None,
+               latest_only: bool = False) -> List[dict]:
+        """Записи о загрузках не старше since (Unix) по выбранным каналам, по времени.
+        latest_only - только последняя загрузка каждого канала."""
+        with self.lock:
+            self._load()
+            entries = list(self.entries)
+        if channels is not None:
+            channels = set(channels)
+            entries = [entry for entry in entries if entry['channel'] in channels]
+        if since is not None:
+            entries = [entry for entry in entries if entry['fetched_at'] >= since]
+        if latest_only:
+            latest = {}
+            for entry in entries:
+                if entry['channel'] not in latest or entry['fetched_at'] >= latest[entry['channel']]['fetched_at']:
+                    latest[entry['channel']] = entry
+            entries = list(latest.values())
+        return sorted(entries, key=lambda entry: entry['fetched_at'])
+
+    def read(self, entry: dict) -> str:
+        """HTML страницы из записи индекса"""
+        return read_page(self._blob_path(entry['hash'], entry['codec']), entry['codec'])
+
+    def stats(self) -> dict:
+        with self.lock:
+            self._load()
+            raw_bytes = sum(blob['raw'] for blob in self.blobs.values())
+            return {
+                'fetches': len(self.entries),
+                'pages': len(self.blobs),
+                'stored_bytes': self.stored_bytes,
+                'raw_bytes': raw_bytes,
+                'codec': self.codec,
+            }
+
+
+def reparse_archive(archive: PageArchive, entries: List[dict], processes: int = 0) -> Dict[str, List[dict]]:
+    """Разбирает страницы из entries и собирает сообщения по каналам.
+
+    Страницы одного канала перекрываются, поэтому сообщения объединяются без повторов
+    (по времени и тексту) в порядке загрузок. processes=0 - по процессу на ядро,
+    processes=1 - в текущем процессе.
+    """
+    tasks = [(archive._blob_path(entry['hash'], entry['codec']), entry['codec'], entry['username'])
+             for entry in entries]
+    processes = processes or os.cpu_count() or 1
+    if processes > 1 and len(tasks) > 1:
+        chunksize = max(1, len(tasks) // (processes * 4))
+        with ProcessPoolExecutor(processes) as executor:
+            pages = list(executor.map(parse_archived_page, tasks, chunksize=chunksize))
+    else:
+        pages = [parse_archived_page(task) for task in tasks]
+
+    messages: Dict[str, List[dict]] = {}
+    seen: Dict[str, set] = {}
+    for entry, page_messages in zip(entries, pages):
+        channel_messages = messages.setdefault(entry['channel'], [])
+        channel_seen = seen.setdefault(entry['channel'], set())
+        for msg in page_messages:
+            key = (msg['timestamp'], msg['text'])
+            if key not in channel_seen:
+                channel_seen.add(key)
+                channel_messages.append(msg)
+    return messages
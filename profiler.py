@@ -0,0 +1,189 @@
+"""Профилирование по запросу: cProfile и tracemalloc для следующих N сборов или дайджестов"""
+import os
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_TARGETS = {
+    'collect': 'сбор сообщений',
+    'digest': 'сборка дайджестов',
+}
+TRACEMALLOC_FRAMES = 5
+
+
+def short_path(filename: str) -> str:
+    """Оставляет от пути файла только последние две части"""
+    parts = filename.replace('\\', '/').split('/')
+    return '/'.join(parts[-2:])
+
+
+def format_function(func: tuple) -> str:
+    filename, line, name = func
+    if filename == '~':
+        return name  # встроенные функции
+    return f"{name} ({short_path(filename)}:{line})"
+
+
+class Profiler:
+    """Сессия профилирования: включается командой и закрывается после заданного числа запусков.
+
+    Профилируется поток, в котором идет запуск, вместе с корутинами, которые event loop
+    выполняет в это время. tracemalloc глобален и работает от первого запуска сессии до
+    последнего, поэтому в места выделения памяти попадает весь процесс. Работа,
+    вынесенная в пул воркеров (worker_pool.py), видна в профиле только как ожидание.
+    """
+
+    def __init__(self, report_dir: str, top: int = 20):
+        self.report_dir = report_dir
+        self.top = top
+        self.lock = threading.Lock()
+        self.session: Optional[dict] = None
+
+    def arm(self, target: str, runs: int, chat_id) -> dict:
+        """Включает профилирование следующих runs запусков target; прежняя сессия отменяется"""
+        if target not in PROFILE_TARGETS:
+            raise ValueError(f"Неизвестная цель профилирования: {target}")
+        with self.lock:
+            self._stop_tracing()
+            self.session = {
+                'target': target,
+                'runs': runs,
+                'remaining': runs,
+                'active': 0,
+                'chat_id': chat_id,
+                'stats': None,
+                'durations': [],
+                'started_tracing': False,
+                'armed_at': time.time(),
+            }
+            return dict(self.session)
+
+    def cancel(self) -> bool:
+        with self.lock:
+            if self.session is None:
+                return False
+            self._stop_tracing()
+            self.session = None
+            return True
+
+    def status(self) -> Optional[dict]:
+        with self.lock:
+            return dict(self.session) if self.session else None
+
+    def _stop_tracing(self):
+        if self.session and self.session['started_tracing'] and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @asynccontextmanager
+    async def profile(self, target: str, on_report: Callable[[object, str], Awaitable[None]]):
+        """Профилирует блок, если для target включена сессия; по последнему запуску отдает отчет"""
+        with self.lock:
+            session = self.session
+            # Одновременно профилируется только один запуск: cProfile не вкладывается сам в себя
+            if (session is None or session['target'] != target or session['remaining'] <= 0
+                    or session['active']):
+                session = None
+            else:
+                session['remaining'] -= 1
+                session['active'] += 1
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start(TRACEMALLOC_FRAMES)
+                    session['started_tracing'] = True
+
+        if session is None:
+            yield
+            return
+
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            duration = time.perf_counter() - started
+            report = None
+            with self.lock:
+                session['durations'].append(duration)
+                if session['stats'] is None:
+                    session['stats'] = pstats.Stats(profile)
+                else:
+                    session['stats'].add(profile)
+                session['active'] -= 1
+                if session['remaining'] == 0 and session['active'] == 0 and self.session is session:
+                    report = self._finish(session)
+                    self.session = None
+            if report:
+                try:
+                    await on_report(session['chat_id'], report)
+                except Exception as e:
+                    logger.error(f"Ошибка отправки отчета профилирования: {e}")
+
+    def _finish(self, session: dict) -> str:
+        """Собирает отчет, сохраняет полные данные на диск и выключает tracemalloc"""
+        snapshot = None
+        peak = 0
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, cProfile.__file__),
+                tracemalloc.Filter(False, pstats.__file__),
+                tracemalloc.Filter(False, __file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+            ))
+            peak = tracemalloc.get_traced_memory()[1]
+        self._stop_tracing()
+
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        base_path = os.path.join(self.report_dir, f"profile-{session['target']}-{stamp}")
+        report = self.render_report(session, snapshot, peak)
+        try:
+            os.makedirs(self.report_dir, exist_ok=True)
+            session['stats'].dump_stats(base_path + '.pstats')
+            with open(base_path + '.txt', 'w', encoding='utf-8') as f:
+                f.write(report)
+            report += f"\n\n💾 Полные данные: {base_path}.pstats"
+        except OSError as e:
+            logger.error(f"Не удалось сохранить профиль в {base_path}: {e}")
+        logger.info(f"Профилирование {session['target']} завершено: {len(session['durations'])} запусков")
+        return report
+
+    def render_report(self, session: dict, snapshot, peak: int) -> str:
+        durations = session['durations']
+        lines = [
+            f"🔬 ПРОФИЛЬ: {PROFILE_TARGETS[session['target']]}",
+            f"Запусков: {len(durations)}, всего {sum(durations):.2f} с, "
+            f"самый долгий {max(durations):.2f} с",
+            "",
+            f"⏱ Топ-{self.top} функций по суммарному времени (cumtime / tottime / вызовов):",
+        ]
+        lines.extend(self.top_functions(session['stats']))
+
+        if snapshot is not None:
+            lines.append("")
+            lines.append(f"🧠 Топ-{self.top // 2} мест выделения памяти (пик {peak / 1024 / 1024:.1f} МБ):")
+            lines.extend(self.top_allocations(snapshot))
+        return '\n'.join(lines)
+
+    def top_functions(self, stats: pstats.Stats) -> List[str]:
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+        lines = []
+        for func, (_, calls, tottime, cumtime, _) in rows[:self.top]:
+            lines.append(f"{cumtime:.3f} / {tottime:.3f} / {calls}  {format_function(func)}")
+        return lines
+
+    def top_allocations(self, snapshot) -> List[str]:
+        lines = []
+        for stat in snapshot.statistics('lineno')[:self.top // 2]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size / 1024:.1f} КБ в {stat.count} блоках  {short_path(frame.filename)}:{frame.lineno}")
+        return lines
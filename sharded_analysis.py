@@ -0,0 +1,205 @@
+"""Параллельный анализ больших окон: каналы делятся на шарды и считаются в пуле процессов.
+
+В процессы уходят не списки словарей, а компактный колоночный пакет: тексты одним
+блоком UTF-8 со смещениями, коды категорий и резонансность массивами. Назад
+возвращаются только признаки каналов (счетчики категорий и топ-кандидаты), которые
+сливаются в WindowAnalysis так же, как при обычном анализе.
+"""
+import json
+import math
+import struct
+import logging
+import threading
+import multiprocessing
+from array import array
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+from digest_engine import ChannelFeatures, WindowAnalysis, analyze_rows, analyze_window
+from metrics import BYTES_BUCKETS, registry as metrics_registry
+from text_analysis import CATEGORIES
+from worker_pool import check_cancelled
+
+logger = logging.getLogger(__name__)
+
+SHARD_MAGIC = b'DSH1'
+# magic, длина заголовка, число сообщений, длина блока текстов
+SHARD_HEADER = struct.Struct('<4sIII')
+CATEGORY_CODES = {category: code for code, category in enumerate(CATEGORIES)}
+NO_CATEGORY = -1
+
+SHARD_BYTES = metrics_registry.histogram(
+    'digest_bot_analysis_shard_bytes', 'Размер колоночного пакета шарда', buckets=BYTES_BUCKETS)
+SHARD_SECONDS = metrics_registry.histogram(
+    'digest_bot_analysis_shard_seconds', 'Время анализа окна в пуле процессов', ['stage'])
+
+
+def encode_shard(channels: List[Tuple[str, str, int, List[dict]]]) -> bytes:
+    """Упаковывает каналы шарда (id, название, позиция, сообщения) в колоночный пакет"""
+    meta = []
+    offsets = array('I', [0])
+    categories = array('b')
+    resonances = array('d')
+    chunks = []
+    size = 0
+    for channel_id, title, position, messages in channels:
+        meta.append([channel_id, title, position, len(messages)])
+        for msg in messages:
+            encoded = msg.get('text', '').encode('utf-8')
+            chunks.append(encoded)
+            size += len(encoded)
+            offsets.append(size)
+            categories.append(CATEGORY_CODES.get(msg.get('category'), NO_CATEGORY))
+            resonance = msg.get('resonance')
+            resonances.append(math.nan if resonance is None else resonance)
+
+    header = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+    return b''.join((
+        SHARD_HEADER.pack(SHARD_MAGIC, len(header), len(categories), size),
+        header,
+        offsets.tobytes(),
+        categories.tobytes(),
+        resonances.tobytes(),
+        *chunks,
+    ))
+
+
+def decode_shard(blob: bytes):
+    """Разбирает пакет; для каждого канала отдает (id, название, позиция, строки для analyze_rows)"""
+    magic, header_size, count, text_size = SHARD_HEADER.unpack_from(blob)
+    if magic != SHARD_MAGIC:
+        raise ValueError("Неизвестный формат пакета шарда")
+    view = memoryview(blob)
+    position = SHARD_HEADER.size
+    meta = json.loads(bytes(view[position:position + header_size]))
+    position += header_size
+
+    offsets = array('I')
+    offsets.frombytes(view[position:position + (count + 1) * offsets.itemsize])
+    position += (count + 1) * offsets.itemsize
+    categories = array('b')
+    categories.frombytes(view[position:position + count * categories.itemsize])
+    position += count * categories.itemsize
+    resonances = array('d')
+    resonances.frombytes(view[position:position + count * resonances.itemsize])
+    position += count * resonances.itemsize
+    texts = view[position:position + text_size]
+
+    def rows(start: int, end: int):
+        for index in range(start, end):
+            code = categories[index]
+            resonance = resonances[index]
+            yield (
+                str(texts[offsets[index]:offsets[index + 1]], 'utf-8'),
+                CATEGORIES[code] if code != NO_CATEGORY else None,
+                None if math.isnan(resonance) else resonance,
+            )
+
+    start = 0
+    for channel_id, title, channel_position, message_count in meta:
+        yield channel_id, title, channel_position, rows(start, start + message_count)
+        start += message_count
+
+
+def analyze_shard(blob: bytes) -> List[ChannelFeatures]:
+    """Точка входа процесса-воркера: признаки всех каналов шарда"""
+    return [analyze_rows(channel_id, title, position, rows)
+            for channel_id, title, position, rows in decode_shard(blob)]
+
+
+def plan_shards(window: Dict[str, List[dict]], shard_count: int) -> List[List[str]]:
+    """Раскладывает каналы по шардам так, чтобы сообщений в шардах было поровну (жадно, крупные первыми)"""
+    shards = [[] for _ in range(max(1, shard_count))]
+    loads = [0] * len(shards)
+    for channel_id in sorted(window, key=lambda ch_id: len(window[ch_id]), reverse=True):
+        target = loads.index(min(loads))
+        shards[target].append(channel_id)
+        loads[target] += len(window[channel_id])
+    return [shard for shard in shards if shard]
+
+
+class ShardedAnalyzer:
+    """Пул процессов для анализа окна. Процессы создаются fork'ом: start() стоит вызвать
+    при запуске бота, до появления других потоков. Без fork (Windows, macOS) режим выключен."""
+
+    def __init__(self, processes: int, min_messages: int = 20000, shards_per_process: int = 2):
+        self.processes = processes
+        self.min_messages = min_messages
+        self.shards_per_process = shards_per_process
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.lock = threading.Lock()
+        self.enabled = processes > 0
+        if self.enabled and 'fork' not in multiprocessing.get_all_start_methods():
+            logger.warning("Параллельный анализ недоступен без fork, окна считаются в одном процессе")
+            self.enabled = False
+
+    def start(self):
+        """Создает процессы заранее, пока в процессе бота нет других потоков"""
+        with self.lock:
+            if not self.enabled or self.executor is not None:
+                return
+            self.executor = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('fork'))
+            # В 3.11 при fork все процессы пула запускаются при первой задаче
+            self.executor.submit(int).result()
+        logger.info(f"Пул параллельного анализа: {self.processes} процессов")
+
+    def should_use(self, message_count: int) -> bool:
+        return self.enabled and message_count >= self.min_messages
+
+    def analyze_window(self, hours: int, window: Dict[str, List[dict]], titles: Dict[str, str],
+                       cancel_event=None) -> WindowAnalysis:
+        """Аналог digest_engine.analyze_window на пуле процессов; блокирующий, для пула потоков"""
+        self.start()
+        executor = self.executor
+        if executor is None:
+            # Пул выключен после сбоя - считаем в этом потоке
+            return analyze_window(hours, window, titles, cancel_event=cancel_event)
+        positions = {channel_id: position for position, channel_id in enumerate(window)}
+        shards = plan_shards(window, self.processes * self.shards_per_process)
+
+        with SHARD_SECONDS.time(stage='encode'):
+            blobs = [
+                encode_shard([
+                    (ch_id, titles.get(ch_id, f'Channel {ch_id}'), positions[ch_id], window[ch_id])
+                    for ch_id in shard
+                ])
+                for shard in shards
+            ]
+        for blob in blobs:
+            SHARD_BYTES.observe(len(blob))
+
+        features = {}
+        with SHARD_SECONDS.time(stage='analyze'):
+            try:
+                pending = {executor.submit(analyze_shard, blob) for blob in blobs}
+                while pending:
+                    done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        for channel_features in future.result():
+                            features[channel_features.channel_id] = channel_features
+                    if pending and cancel_event is not None and cancel_event.is_set():
+                        for future in pending:
+                            future.cancel()
+                        check_cancelled(cancel_event)
+            except BrokenProcessPool as e:
+                # Упавший процесс ломает весь пул. Новый fork посреди работы, когда уже идут
+                # планировщик, метрики и воркеры, может унаследовать чужие блокировки и зависнуть,
+                # поэтому до перезапуска бота окна считаются в одном процессе
+                logger.error(f"Пул параллельного анализа сломан ({e}), параллельный анализ выключен "
+                             f"до перезапуска, окна считаются в одном процессе")
+                with self.lock:
+                    self.enabled = False
+                    if self.executor is executor:
+                        self.executor = None
+                return analyze_window(hours, window, titles, cancel_event=cancel_event)
+
+        # Порядок каналов как в окне: от него зависит выбор при равной резонансности
+        ordered = {channel_id: features[channel_id] for channel_id in window}
+        return WindowAnalysis(hours, ordered)
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
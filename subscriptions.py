@@ -0,0 +1,93 @@
+"""Персональные подписки пользователей на дайджесты"""
+import os
+import json
+import logging
+from typing import Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+DIGEST_STYLES = {
+    'resonance': 'метрики + топ-3 резонансные новости',
+    'short': 'короткая сводка одним абзацем',
+}
+DEFAULT_HOURS = [7, 9, 11, 13, 15, 17, 19, 21]
+
+
+class SubscriptionStore:
+    """Хранилище подписок: user_id -> настройки, сохраняется в JSON"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.subscriptions: Dict[int, dict] = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for record in json.load(f):
+                    self.subscriptions[int(record['user_id'])] = record
+            logger.info(f"Загружено {len(self.subscriptions)} подписок")
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Ошибка загрузки подписок из {self.path}: {e}")
+
+    def save(self):
+        """Атомарно сохраняет подписки на диск"""
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(list(self.subscriptions.values()), f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Ошибка сохранения подписок в {self.path}: {e}")
+
+    def get(self, user_id: int) -> Optional[dict]:
+        return self.subscriptions.get(user_id)
+
+    def subscribe(self, user_id: int, chat_id: int) -> dict:
+        """Включает подписку; существующие настройки сохраняются"""
+        subscription = self.subscriptions.get(user_id)
+        if subscription is None:
+            subscription = {
+                'user_id': user_id,
+                'chat_id': chat_id,
+                'channels': [],  # пустой список - все отслеживаемые каналы
+                'hours': list(DEFAULT_HOURS),
+                'style': 'resonance',
+                'active': True,
+            }
+            self.subscriptions[user_id] = subscription
+        subscription['chat_id'] = chat_id
+        subscription['active'] = True
+        self.save()
+        return subscription
+
+    def unsubscribe(self, user_id: int) -> bool:
+        subscription = self.subscriptions.get(user_id)
+        if not subscription or not subscription['active']:
+            return False
+        subscription['active'] = False
+        self.save()
+        return True
+
+    def update(self, user_id: int, **fields) -> Optional[dict]:
+        subscription = self.subscriptions.get(user_id)
+        if subscription is None:
+            return None
+        subscription.update(fields)
+        self.save()
+        return subscription
+
+    def due(self, hour: int) -> List[dict]:
+        """Активные подписки, которым нужно отправить дайджест в этот час"""
+        return [s for s in self.subscriptions.values() if s['active'] and hour in s['hours']]
+
+    def subscribed_channels(self) -> Set[str]:
+        """Каналы, явно выбранные хотя бы одним активным подписчиком"""
+        channels = set()
+        for subscription in self.subscriptions.values():
+            if subscription['active']:
+                channels.update(subscription['channels'])
+        return channels
@@ -0,0 +1,127 @@
+"""Словари ключевых слов и функции анализа текста новостей"""
+import re
+from typing import List, Optional
+
+from entities import COUNTRY, extract_entities, get_gazetteer
+
+# Ключевые слова для анализа характера повестки
+DEVELOPMENT_KEYWORDS = (
+    'соглашение', 'договор', 'сотрудничество', 'партнерство', 'развитие', 'рост',
+    'успех', 'достижение', 'мир', 'переговоры', 'диалог', 'встреча', 'саммит',
+    'инвестиции', 'проект', 'программа', 'инициатива', 'реформа', 'модернизация'
+)
+
+TENSION_KEYWORDS = (
+    'конфликт', 'война', 'нападение', 'атака', 'санкции', 'кризис', 'напряженность',
+    'противостояние', 'спор', 'разногласия', 'угроза', 'опасность', 'эскалация',
+    'блокада', 'изоляция', 'протест', 'беспорядки', 'столкновения', 'обстрел'
+)
+
+ADMINISTRATIVE_KEYWORDS = (
+    'объявил', 'сообщил', 'заявил', 'планирует', 'рассматривает', 'принял решение',
+    'назначил', 'отправил', 'получил', 'подписал', 'утвердил', 'одобрил', 'отклонил',
+    'заседание', 'совещание', 'конференция', 'пресс-релиз', 'официально', 'формально'
+)
+
+CATEGORIES = ('development', 'tension', 'administrative')
+
+# Высокая резонансность - ключевые события
+HIGH_RESONANCE_KEYWORDS = (
+    'война', 'конфликт', 'атака', 'нападение', 'санкции', 'кризис',
+    'президент', 'премьер', 'министр', 'решение', 'заявление',
+    'смерть', 'убийство', 'теракт', 'взрыв', 'пожар', 'катастрофа',
+    'выборы', 'референдум', 'голосование', 'отставка', 'назначение',
+    'суд', 'приговор', 'арест', 'задержание', 'розыск',
+    'экономика', 'инфляция', 'безработица', 'кризис', 'рецессия'
+)
+
+# Средняя резонансность - важные события
+MEDIUM_RESONANCE_KEYWORDS = (
+    'соглашение', 'договор', 'встреча', 'переговоры', 'саммит',
+    'инвестиции', 'проект', 'программа', 'реформа', 'закон',
+    'протест', 'демонстрация', 'забастовка', 'митинг',
+    'технологии', 'инновации', 'разработка', 'запуск'
+)
+
+# Ключевые слова, по которым строятся тренды (без повторов)
+TREND_KEYWORDS = tuple(dict.fromkeys(HIGH_RESONANCE_KEYWORDS + MEDIUM_RESONANCE_KEYWORDS))
+
+# Бонус за упоминание стран/лидеров в резонансности. Ищутся подстрокой, как и раньше, а не
+# через entities.py: падежные формы изменили бы оценки и порядок топа уже собранных дайджестов
+RESONANCE_COUNTRIES = ('россия', 'украина', 'сша', 'китай', 'европа', 'германия', 'франция')
+
+# Рекламные и служебные фразы - такие сообщения в сводку не попадают
+SKIP_PHRASES = (
+    'подписаться на', 'подпишись на', 'читать далее',
+    'источник:', 'ссылка:', 'фото:', 'изображение:',
+    'картинка:', 'снимок:', 'видео:', 'ролик:',
+    'подписывайтесь', 'подписывайся', 'читайте далее',
+    'больше новостей', 'следите за', 'следите за новостями',
+    'канал:', 'телеграм:', 't.me/', 'https://',
+    'реклама', 'рекламный', 'партнер', 'партнерский'
+)
+
+DIGIT_PATTERN = re.compile(r'\d')
+
+
+def classify_message(text: str) -> str:
+    """Определяет категорию сообщения: development, tension или administrative"""
+    text_lower = text.lower()
+
+    # Подсчитываем ключевые слова
+    dev_score = sum(1 for keyword in DEVELOPMENT_KEYWORDS if keyword in text_lower)
+    tension_score = sum(1 for keyword in TENSION_KEYWORDS if keyword in text_lower)
+    admin_score = sum(1 for keyword in ADMINISTRATIVE_KEYWORDS if keyword in text_lower)
+
+    # Определяем категорию по максимальному счету
+    if dev_score > tension_score and dev_score > admin_score:
+        return 'development'
+    if tension_score > dev_score and tension_score > admin_score:
+        return 'tension'
+    # Если нет четких ключевых слов, считаем административным
+    return 'administrative'
+
+
+def find_countries(text: str, entities: Optional[List[str]] = None) -> List[str]:
+    """Возвращает страны, упомянутые в тексте (в любом падеже)"""
+    if entities is None:
+        entities = extract_entities(text)
+    return [entity_id for entity_id in entities if get_gazetteer().kind(entity_id) == COUNTRY]
+
+
+def find_trend_keywords(text: str) -> List[str]:
+    """Возвращает отслеживаемые ключевые слова, встреченные в тексте"""
+    text_lower = text.lower()
+    return [keyword for keyword in TREND_KEYWORDS if keyword in text_lower]
+
+
+def is_promotional(text: str) -> bool:
+    """Проверяет, содержит ли текст рекламные или служебные фразы"""
+    text_lower = text.lower()
+    return any(phrase in text_lower for phrase in SKIP_PHRASES)
+
+
+def calculate_resonance_score(text: str) -> int:
+    """Вычисляет резонансность новости (0-100)"""
+    text_lower = text.lower()
+    score = 0
+
+    # Подсчитываем очки
+    for keyword in HIGH_RESONANCE_KEYWORDS:
+        if keyword in text_lower:
+            score += 10
+
+    for keyword in MEDIUM_RESONANCE_KEYWORDS:
+        if keyword in text_lower:
+            score += 5
+
+    # Бонус за упоминание стран/лидеров
+    for country in RESONANCE_COUNTRIES:
+        if country in text_lower:
+            score += 3
+
+    # Бонус за цифры (важные данные)
+    if DIGIT_PATTERN.search(text):
+        score += 2
+
+    return min(score, 100)  # Максимум 100
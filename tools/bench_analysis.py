@@ -0,0 +1,118 @@
+"""Бенчмарк анализа окна: один поток против шардов в пуле процессов
+
+    python tools/bench_analysis.py --channels 300 --messages 200 --processes 1 2 4 8
+    python tools/bench_analysis.py --corpus corpus.json --processes 2 4
+
+--corpus берет сообщения, восстановленные из архива страниц (tools/reparse_archive.py --out),
+вместо синтетических.
+
+Проверяет, что шардированный анализ дает тот же топ и те же счетчики, и печатает
+пропускную способность (сообщений в секунду) и ускорение относительно одного потока.
+"""
+import os
+import sys
+import json
+import time
+import pickle
+import random
+import argparse
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from collector import extract_features
+from digest_engine import analyze_window
+from sharded_analysis import ShardedAnalyzer, encode_shard
+
+WORDS = (
+    'Президент заявил что министр провел встречу санкции экономика рост переговоры саммит '
+    'решение правительство Россия Украина США Китай договор проект инвестиции суд выборы '
+    'война конфликт атака соглашение сотрудничество развитие запуск открытие реформа бюджет'
+).split()
+
+
+def make_window(channels: int, messages: int, features: bool, seed: int):
+    """Синтетическое окно: channels каналов по messages сообщений в 1-4 предложения"""
+    rng = random.Random(seed)
+    window = {}
+    for channel in range(channels):
+        channel_messages = []
+        for _ in range(messages):
+            sentences = [
+                ' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 24))).capitalize() + '.'
+                for _ in range(rng.randint(1, 4))
+            ]
+            msg = {'text': ' '.join(sentences)}
+            if features:
+                extract_features(msg)
+            channel_messages.append(msg)
+        window[f'channel{channel}'] = channel_messages
+    titles = {channel_id: channel_id.title() for channel_id in window}
+    return window, titles
+
+
+def load_corpus(path: str, features: bool):
+    """Окно из JSON tools/reparse_archive.py: признаки там уже посчитаны при разборе"""
+    with open(path, 'r', encoding='utf-8') as f:
+        corpus = json.load(f)
+    window = corpus['window']
+    if not features:
+        window = {channel_id: [{'text': msg['text']} for msg in messages] for channel_id, messages in window.items()}
+    return window, corpus.get('titles', {})
+
+
+def summary(analysis) -> tuple:
+    selection = analysis.select()
+    return (selection.message_count, selection.candidate_count, tuple(selection.category_counts.items()),
+            tuple((news['score'], news['channel']) for news in selection.top_news), tuple(selection.fact_texts))
+
+
+def best_of(repeat: int, func) -> tuple:
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def run(args):
+    logging.basicConfig(level=logging.WARNING)
+    if args.corpus:
+        window, titles = load_corpus(args.corpus, args.features)
+    else:
+        window, titles = make_window(args.channels, args.messages, args.features, args.seed)
+    total = sum(len(messages) for messages in window.values())
+    pickled = len(pickle.dumps(list(window.values())))
+    encoded = len(encode_shard([(ch_id, titles.get(ch_id, ch_id), i, msgs) for i, (ch_id, msgs) in enumerate(window.items())]))
+    print(f"Окно: {len(window)} каналов, {total} сообщений, признаки при сборе: {'да' if args.features else 'нет'}")
+    print(f"Размер для передачи: pickle словарей {pickled / 1024:.0f} КБ, колоночный пакет {encoded / 1024:.0f} КБ")
+    print(f"Ядер: {os.cpu_count()}")
+
+    serial_time, serial = best_of(args.repeat, lambda: analyze_window(24, window, titles))
+    expected = summary(serial)
+    print(f"1 поток: {serial_time:.3f} с, {total / serial_time:,.0f} сообщ/с")
+
+    for processes in args.processes:
+        analyzer = ShardedAnalyzer(processes, min_messages=0)
+        analyzer.start()
+        try:
+            elapsed, result = best_of(args.repeat, lambda: analyzer.analyze_window(24, window, titles))
+        finally:
+            analyzer.shutdown()
+        same = 'совпадает' if summary(result) == expected else 'РАСХОДИТСЯ'
+        print(f"{processes} процессов: {elapsed:.3f} с, {total / elapsed:,.0f} сообщ/с, "
+              f"ускорение x{serial_time / elapsed:.2f}, результат {same}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--channels', type=int, default=300)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--features', action='store_true', help='посчитать категорию и резонансность заранее, как при сборе')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--corpus', help='JSON с сообщениями из tools/reparse_archive.py --out')
+    run(parser.parse_args())
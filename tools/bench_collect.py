@@ -0,0 +1,57 @@
+"""Бенчмарк сбора: последовательный обход каналов против потокового конвейера
+
+    python tools/bench_collect.py --channels 40 --max-latency 1.0
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from collector import extract_features, fetch_channel_page, parse_channel_page, run_collection
+from tools.fake_telegram_web import start_fake_telegram_web
+
+
+async def sequential(channels, base_url: str) -> float:
+    """Прежняя схема: канал за каналом загрузка, разбор и признаки"""
+    started = time.perf_counter()
+    for _, username in channels:
+        html_content = await asyncio.to_thread(fetch_channel_page, username, base_url)
+        [extract_features(msg) for msg in parse_channel_page(html_content, username)]
+    return time.perf_counter() - started
+
+
+async def run(args):
+    logging.basicConfig(level=logging.WARNING)
+    server = start_fake_telegram_web(min_latency=args.min_latency, max_latency=args.max_latency,
+                                     messages=args.messages)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    channels = [(str(i), f"channel{i}") for i in range(args.channels)]
+    stored = {}
+
+    async def store(channel_id, messages):
+        stored[channel_id] = messages
+
+    stats = await run_collection(channels, store, base_url=base_url,
+                                 concurrency=args.concurrency, queue_size=args.queue_size)
+    print(f"Каналов: {args.channels}, задержка {args.min_latency}-{args.max_latency} с, параллельно: {args.concurrency}")
+    print(f"Конвейер: {stats['wall_time']:.3f} с (самая долгая загрузка {stats['longest_fetch']:.3f} с, "
+          f"обработка {stats['process_time'] * 1000:.1f} мс), сообщений: {stats['messages']}")
+    if not args.skip_sequential:
+        print(f"Последовательно: {await sequential(channels, base_url):.3f} с")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--channels', type=int, default=40)
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--min-latency', type=float, default=0.1)
+    parser.add_argument('--max-latency', type=float, default=1.0)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--queue-size', type=int, default=4)
+    parser.add_argument('--skip-sequential', action='store_true')
+    asyncio.run(run(parser.parse_args()))
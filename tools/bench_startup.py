@@ -0,0 +1,123 @@
+"""Бенчмарк холодного старта: время от запуска процесса бота до ответа на первое обновление
+
+    python tools/bench_startup.py --runs 3 --budget 5
+    python tools/bench_startup.py --mode webhook --text /help
+
+Бот запускается отдельным процессом против tools/fake_bot_api.py с пустым DATA_DIR,
+как после рестарта или нового деплоя на Render. Команда пользователя ставится в
+очередь сразу (в режиме вебхука - как только бот зарегистрирует вебхук), поэтому
+замер включает импорт модулей, загрузку состояния и запуск приложения. Отдельно
+печатается время `import main`. Если медиана превышает бюджет (--budget или
+STARTUP_BUDGET_SECONDS), скрипт завершается с кодом 1 - его можно ставить в CI.
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tools.fake_bot_api import post_update, start_fake_bot_api, wait_for_webhook
+
+USER_ID = 4242
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def measure_import(runs: int) -> float:
+    """Лучшее время `import main` в чистом интерпретаторе, секунды"""
+    code = 'import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)'
+    timings = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as data_dir:
+            env = dict(os.environ, DATA_DIR=data_dir, TELEGRAM_BOT_TOKEN='')
+            output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env,
+                                    capture_output=True, text=True, check=True).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return min(timings)
+
+
+def measure_first_update(mode: str, text: str, timeout: float, verbose: bool) -> float:
+    """Запускает бота и возвращает время до его первого ответа пользователю, секунды"""
+    server = start_fake_bot_api()
+    replied = threading.Event()
+
+    def on_call(method, params):
+        if method == 'sendMessage' and str(params.get('chat_id')) == str(USER_ID):
+            replied.set()
+
+    server.listeners.append(on_call)
+    api_url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = dict(os.environ, TELEGRAM_API_BASE_URL=api_url, TELEGRAM_BOT_TOKEN='123:bench',
+                   DATA_DIR=data_dir, METRICS_PORT='0', WEBHOOK_URL='')
+        if mode == 'webhook':
+            port = free_port()
+            env.update(WEBHOOK_URL=f'http://127.0.0.1:{port}', WEBHOOK_PORT=str(port), WEBHOOK_LISTEN='127.0.0.1')
+        else:
+            server.push_update(server.command_update(USER_ID, text))
+
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, 'main.py'], cwd=ROOT, env=env,
+                                   stdout=None if verbose else subprocess.DEVNULL, stderr=subprocess.STDOUT)
+        try:
+            if mode == 'webhook':
+                if not wait_for_webhook(server, timeout=timeout):
+                    raise TimeoutError("бот не зарегистрировал вебхук")
+                post_update(server.webhook_url, server.command_update(USER_ID, text), server.webhook_secret)
+            if not replied.wait(max(0.0, timeout - (time.perf_counter() - started))):
+                raise TimeoutError(f"нет ответа на {text} за {timeout:.0f} с")
+            return time.perf_counter() - started
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            server.shutdown()
+
+
+def run(args) -> int:
+    import_time = measure_import(args.runs)
+    print(f"import main: {import_time * 1000:.0f} мс (лучшее из {args.runs})")
+
+    timings = []
+    for attempt in range(args.runs):
+        try:
+            elapsed = measure_first_update(args.mode, args.text, args.timeout, args.verbose)
+        except TimeoutError as e:
+            print(f"Запуск {attempt + 1}: {e}")
+            return 1
+        timings.append(elapsed)
+        print(f"Запуск {attempt + 1}: ответ на {args.text} через {elapsed * 1000:.0f} мс")
+
+    median = statistics.median(timings)
+    print(f"До первого обработанного обновления ({args.mode}): медиана {median * 1000:.0f} мс, "
+          f"лучшее {min(timings) * 1000:.0f} мс, бюджет {args.budget * 1000:.0f} мс")
+    if median > args.budget:
+        print("Бюджет запуска превышен")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=('polling', 'webhook'), default='polling')
+    parser.add_argument('--text', default='/start', help='команда первого обновления')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--budget', type=float, default=float(os.getenv('STARTUP_BUDGET_SECONDS', 5)),
+                        help='допустимая медиана, секунды')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--verbose', action='store_true', help='показывать лог бота')
+    sys.exit(run(parser.parse_args()))
@@ -0,0 +1,67 @@
+"""Бенчмарк LLM-суммаризации против локального фейкового сервера
+
+    python tools/bench_summarizer.py --stories 300 --latency 0.3
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_summarizer import LLMSummarizer, SummaryCache
+from tools.fake_openai_server import start_fake_openai_server
+
+WORDS = ('президент заявил министр встреча санкции экономика рост переговоры саммит '
+         'решение правительство страна регион договор проект инвестиции суд выборы').split()
+
+
+def make_stories(count: int, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 80))) + f' #{i}.' for i in range(count)]
+
+
+def first_words(text: str) -> str:
+    return ' '.join(text.split()[:12])
+
+
+async def run(args):
+    server = start_fake_openai_server(latency=args.latency, fail_rate=args.fail_rate)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    stories = make_stories(args.stories)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        summarizer = LLMSummarizer(
+            api_key='fake', model='fake-model', base_url=base_url,
+            cache=SummaryCache(os.path.join(tmp, 'cache.jsonl')), fallback=first_words,
+            token_budget=args.token_budget, max_concurrency=args.concurrency, timeout=args.timeout,
+        )
+
+        started = time.perf_counter()
+        await summarizer.summarize_many(stories)
+        cold = time.perf_counter() - started
+        cold_requests = server.request_count
+
+        started = time.perf_counter()
+        await summarizer.summarize_many(stories)
+        warm = time.perf_counter() - started
+
+    print(f"Новостей: {len(stories)}, бюджет пачки: {args.token_budget} токенов, параллельно: {args.concurrency}")
+    print(f"Холодный прогон: {cold:.3f} с, запросов к модели: {cold_requests}")
+    print(f"Повторный прогон (кэш): {warm * 1000:.2f} мс, новых запросов: {server.request_count - cold_requests}")
+    print(f"Статистика: {summarizer.stats}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--stories', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0.3)
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    parser.add_argument('--token-budget', type=int, default=3000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--timeout', type=float, default=20.0)
+    asyncio.run(run(parser.parse_args()))
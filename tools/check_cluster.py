@@ -0,0 +1,138 @@
+"""Проверка аренд кластера на общей SQLite-базе с управляемым временем
+
+    python tools/check_cluster.py
+    python tools/check_cluster.py --shards 64 --ttl 30
+
+Время передается через параметры now=, поэтому результат детерминирован и не зависит
+от скорости машины. Проверяет:
+- два узла на одной базе делят шарды поровну (32/32 при 64 шардах), без пересечений;
+- шарды и лидерство умершего узла забирает живой узел после истечения аренды, не раньше;
+- save_messages отказывает узлу, чей шард перешел к другому, и пишет новому владельцу;
+- лидер, не продливший аренду, узнает о потере лидерства (on_leader_lost).
+"""
+import os
+import sys
+import tempfile
+import argparse
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cluster import ClusterNode, ClusterStore, channel_shard
+
+START = 1_000_000.0
+
+
+def even_split(sizes, shards: int) -> bool:
+    """Шарды поделены поровну (при нечетном числе один узел держит на шард больше)"""
+    return sorted(sizes) == [shards // 2, shards - shards // 2]
+
+
+class Checker:
+    def __init__(self):
+        self.failed = 0
+
+    def check(self, name: str, ok: bool, details: str = ''):
+        print(f"{'ok  ' if ok else 'FAIL'} {name}{f' ({details})' if details else ''}")
+        if not ok:
+            self.failed += 1
+
+
+def channel_in_shard(shard: int, shards: int) -> str:
+    """Любой id канала, попадающий в шард"""
+    index = 0
+    while channel_shard(f'channel{index}', shards) != shard:
+        index += 1
+    return f'channel{index}'
+
+
+def settle(store: ClusterStore, workers, shards: int, ttl: float, now: float, step: float, rounds: int = 6) -> float:
+    """Несколько кругов продления аренд всеми узлами; возвращает время после последнего круга"""
+    for _ in range(rounds):
+        for worker_id in workers:
+            store.rebalance_shards(worker_id, shards, ttl, now=now)
+            now += step
+    return now
+
+
+def run(args):
+    logging.basicConfig(level=logging.WARNING)
+    shards, ttl = args.shards, args.ttl
+    step = ttl / 3  # как часто узлы продлевают аренды в ClusterNode
+    checker = Checker()
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = ClusterStore(os.path.join(directory, 'cluster.db'))
+
+        # Один узел забирает все шарды, второй при подключении получает половину
+        now = START
+        alone = store.rebalance_shards('a', shards, ttl, now=now)
+        checker.check('один узел держит все шарды', len(alone) == shards, f"{len(alone)}/{shards}")
+        now = settle(store, ['a', 'b'], shards, ttl, now + step, step)
+        a = store.rebalance_shards('a', shards, ttl, now=now)
+        b = store.rebalance_shards('b', shards, ttl, now=now)
+        owners = store.shard_owners(shards, now=now)
+        checker.check('два узла делят шарды поровну', even_split((len(a), len(b)), shards),
+                      f"{len(a)}/{len(b)}")
+        checker.check('шарды не пересекаются и покрыты все', not (a & b) and len(owners) == shards,
+                      f"пересечение {len(a & b)}, с владельцем {len(owners)}")
+
+        # Шард, который узел a отдал при подключении b, больше не принимает его запись
+        moved = min(b)
+        channel = channel_in_shard(moved, shards)
+        checker.check('запись старого владельца отклоняется после передачи шарда',
+                      not store.save_messages('a', shards, channel, [], now=now))
+        checker.check('запись нового владельца принимается', store.save_messages('b', shards, channel, [], now=now))
+
+        # Узел b умирает: до конца его аренды шарды остаются за ним, потом их забирает a
+        b_last = now
+        b_shards = b
+        a = store.rebalance_shards('a', shards, ttl, now=b_last + ttl / 2)
+        checker.check('до истечения аренды шарды умершего узла не трогаются', a.isdisjoint(b_shards),
+                      f"у a {len(a)}")
+        now = b_last + ttl + 1
+        a = store.rebalance_shards('a', shards, ttl, now=now)
+        checker.check('после истечения аренды живой узел забирает все шарды', len(a) == shards,
+                      f"{len(a)}/{shards}")
+        checker.check('запись умершего узла отклоняется', not store.save_messages('b', shards, channel, [], now=now))
+        checker.check('запись узла, забравшего шард, принимается',
+                      store.save_messages('a', shards, channel, [], now=now))
+
+        # Лидерство: лидер перестал продлевать аренду, ее берет другой узел, прежний лидер это замечает
+        lost = []
+        leader = ClusterNode(store, 'leader', shards=shards, lease_seconds=ttl,
+                             on_leader_lost=lambda: lost.append('leader'))
+        follower = ClusterNode(store, 'follower', shards=shards, lease_seconds=ttl)
+        now += ttl * 2  # узлы a и b из прошлых проверок уже не считаются живыми
+        leader.renew_leases(now)
+        follower.renew_leases(now)
+        checker.check('лидер один', leader.is_leader(now) and not follower.is_leader(now))
+        follower.renew_leases(now + ttl / 2)
+        checker.check('лидерство не переходит до истечения аренды', not follower.is_leader(now + ttl / 2))
+        now += ttl + 1
+        follower.renew_leases(now)
+        checker.check('после истечения аренды лидерство переходит', follower.is_leader(now))
+        leader.renew_leases(now)
+        checker.check('прежний лидер узнает о потере лидерства', lost == ['leader'] and not leader.is_leader(now))
+        for _ in range(6):
+            now += step
+            leader.renew_leases(now)
+            follower.renew_leases(now)
+        owned = (len(leader.owned), len(follower.owned))
+        checker.check('после смены лидера узлы снова делят шарды поровну',
+                      even_split(owned, shards) and not (leader.owned & follower.owned),
+                      f"{owned[0]}/{owned[1]}")
+        checker.check('лидер остается прежним при продлении', follower.is_leader(now) and not leader.is_leader(now))
+
+    print(f"Проверок не прошло: {checker.failed}" if checker.failed else "Все проверки прошли")
+    return 1 if checker.failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--shards', type=int, default=64)
+    parser.add_argument('--ttl', type=float, default=30)
+    args = parser.parse_args()
+    if args.shards < 2:
+        parser.error('для проверки передачи шардов нужно хотя бы 2 шарда')
+    sys.exit(run(args))
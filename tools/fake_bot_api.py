@@ -0,0 +1,336 @@
+"""Локальный фейковый Telegram Bot API для офлайн-тестов бота
+
+Понимает getMe, setWebhook, deleteWebhook, getWebhookInfo, getUpdates (длинный опрос),
+sendMessage, editMessageText, answerCallbackQuery, answerInlineQuery, getFile и setMyCommands, отдает
+файлы из document_update по /file/bot<token>/<путь>. Исходящие сообщения бота запоминает, а обновления от "пользователей" либо отдает через getUpdates,
+либо отправляет POST-запросом на зарегистрированный вебхук с секретным токеном.
+
+Проверка режима вебхука:
+    python tools/fake_bot_api.py --port 8081 --updates 20 --text /status
+    TELEGRAM_API_BASE_URL=http://127.0.0.1:8081 TELEGRAM_BOT_TOKEN=123:fake \\
+        WEBHOOK_URL=http://127.0.0.1:8080 WEBHOOK_PORT=8080 python main.py
+"""
+import json
+import time
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from collections import deque
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+BOT_USER = {'id': 1000000001, 'is_bot': True, 'first_name': 'Digest Bot', 'username': 'fake_digest_bot'}
+
+
+def make_user(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}', 'language_code': 'ru'}
+
+
+def make_private_chat(chat_id: int) -> dict:
+    return {'id': chat_id, 'type': 'private', 'first_name': f'User {chat_id}'}
+
+
+class FakeBotAPI(ThreadingHTTPServer):
+    """Сервер с состоянием: сообщения бота, очередь обновлений, настройки вебхука"""
+
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0.0):
+        super().__init__(address, FakeBotAPIHandler)
+        self.latency = latency
+        self.lock = threading.Condition()
+        self.update_id = 0
+        self.message_id = 0
+        self.pending_updates = deque()
+        self.sent = []  # (время, метод, параметры)
+        self.webhook_url = ''
+        self.webhook_secret = ''
+        self.method_counts = {}
+        self.listeners = []  # функции (method, params), вызываются на каждый вызов бота
+        self.files = {}  # file_id -> содержимое файлов, присланных пользователями
+
+    # --- обновления от пользователей ---
+
+    def _next_update_id(self) -> int:
+        with self.lock:
+            self.update_id += 1
+            return self.update_id
+
+    def command_update(self, user_id: int, text: str) -> dict:
+        """Обновление с текстовым сообщением (командой) от пользователя в личном чате"""
+        with self.lock:
+            self.message_id += 1
+            message_id = self.message_id
+        return {
+            'update_id': self._next_update_id(),
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': make_private_chat(user_id),
+                'from': make_user(user_id),
+                'text': text,
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+                if text.startswith('/') else [],
+            },
+        }
+
+    def callback_update(self, user_id: int, data: str, message_id: Optional[int] = None) -> dict:
+        """Обновление с нажатием inline-кнопки под сообщением бота"""
+        with self.lock:
+            if message_id is None:
+                self.message_id += 1
+                message_id = self.message_id
+        return {
+            'update_id': self._next_update_id(),
+            'callback_query': {
+                'id': str(self.update_id),
+                'from': make_user(user_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': message_id,
+                    'date': int(time.time()),
+                    'chat': make_private_chat(user_id),
+                    'from': BOT_USER,
+                    'text': 'Меню',
+                },
+            },
+        }
+
+    def document_update(self, user_id: int, file_name: str, content: bytes) -> dict:
+        """Обновление с файлом, который пользователь прислал в личный чат"""
+        with self.lock:
+            self.message_id += 1
+            message_id = self.message_id
+            file_id = f"file{len(self.files) + 1}"
+            self.files[file_id] = content
+        return {
+            'update_id': self._next_update_id(),
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': make_private_chat(user_id),
+                'from': make_user(user_id),
+                'document': {'file_id': file_id, 'file_unique_id': file_id, 'file_name': file_name,
+                             'file_size': len(content)},
+            },
+        }
+
+    def inline_update(self, user_id: int, query: str) -> dict:
+        """Обновление с inline-запросом (@бот <query>) из любого чата"""
+        update_id = self._next_update_id()
+        return {
+            'update_id': update_id,
+            'inline_query': {
+                'id': str(update_id),
+                'from': make_user(user_id),
+                'query': query,
+                'offset': '',
+                'chat_type': 'private',
+            },
+        }
+
+    def push_update(self, update: dict):
+        """Доставляет обновление боту: на вебхук, если он задан, иначе в очередь getUpdates"""
+        if self.webhook_url:
+            post_update(self.webhook_url, update, self.webhook_secret)
+            return
+        with self.lock:
+            self.pending_updates.append(update)
+            self.lock.notify_all()
+
+    # --- методы Bot API ---
+
+    def call(self, method: str, params: dict):
+        with self.lock:
+            self.method_counts[method] = self.method_counts.get(method, 0) + 1
+        for listener in list(self.listeners):
+            listener(method, params)
+        if self.latency and method not in ('getUpdates', 'getMe'):
+            time.sleep(self.latency)
+
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'setWebhook':
+            self.webhook_url = params.get('url', '')
+            self.webhook_secret = params.get('secret_token', '')
+            if params.get('drop_pending_updates'):
+                with self.lock:
+                    self.pending_updates.clear()
+            return True
+        if method == 'deleteWebhook':
+            self.webhook_url = ''
+            return True
+        if method == 'getWebhookInfo':
+            with self.lock:
+                pending = len(self.pending_updates)
+            return {'url': self.webhook_url, 'has_custom_certificate': False, 'pending_update_count': pending}
+        if method == 'getUpdates':
+            return self._get_updates(params)
+        if method in ('sendMessage', 'editMessageText'):
+            chat_id = int(params.get('chat_id', 0)) if str(params.get('chat_id', '')).lstrip('-').isdigit() else 0
+            with self.lock:
+                if method == 'sendMessage':
+                    self.message_id += 1
+                    message_id = self.message_id
+                else:
+                    message_id = int(params.get('message_id') or 0)
+                self.sent.append((time.time(), method, params))
+            return {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': make_private_chat(chat_id) if chat_id > 0 else
+                {'id': chat_id, 'type': 'channel', 'title': str(params.get('chat_id'))},
+                'from': BOT_USER,
+                'text': params.get('text', ''),
+            }
+        if method == 'answerInlineQuery':
+            with self.lock:
+                self.sent.append((time.time(), method, params))
+            return True
+        if method == 'getFile':
+            file_id = params.get('file_id', '')
+            if file_id not in self.files:
+                raise ValueError('wrong file_id')
+            return {'file_id': file_id, 'file_unique_id': file_id, 'file_size': len(self.files[file_id]),
+                    'file_path': f"documents/{file_id}"}
+        if method in ('answerCallbackQuery', 'setMyCommands', 'deleteMyCommands', 'close', 'logOut'):
+            return True
+        raise KeyError(method)
+
+    def _get_updates(self, params: dict) -> list:
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        deadline = time.time() + timeout
+        with self.lock:
+            while True:
+                while self.pending_updates and self.pending_updates[0]['update_id'] < offset:
+                    self.pending_updates.popleft()
+                if self.pending_updates or time.time() >= deadline:
+                    return list(self.pending_updates)[:int(params.get('limit') or 100)]
+                self.lock.wait(deadline - time.time())
+
+
+class FakeBotAPIHandler(BaseHTTPRequestHandler):
+    """Обработчик /bot<token>/<method> в формате Bot API"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # бот остановлен посреди длинного опроса
+
+    def _params(self) -> dict:
+        length = int(self.headers.get('Content-Length', 0))
+        raw = self.rfile.read(length) if length else b''
+        content_type = self.headers.get('Content-Type', '')
+        if 'application/json' in content_type:
+            return json.loads(raw or b'{}')
+        params = {}
+        for key, values in parse_qs(raw.decode('utf-8'), keep_blank_values=True).items():
+            value = values[-1]
+            try:
+                # Вложенные объекты (клавиатуры, списки) приходят строкой JSON
+                params[key] = json.loads(value) if value[:1] in ('{', '[') or value in ('true', 'false') else value
+            except ValueError:
+                params[key] = value
+        return params
+
+    def do_GET(self):
+        parts = self.path.split('?', 1)[0].strip('/').split('/')
+        if len(parts) == 4 and parts[0] == 'file' and parts[1].startswith('bot'):
+            content = self.server.files.get(parts[3])
+            if content is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+            return
+        self.do_POST()
+
+    def do_POST(self):
+        parts = self.path.split('?', 1)[0].strip('/').split('/')
+        if len(parts) != 2 or not parts[0].startswith('bot'):
+            self._send_json(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+            return
+        try:
+            result = self.server.call(parts[1], self._params())
+        except KeyError:
+            self._send_json(404, {'ok': False, 'error_code': 404, 'description': 'Not Found: method not found'})
+            return
+        except (ValueError, TypeError) as e:
+            self._send_json(400, {'ok': False, 'error_code': 400, 'description': f'Bad Request: {e}'})
+            return
+        self._send_json(200, {'ok': True, 'result': result})
+
+
+def post_update(url: str, update: dict, secret_token: str = '', timeout: float = 10) -> int:
+    """Отправляет обновление на вебхук так же, как это делает Telegram; возвращает HTTP-статус"""
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(update).encode('utf-8'),
+        headers={'Content-Type': 'application/json', 'X-Telegram-Bot-Api-Secret-Token': secret_token},
+        method='POST',
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def start_fake_bot_api(host: str = '127.0.0.1', port: int = 0, latency: float = 0.0) -> FakeBotAPI:
+    """Запускает фейковый Bot API в фоновом потоке (адрес - server.server_address)"""
+    server = FakeBotAPI((host, port), latency=latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def wait_for_webhook(server: FakeBotAPI, timeout: float = 60) -> bool:
+    deadline = time.time() + timeout
+    while not server.webhook_url and time.time() < deadline:
+        time.sleep(0.1)
+    return bool(server.webhook_url)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Фейковый Telegram Bot API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка ответа на вызовы бота, секунды')
+    parser.add_argument('--updates', type=int, default=0, help='сколько команд отправить после setWebhook')
+    parser.add_argument('--text', default='/status', help='текст команды')
+    args = parser.parse_args()
+
+    server = start_fake_bot_api(args.host, args.port, args.latency)
+    print(f"Фейковый Bot API: http://{args.host}:{server.server_address[1]}")
+    try:
+        if args.updates:
+            print("Жду setWebhook от бота...")
+            wait_for_webhook(server, timeout=3600)
+            print(f"Вебхук: {server.webhook_url}")
+            for i in range(args.updates):
+                sent_before = len(server.sent)
+                started = time.perf_counter()
+                status = post_update(server.webhook_url, server.command_update(100 + i, args.text), server.webhook_secret)
+                while len(server.sent) == sent_before and time.perf_counter() - started < 30:
+                    time.sleep(0.005)
+                print(f"{args.text} от {100 + i}: HTTP {status}, ответ через {(time.perf_counter() - started) * 1000:.0f} мс")
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
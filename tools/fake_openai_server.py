@@ -0,0 +1,114 @@
+"""Локальный OpenAI-совместимый сервер для офлайн-тестов суммаризации
+
+Отвечает на POST /v1/chat/completions: ожидает в последнем сообщении JSON-список
+{"id", "text"} и возвращает JSON-объект {id: первые слова текста}.
+
+Запуск:
+    python tools/fake_openai_server.py --port 8089 --latency 0.2
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 LLM_SUMMARIES_ENABLED=1 python main.py
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов в формате OpenAI Chat Completions"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            self._send_json(200, {'object': 'list', 'data': [{'id': 'fake-model', 'object': 'model', 'owned_by': 'local'}]})
+        else:
+            self._send_json(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'not found'}})
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        server = self.server
+
+        with server.lock:
+            server.request_count += 1
+
+        if server.latency:
+            time.sleep(server.latency)
+        if server.fail_rate and random.random() < server.fail_rate:
+            self._send_json(503, {'error': {'message': 'model overloaded'}})
+            return
+
+        try:
+            stories = json.loads(request['messages'][-1]['content'])
+        except (KeyError, IndexError, ValueError):
+            stories = []
+
+        answers = {}
+        for story in stories:
+            words = str(story.get('text', '')).split()
+            summary = ' '.join(words[:server.summary_words])
+            answers[str(story.get('id'))] = summary.rstrip('.,;:') + '.'
+
+        content = json.dumps(answers, ensure_ascii=False)
+        prompt_chars = sum(len(m.get('content', '')) for m in request.get('messages', []))
+        self._send_json(200, {
+            'id': f'chatcmpl-fake-{server.request_count}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'fake-model'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop',
+            }],
+            'usage': {
+                'prompt_tokens': prompt_chars // 3,
+                'completion_tokens': len(content) // 3,
+                'total_tokens': (prompt_chars + len(content)) // 3,
+            },
+        })
+
+
+def start_fake_openai_server(host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                             fail_rate: float = 0.0, summary_words: int = 12) -> ThreadingHTTPServer:
+    """Запускает сервер в фоновом потоке и возвращает его (адрес - server.server_address)"""
+    server = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.fail_rate = fail_rate
+    server.summary_words = summary_words
+    server.request_count = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Фейковый OpenAI-совместимый сервер')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка ответа, секунды')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='доля ответов 503')
+    args = parser.parse_args()
+
+    server = start_fake_openai_server(args.host, args.port, args.latency, args.fail_rate)
+    print(f"Фейковый OpenAI API: http://{args.host}:{server.server_address[1]}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,115 @@
+"""Локальная имитация веб-версии каналов Telegram (t.me/s/<username>) для офлайн-тестов сбора
+
+Отвечает на GET /s/<username> страницей с шапкой канала и сообщениями в разметке виджета
+Telegram. Для username, начинающихся с 'missing', страница без шапки - как у Telegram
+для несуществующего или приватного канала.
+Задержка ответа для каждого канала своя и постоянная (от --min-latency до --max-latency).
+
+Запуск:
+    python tools/fake_telegram_web.py --port 8090 --max-latency 1.0
+    TELEGRAM_WEB_BASE_URL=http://127.0.0.1:8090 python main.py
+"""
+import html
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ('президент заявил министр встреча санкции экономика рост переговоры саммит '
+         'решение правительство страна регион договор проект инвестиции суд выборы '
+         'Россия Китай США Франция Германия кризис конфликт взрыв протест').split()
+
+
+def render_channel_page(username: str, messages: int = 20, seed: int = 0) -> str:
+    """Генерирует страницу канала: одинаковую для одного username и seed"""
+    rng = random.Random(f"{username}:{seed}")
+    now = datetime.now(timezone.utc)
+    parts = [f'<html><head><title>{html.escape(username)}</title></head><body>']
+    if username.startswith('missing'):
+        parts.append('<div class="tgme_page"><div class="tgme_page_title">Telegram</div></div></body></html>')
+        return ''.join(parts)
+    subscribers = rng.randint(1_000, 3_000_000)
+    parts.append(
+        '<div class="tgme_channel_info"><div class="tgme_channel_info_header">'
+        f'<i class="tgme_page_photo_image bgcolor1" data-content="{html.escape(username[:1].upper())}">'
+        f'<img src="https://cdn.example.org/file/{html.escape(username)}.jpg"></i>'
+        f'<div class="tgme_channel_info_header_title"><span dir="auto">Канал {html.escape(username)}</span></div>'
+        f'<div class="tgme_channel_info_header_username"><a href="https://t.me/{html.escape(username)}">'
+        f'@{html.escape(username)}</a></div></div>'
+        '<div class="tgme_channel_info_counters"><div class="tgme_channel_info_counter">'
+        f'<span class="counter_value">{subscribers / 1000:.1f}K</span> <span class="counter_type">subscribers</span>'
+        '</div></div></div>'
+    )
+    for i in range(messages):
+        text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(12, 60))).capitalize() + '.'
+        posted = now - timedelta(minutes=(messages - i) * rng.randint(5, 20))
+        parts.append(
+            '<div class="tgme_widget_message_wrap"><div class="tgme_widget_message">'
+            f'<div class="tgme_widget_message_text js-message_text" dir="auto">{html.escape(text)}<br/>&nbsp;</div>'
+            f'<a class="tgme_widget_message_date"><time datetime="{posted.strftime("%Y-%m-%dT%H:%M:%S+00:00")}">'
+            f'{posted.strftime("%H:%M")}</time></a></div></div>'
+        )
+    parts.append('</body></html>')
+    return ''.join(parts)
+
+
+class FakeTelegramWebHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов страниц каналов"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0].strip('/')
+        if not path.startswith('s/'):
+            self.send_error(404)
+            return
+        username = path[2:]
+        server = self.server
+
+        with server.lock:
+            server.request_count += 1
+        latency = random.Random(username).uniform(server.min_latency, server.max_latency)
+        if latency:
+            time.sleep(latency)
+
+        body = render_channel_page(username, server.messages, server.seed).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_fake_telegram_web(host: str = '127.0.0.1', port: int = 0, min_latency: float = 0.0,
+                            max_latency: float = 0.0, messages: int = 20, seed: int = 0) -> ThreadingHTTPServer:
+    """Запускает сервер в фоновом потоке и возвращает его (адрес - server.server_address)"""
+    server = ThreadingHTTPServer((host, port), FakeTelegramWebHandler)
+    server.daemon_threads = True
+    server.min_latency = min_latency
+    server.max_latency = max_latency
+    server.messages = messages
+    server.seed = seed
+    server.request_count = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Фейковая веб-версия каналов Telegram')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--min-latency', type=float, default=0.0, help='минимальная задержка ответа, секунды')
+    parser.add_argument('--max-latency', type=float, default=0.0, help='максимальная задержка ответа, секунды')
+    parser.add_argument('--messages', type=int, default=20, help='сообщений на странице')
+    args = parser.parse_args()
+
+    server = start_fake_telegram_web(args.host, args.port, args.min_latency, args.max_latency, args.messages)
+    print(f"Фейковая веб-версия Telegram: http://{args.host}:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
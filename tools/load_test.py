@@ -0,0 +1,310 @@
+"""Нагрузочный тест бота: фейковый Bot API, фейковые каналы и толпа пользователей
+
+    python tools/load_test.py --users 200 --duration 60
+    python tools/load_test.py --users 500 --mode webhook --mix /status=5 /digest=1 toggle_channel=4
+    python tools/load_test.py --users 100 --api-latency 0.05 --env DELIVERY_GLOBAL_RATE=100
+
+Бот (main.py с настоящими обработчиками) запускается отдельным процессом против
+tools/fake_bot_api.py и tools/fake_telegram_web.py, то есть полностью офлайн.
+Каждый пользователь - поток со своим личным чатом: отправляет команду или нажимает
+кнопку канала в меню /manage_channels, ждет итогового ответа бота, думает и повторяет.
+Задержка считается от отправки обновления до итогового ответа (для /digest и
+/collect_messages - после сообщения "🔄 ...", для кнопки - до правки меню каналов).
+Ответ с ❌ или ⏹, HTTP-ошибка вебхука и отсутствие ответа за --timeout считаются
+ошибками. Если доля ошибок больше --max-error-rate, скрипт завершается с кодом 1.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tools.bench_startup import free_port
+from tools.fake_bot_api import post_update, start_fake_bot_api, wait_for_webhook
+from tools.fake_telegram_web import start_fake_telegram_web
+from channel_menu import TOGGLE, encode_callback
+
+FIRST_USER_ID = 200000
+# Каналы из PREDEFINED_CHANNELS в main.py - бот подписывается на них при запуске
+CHANNEL_IDS = ('meduza', 'rbc', 'tass', 'interfax', 'ria', 'bbbreaking',
+               'kontext', 'meduzalive', 'superslowflow', 'vcnews', 'mediazzzona')
+DEFAULT_MIX = ('/status=5', '/digest=2', 'toggle_channel=3', '/collect_messages=1')
+ERROR_MARKS = ('❌', '⏹')
+PROGRESS_MARK = '🔄'
+
+
+def is_final(action: str, method: str, params: dict) -> bool:
+    """Итоговый ли это ответ бота на действие пользователя"""
+    text = str(params.get('text', ''))
+    if text.startswith(ERROR_MARKS):
+        return True
+    if action == 'toggle_channel':
+        # Бот одной правкой пишет "Канал ... включен" и возвращает страницу меню каналов
+        return method == 'editMessageText' and bool(params.get('reply_markup'))
+    return not text.startswith(PROGRESS_MARK)
+
+
+class PendingAction:
+    __slots__ = ('action', 'started', 'done', 'error', 'finished')
+
+    def __init__(self, action: str):
+        self.action = action
+        self.started = time.perf_counter()
+        self.done = threading.Event()
+        self.error = False
+        self.finished = 0.0
+
+
+class LoadStats:
+    """Ожидающие ответа действия по чатам и итоговые задержки по командам"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending: Dict[int, PendingAction] = {}
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.timeouts: Dict[str, int] = {}
+
+    def begin(self, chat_id: int, action: str) -> PendingAction:
+        pending = PendingAction(action)
+        with self.lock:
+            self.pending[chat_id] = pending
+        return pending
+
+    def on_bot_call(self, method: str, params: dict):
+        """Слушатель фейкового Bot API: сопоставляет ответы бота с ожидающими действиями"""
+        if method not in ('sendMessage', 'editMessageText'):
+            return
+        chat_id = str(params.get('chat_id', ''))
+        if not chat_id.isdigit():
+            return
+        with self.lock:
+            pending = self.pending.get(int(chat_id))
+            if pending is None or not is_final(pending.action, method, params):
+                return
+            del self.pending[int(chat_id)]
+        pending.error = str(params.get('text', '')).startswith(ERROR_MARKS)
+        pending.finished = time.perf_counter()
+        pending.done.set()
+
+    def finish(self, chat_id: int, pending: PendingAction, timeout: float) -> bool:
+        """Ждет ответа на действие и записывает результат; False - ответа не было"""
+        if not pending.done.wait(timeout):
+            with self.lock:
+                self.pending.pop(chat_id, None)
+                self.timeouts[pending.action] = self.timeouts.get(pending.action, 0) + 1
+            return False
+        with self.lock:
+            if pending.error:
+                self.errors[pending.action] = self.errors.get(pending.action, 0) + 1
+            else:
+                self.latencies.setdefault(pending.action, []).append(pending.finished - pending.started)
+        return True
+
+    def fail(self, chat_id: int, pending: PendingAction):
+        with self.lock:
+            self.pending.pop(chat_id, None)
+            self.errors[pending.action] = self.errors.get(pending.action, 0) + 1
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Процентиль по ближайшему рангу для отсортированного списка"""
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, int(round(q / 100 * len(values) + 0.5)) - 1))
+    return values[rank]
+
+
+def parse_mix(items: List[str]) -> Dict[str, float]:
+    mix = {}
+    for item in items:
+        action, _, weight = item.partition('=')
+        mix[action] = float(weight or 1)
+    unknown = set(mix) - {'/status', '/digest', '/collect_messages', 'toggle_channel'}
+    if unknown:
+        raise SystemExit(f"Неизвестные действия: {', '.join(sorted(unknown))}")
+    return mix
+
+
+class SimulatedUser(threading.Thread):
+    """Пользователь в личном чате: действие, ожидание ответа, пауза на размышление"""
+
+    def __init__(self, user_id: int, server, stats: LoadStats, mix: Dict[str, float], args, deadline: float):
+        super().__init__(daemon=True)
+        self.user_id = user_id
+        self.server = server
+        self.stats = stats
+        self.mix = mix
+        self.args = args
+        self.deadline = deadline
+        self.rng = random.Random(user_id)
+
+    def make_update(self, action: str) -> dict:
+        if action == 'toggle_channel':
+            channel_id = self.rng.choice(CHANNEL_IDS)
+            return self.server.callback_update(self.user_id, encode_callback(TOGGLE, 0, channel_id))
+        return self.server.command_update(self.user_id, action)
+
+    def run(self):
+        actions = list(self.mix)
+        weights = [self.mix[action] for action in actions]
+        time.sleep(self.rng.uniform(0, self.args.ramp))
+        while time.perf_counter() < self.deadline:
+            action = self.rng.choices(actions, weights)[0]
+            update = self.make_update(action)
+            pending = self.stats.begin(self.user_id, action)
+            if self.server.webhook_url:
+                status = post_update(self.server.webhook_url, update, self.server.webhook_secret)
+                if status != 200:
+                    self.stats.fail(self.user_id, pending)
+                    time.sleep(self.args.think)
+                    continue
+            else:
+                self.server.push_update(update)
+            if not self.stats.finish(self.user_id, pending, self.args.timeout):
+                # Поздний ответ иначе засчитался бы следующему действию - пользователь уходит
+                return
+            time.sleep(self.rng.expovariate(1 / self.args.think) if self.args.think else 0)
+
+
+def start_bot(args, api_url: str, web_url: str, data_dir: str, log_file) -> subprocess.Popen:
+    env = dict(os.environ, TELEGRAM_API_BASE_URL=api_url, TELEGRAM_WEB_BASE_URL=web_url,
+               TELEGRAM_BOT_TOKEN='123:load', DATA_DIR=data_dir, METRICS_PORT='0',
+               WEBHOOK_URL='', DIGEST_CHANNEL_ID='', LLM_SUMMARIES_ENABLED='0')
+    if args.mode == 'webhook':
+        port = free_port()
+        env.update(WEBHOOK_URL=f'http://127.0.0.1:{port}', WEBHOOK_PORT=str(port), WEBHOOK_LISTEN='127.0.0.1')
+    for item in args.env:
+        key, _, value = item.partition('=')
+        env[key] = value
+    return subprocess.Popen([sys.executable, 'main.py'], cwd=ROOT, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+
+
+def wait_until_ready(server, process: subprocess.Popen, mode: str, timeout: float = 60) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline and process.poll() is None:
+        if mode == 'webhook' and wait_for_webhook(server, timeout=0.2):
+            return True
+        if mode == 'polling' and server.method_counts.get('getUpdates'):
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def warm_up(server, stats: LoadStats, timeout: float) -> Optional[float]:
+    """Первый сбор сообщений, чтобы у /digest были данные; возвращает длительность"""
+    user_id = FIRST_USER_ID - 1
+    pending = stats.begin(user_id, '/collect_messages')
+    update = server.command_update(user_id, '/collect_messages')
+    if server.webhook_url:
+        post_update(server.webhook_url, update, server.webhook_secret)
+    else:
+        server.push_update(update)
+    if not pending.done.wait(timeout):
+        return None
+    with stats.lock:
+        stats.pending.pop(user_id, None)
+    return pending.finished - pending.started
+
+
+def report(stats: LoadStats, elapsed: float, users: int, server) -> float:
+    """Печатает таблицу задержек и возвращает общую долю ошибок"""
+    print(f"\n{users} пользователей, {elapsed:.1f} с")
+    print(f"{'действие':<18}{'всего':>7}{'ошибок':>8}{'таймаут':>9}{'p50, мс':>10}{'p95, мс':>10}"
+          f"{'p99, мс':>10}{'max, мс':>10}")
+    total = failed = 0
+    for action in sorted(set(stats.latencies) | set(stats.errors) | set(stats.timeouts)):
+        latencies = sorted(stats.latencies.get(action, []))
+        errors = stats.errors.get(action, 0)
+        timeouts = stats.timeouts.get(action, 0)
+        count = len(latencies) + errors + timeouts
+        total += count
+        failed += errors + timeouts
+        print(f"{action:<18}{count:>7}{errors:>8}{timeouts:>9}"
+              f"{percentile(latencies, 50) * 1000:>10.0f}{percentile(latencies, 95) * 1000:>10.0f}"
+              f"{percentile(latencies, 99) * 1000:>10.0f}{(latencies[-1] if latencies else 0) * 1000:>10.0f}")
+    error_rate = failed / total if total else 1.0
+    print(f"Действий: {total} ({total / elapsed:.1f}/с), доля ошибок: {error_rate:.2%}")
+    calls = ', '.join(f"{method} {count}" for method, count in sorted(server.method_counts.items()))
+    print(f"Вызовы Bot API: {calls}")
+    return error_rate
+
+
+def run(args) -> int:
+    mix = parse_mix(args.mix)
+    server = start_fake_bot_api(latency=args.api_latency)
+    web = start_fake_telegram_web(min_latency=args.web_latency / 2, max_latency=args.web_latency,
+                                  messages=args.messages)
+    stats = LoadStats()
+    server.listeners.append(stats.on_bot_call)
+    api_url = f'http://127.0.0.1:{server.server_address[1]}'
+    web_url = f'http://127.0.0.1:{web.server_address[1]}'
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        log_path = args.log or os.path.join(data_dir, 'bot.log')
+        with open(log_path, 'w') as log_file:
+            process = start_bot(args, api_url, web_url, data_dir, log_file)
+            try:
+                if not wait_until_ready(server, process, args.mode):
+                    print(f"Бот не запустился, лог: {log_path}")
+                    return 1
+                print(f"Бот запущен ({args.mode}), Bot API {api_url}, каналы {web_url}")
+                if not args.no_warmup:
+                    warmup_time = warm_up(server, stats, args.timeout)
+                    if warmup_time is None:
+                        print("Первый сбор сообщений не завершился")
+                        return 1
+                    print(f"Первый сбор сообщений: {warmup_time:.1f} с")
+
+                started = time.perf_counter()
+                deadline = started + args.duration
+                users = [SimulatedUser(FIRST_USER_ID + i, server, stats, mix, args, deadline)
+                         for i in range(args.users)]
+                for user in users:
+                    user.start()
+                for user in users:
+                    user.join(timeout=max(0.0, deadline + args.timeout - time.perf_counter()))
+                    if process.poll() is not None:
+                        print(f"Бот завершился с кодом {process.returncode}, лог: {log_path}")
+                        return 1
+                error_rate = report(stats, time.perf_counter() - started, args.users, server)
+            finally:
+                process.terminate()
+                try:
+                    process.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                server.shutdown()
+                web.shutdown()
+
+    if error_rate > args.max_error_rate:
+        print(f"Доля ошибок больше допустимой ({args.max_error_rate:.2%})")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50, help='одновременных пользователей')
+    parser.add_argument('--duration', type=float, default=30, help='длительность теста, секунды')
+    parser.add_argument('--ramp', type=float, default=5, help='за сколько секунд подключаются все пользователи')
+    parser.add_argument('--think', type=float, default=2, help='средняя пауза пользователя между действиями, секунды')
+    parser.add_argument('--mix', nargs='+', default=list(DEFAULT_MIX),
+                        help='веса действий: /status, /digest, /collect_messages, toggle_channel')
+    parser.add_argument('--mode', choices=('polling', 'webhook'), default='polling')
+    parser.add_argument('--timeout', type=float, default=60, help='сколько ждать итогового ответа, секунды')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='задержка фейкового Bot API, секунды')
+    parser.add_argument('--web-latency', type=float, default=0.2, help='максимальная задержка страниц каналов')
+    parser.add_argument('--messages', type=int, default=20, help='сообщений на странице канала')
+    parser.add_argument('--env', nargs='*', default=[], help='дополнительные переменные бота KEY=VALUE')
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--no-warmup', action='store_true', help='не собирать сообщения перед тестом')
+    parser.add_argument('--log', help='куда писать лог бота (по умолчанию во временный каталог)')
+    sys.exit(run(parser.parse_args()))
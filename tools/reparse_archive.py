@@ -0,0 +1,72 @@
+"""Массовый повторный разбор архива страниц каналов текущим парсером
+
+    python tools/reparse_archive.py --hours 168 --processes 0 --out corpus.json
+    python tools/reparse_archive.py --archive /var/data/archive --latest --compare
+
+Страницы разбираются на всех ядрах (--processes 0) или в заданном числе процессов,
+сообщения каналов объединяются без повторов. Печатает размер архива и степень
+сжатия, время разбора и число сообщений по каналам. --out сохраняет результат в
+JSON {"titles": ..., "window": ...}, который tools/bench_analysis.py --corpus
+использует как реалистичный корпус вместо синтетических сообщений.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from page_archive import PageArchive, reparse_archive
+
+
+def run(args) -> int:
+    logging.basicConfig(level=logging.WARNING)
+    archive = PageArchive(args.archive, max_bytes=0)
+    stats = archive.stats()
+    if not stats['fetches']:
+        print(f"Архив {args.archive} пуст")
+        return 1
+    ratio = stats['raw_bytes'] / stats['stored_bytes'] if stats['stored_bytes'] else 0
+    print(f"Архив: {stats['fetches']} загрузок, {stats['pages']} уникальных страниц, "
+          f"{stats['raw_bytes'] / 1024 / 1024:.1f} МБ HTML -> {stats['stored_bytes'] / 1024 / 1024:.1f} МБ "
+          f"(x{ratio:.1f})")
+
+    since = time.time() - args.hours * 3600 if args.hours else None
+    entries = archive.select(since=since, latest_only=args.latest)
+    print(f"К разбору: {len(entries)} страниц, ядер: {os.cpu_count()}")
+
+    if args.compare:
+        started = time.perf_counter()
+        reparse_archive(archive, entries, processes=1)
+        serial_time = time.perf_counter() - started
+        print(f"1 процесс: {serial_time:.2f} с, {len(entries) / serial_time:,.0f} страниц/с")
+
+    started = time.perf_counter()
+    window = reparse_archive(archive, entries, processes=args.processes)
+    elapsed = time.perf_counter() - started
+    processes = args.processes or os.cpu_count()
+    print(f"{processes} процессов: {elapsed:.2f} с, {len(entries) / elapsed:,.0f} страниц/с")
+
+    for channel_id, messages in sorted(window.items(), key=lambda item: -len(item[1])):
+        print(f"  {channel_id}: {len(messages)} сообщений")
+    print(f"Всего сообщений: {sum(len(messages) for messages in window.values())}")
+
+    if args.out:
+        titles = {entry['channel']: entry['username'] for entry in entries}
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump({'titles': titles, 'window': window}, f, ensure_ascii=False)
+        print(f"Корпус сохранен в {args.out}")
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--archive', default=os.path.join(os.getenv('DATA_DIR', 'data'), 'archive'))
+    parser.add_argument('--hours', type=float, default=0, help='только загрузки за последние часы (0 - все)')
+    parser.add_argument('--latest', action='store_true', help='только последняя страница каждого канала')
+    parser.add_argument('--processes', type=int, default=0, help='процессов разбора (0 - по числу ядер)')
+    parser.add_argument('--compare', action='store_true', help='сначала разобрать в одном процессе для сравнения')
+    parser.add_argument('--out', help='сохранить сообщения каналов в JSON для бенчмарков')
+    sys.exit(run(parser.parse_args()))
@@ -0,0 +1,213 @@
+"""Структурные трассы запусков дайджеста: стадии с таймингами, счетчики и причины отбрасывания.
+
+Текущая трасса хранится в contextvars, поэтому ее видят все корутины и задачи,
+запущенные внутри запуска, без передачи через аргументы. Вне трассы функции
+модуля ничего не делают.
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Trace:
+    """Одна трасса: запуск дайджеста от сбора до отправки"""
+
+    def __init__(self, kind: str, **meta):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.started_at = time.time()
+        self.t0 = time.perf_counter()
+        self.meta = dict(meta)
+        self.stages: List[dict] = []
+        self.counts: Dict[str, int] = {}
+        self.drops: Dict[str, int] = {}
+        self.status = 'ok'
+        self.error: Optional[str] = None
+        self.duration: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def add_stage(self, name: str, started: float, duration: float, **fields) -> dict:
+        """Добавляет стадию; started - значение time.perf_counter() в момент начала"""
+        record = {'stage': name, 'start': round(started - self.t0, 4), 'duration': round(duration, 4)}
+        record.update(fields)
+        with self.lock:
+            self.stages.append(record)
+        return record
+
+    @contextmanager
+    def stage(self, name: str, **fields):
+        """Замеряет стадию; в отданный словарь можно дописать поля по ходу работы"""
+        started = time.perf_counter()
+        extra = dict(fields)
+        try:
+            yield extra
+        finally:
+            self.add_stage(name, started, time.perf_counter() - started, **extra)
+
+    def count(self, key: str, value: int = 1):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + value
+
+    def drop(self, reason: str, value: int = 1):
+        if value:
+            with self.lock:
+                self.drops[reason] = self.drops.get(reason, 0) + value
+
+    def set(self, **meta):
+        self.meta.update(meta)
+
+    def fail(self, error: Exception):
+        self.status = 'error'
+        self.error = str(error)
+
+    def to_dict(self) -> dict:
+        return {
+            'run_id': self.run_id,
+            'kind': self.kind,
+            'started_at': datetime.fromtimestamp(self.started_at).isoformat(timespec='seconds'),
+            'duration': round(self.duration, 4) if self.duration is not None else None,
+            'status': self.status,
+            'error': self.error,
+            'meta': self.meta,
+            'counts': self.counts,
+            'drops': self.drops,
+            'stages': sorted(self.stages, key=lambda record: record['start']),
+        }
+
+
+class TraceStore:
+    """Журнал трасс в JSONL; последние трассы дополнительно держатся в памяти"""
+
+    def __init__(self, path: Optional[str], keep: int = 200, max_bytes: int = 5 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.recent_traces = deque(maxlen=keep)
+        self.lock = threading.Lock()
+
+    def append(self, record: dict):
+        with self.lock:
+            self.recent_traces.append(record)
+            if not self.path:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                # Старый журнал откладываем в .1, чтобы файл не рос бесконечно
+                if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, self.path + '.1')
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            except OSError as e:
+                logger.error(f"Ошибка записи трассы в {self.path}: {e}")
+
+    def recent(self, limit: int = 10) -> List[dict]:
+        with self.lock:
+            return list(self.recent_traces)[-limit:][::-1]
+
+    def get(self, run_id: str) -> Optional[dict]:
+        """Ищет трассу по run_id (или его началу) в памяти, затем в журнале на диске"""
+        with self.lock:
+            for record in reversed(self.recent_traces):
+                if record['run_id'].startswith(run_id):
+                    return record
+            if not self.path:
+                return None
+            for path in (self.path, self.path + '.1'):
+                if not os.path.exists(path):
+                    continue
+                found = None
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        for line in f:
+                            if run_id in line:
+                                record = json.loads(line)
+                                if record.get('run_id', '').startswith(run_id):
+                                    found = record
+                except (OSError, ValueError) as e:
+                    logger.error(f"Ошибка чтения трасс из {path}: {e}")
+                if found:
+                    return found
+        return None
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar('current_trace', default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def start_trace(store: TraceStore, kind: str, **meta):
+    """Открывает трассу запуска; вложенный вызов продолжает уже открытую трассу"""
+    parent = _current_trace.get()
+    if parent is not None:
+        yield parent
+        return
+
+    trace = Trace(kind, **meta)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    except asyncio.CancelledError:
+        trace.status = 'cancelled'
+        raise
+    except Exception as e:
+        trace.fail(e)
+        raise
+    finally:
+        _current_trace.reset(token)
+        trace.duration = time.perf_counter() - trace.t0
+        store.append(trace.to_dict())
+        logger.info(f"Трасса {trace.run_id} ({kind}): {trace.duration:.2f} с, статус {trace.status}")
+
+
+@contextmanager
+def stage(name: str, **fields):
+    """Стадия текущей трассы; без трассы просто выполняет блок"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield dict(fields)
+        return
+    with trace.stage(name, **fields) as extra:
+        yield extra
+
+
+def add_stage(name: str, started: float, duration: float, **fields):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_stage(name, started, duration, **fields)
+
+
+def count(key: str, value: int = 1):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.count(key, value)
+
+
+def drop(reason: str, value: int = 1):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.drop(reason, value)
+
+
+def annotate(**meta):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.set(**meta)
+
+
+def fail(error: Exception):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.fail(error)
@@ -0,0 +1,95 @@
+"""Скользящие почасовые ряды по категориям, странам и ключевым словам"""
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class TrendStore:
+    """Набор кольцевых буферов почасовых счетчиков фиксированного размера.
+
+    Каждый ряд - array('I') длиной size, ячейка - час (epoch_hour % size).
+    Память не растет со временем, чтение окна в N часов стоит O(N) <= O(size)
+    независимо от того, сколько сообщений прошло через бота.
+    """
+
+    def __init__(self, size: int = 168):
+        self.size = size
+        self.head_hour: Optional[int] = None  # последний час, до которого сдвинуты буферы
+        self.series: Dict[Tuple[str, str], array] = {}
+
+    def _series(self, kind: str, name: str) -> array:
+        key = (kind, name)
+        counts = self.series.get(key)
+        if counts is None:
+            counts = array('I', bytes(4 * self.size))
+            self.series[key] = counts
+        return counts
+
+    def _advance(self, hour: int):
+        """Сдвигает окно до hour, обнуляя ячейки, которые занимают новые часы"""
+        if self.head_hour is None:
+            self.head_hour = hour
+            return
+        if hour <= self.head_hour:
+            return
+        steps = min(hour - self.head_hour, self.size)
+        for step in range(1, steps + 1):
+            slot = (self.head_hour + step) % self.size
+            for counts in self.series.values():
+                counts[slot] = 0
+        self.head_hour = hour
+
+    def record(self, hour: int, category: str, countries: Iterable[str] = (),
+               keywords: Iterable[str] = ()) -> bool:
+        """Учитывает одно сообщение в часе hour. Возвращает False, если час уже вне буфера"""
+        self._advance(hour)
+        if hour <= self.head_hour - self.size:
+            return False
+        slot = hour % self.size
+        self._series('category', category)[slot] += 1
+        for country in countries:
+            self._series('country', country)[slot] += 1
+        for keyword in keywords:
+            self._series('keyword', keyword)[slot] += 1
+        return True
+
+    def hourly(self, kind: str, name: str, hours: int, now_hour: int) -> List[int]:
+        """Почасовые значения ряда за последние hours часов (от старых к новым)"""
+        self._advance(now_hour)
+        hours = max(1, min(hours, self.size))
+        counts = self.series.get((kind, name))
+        if counts is None:
+            return [0] * hours
+        return [counts[(now_hour - offset) % self.size] for offset in range(hours - 1, -1, -1)]
+
+    def total(self, kind: str, name: str, hours: int, now_hour: int, offset: int = 0) -> int:
+        """Сумма ряда за hours часов, заканчивающихся offset часов назад"""
+        self._advance(now_hour)
+        counts = self.series.get((kind, name))
+        if counts is None or hours + offset > self.size:
+            return 0
+        end = now_hour - offset
+        return sum(counts[(end - i) % self.size] for i in range(hours))
+
+    def top(self, kind: str, hours: int, now_hour: int, limit: int = 5) -> List[Tuple[str, int]]:
+        """Самые частые значения ряда данного вида за последние hours часов"""
+        hours = max(1, min(hours, self.size))
+        totals = []
+        for (series_kind, name) in list(self.series):
+            if series_kind != kind:
+                continue
+            value = self.total(kind, name, hours, now_hour)
+            if value:
+                totals.append((name, value))
+        totals.sort(key=lambda item: item[1], reverse=True)
+        return totals[:limit]
+
+
+SPARK_CHARS = '▁▂▃▄▅▆▇█'
+
+
+def sparkline(values: List[int]) -> str:
+    """Рисует мини-график из блоков по почасовым значениям"""
+    peak = max(values) if values else 0
+    if not peak:
+        return SPARK_CHARS[0] * len(values)
+    return ''.join(SPARK_CHARS[min(len(SPARK_CHARS) - 1, value * (len(SPARK_CHARS) - 1) // peak)] for value in values)
@@ -0,0 +1,65 @@
+"""Параллельная обработка обновлений с сохранением порядка внутри каждого чата"""
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+def update_chat_key(update: object) -> Optional[int]:
+    """Чат, в рамках которого обновления должны обрабатываться по порядку"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id  # inline-запросы и прочее без чата
+    return None
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Обновления разных чатов обрабатываются одновременно, одного чата - строго по очереди.
+
+    Так /status одного пользователя не ждет чужой /digest, а ответы в одном чате
+    не перемешиваются. Замок чата удаляется, когда его очередь пустеет.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self.chat_locks: Dict[int, asyncio.Lock] = {}
+        self.waiting: Dict[int, int] = {}
+
+    async def process_update(self, update: object, coroutine) -> None:
+        # Сначала очередь чата, потом общий слот: обновления, ждущие своей очереди в чате,
+        # не занимают слоты max_concurrent_updates, и поток обновлений одного чата
+        # не останавливает остальные чаты
+        key = update_chat_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        lock = self.chat_locks.get(key)
+        if lock is None:
+            lock = self.chat_locks[key] = asyncio.Lock()
+        self.waiting[key] = self.waiting.get(key, 0) + 1
+        try:
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            self.waiting[key] -= 1
+            if not self.waiting[key]:
+                del self.waiting[key]
+                del self.chat_locks[key]
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self.chat_locks.clear()
+        self.waiting.clear()
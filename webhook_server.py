@@ -0,0 +1,176 @@
+"""Встроенный asyncio HTTP-сервер для приема обновлений Telegram через вебхук"""
+import hmac
+import json
+import asyncio
+import logging
+from typing import Callable, Optional
+
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 1024 * 1024
+READ_TIMEOUT = 30
+REASONS = {
+    200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+    408: 'Request Timeout', 413: 'Payload Too Large', 503: 'Service Unavailable',
+}
+
+
+class WebhookServer:
+    """Принимает POST с обновлениями и кладет их в update_queue приложения.
+
+    Обновление подтверждается сразу после постановки в очередь - Telegram не ждет
+    обработки команды. Секретный токен сверяется с заголовком
+    X-Telegram-Bot-Api-Secret-Token, GET на health_path отдает состояние бота.
+    """
+
+    def __init__(self, application: Application, host: str, port: int, path: str,
+                 secret_token: Optional[str], health_path: str = '/healthz',
+                 health_info: Optional[Callable[[], dict]] = None):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.path = '/' + path.strip('/')
+        self.secret_token = secret_token
+        self.health_path = health_path
+        self.health_info = health_info
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.draining = False
+        self.in_flight = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.connections = set()
+        self.stats = {'updates': 0, 'rejected': 0}
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"Вебхук слушает http://{self.host}:{self.port}{self.path}")
+
+    async def stop(self, timeout: float = 10.0):
+        """Перестает принимать соединения и дожидается запросов, которые уже в работе"""
+        self.draining = True
+        if self.server is not None:
+            self.server.close()
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Вебхук: {self.in_flight} запросов не завершились за {timeout} с")
+        # Простаивающие keep-alive соединения закрываем сами, иначе wait_closed их ждет
+        for writer in list(self.connections):
+            writer.close()
+        if self.server is not None:
+            await self.server.wait_closed()
+        logger.info(f"Вебхук остановлен, принято обновлений: {self.stats['updates']}")
+
+    # --- HTTP ---
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections.add(writer)
+        try:
+            while not self.draining:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), timeout=READ_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+                self._begin()
+                try:
+                    keep_alive = await self._handle_request(request_line, reader, writer)
+                finally:
+                    self._end()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logger.error(f"Ошибка обработки запроса вебхука: {e}")
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    def _begin(self):
+        self.in_flight += 1
+        self.idle.clear()
+
+    def _end(self):
+        self.in_flight -= 1
+        if not self.in_flight:
+            self.idle.set()
+
+    async def _handle_request(self, request_line: bytes, reader: asyncio.StreamReader,
+                              writer: asyncio.StreamWriter) -> bool:
+        try:
+            method, target, version = request_line.decode('latin-1').split()
+        except ValueError:
+            await self._respond(writer, 400, {'ok': False}, keep_alive=False)
+            return False
+
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=READ_TIMEOUT)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+        length = int(headers.get('content-length') or 0)
+        if length > MAX_BODY_SIZE:
+            await self._respond(writer, 413, {'ok': False}, keep_alive=False)
+            return False
+        body = await asyncio.wait_for(reader.readexactly(length), timeout=READ_TIMEOUT) if length else b''
+
+        path = target.split('?', 1)[0]
+        if path == self.health_path and method in ('GET', 'HEAD'):
+            status = 503 if self.draining or not self.application.running else 200
+            payload = {'status': 'ok' if status == 200 else 'draining', **self._health()}
+            await self._respond(writer, status, payload, keep_alive)
+        elif path != self.path:
+            await self._respond(writer, 404, {'ok': False}, keep_alive)
+        elif method != 'POST':
+            await self._respond(writer, 405, {'ok': False}, keep_alive)
+        elif self.secret_token and not hmac.compare_digest(
+                headers.get('x-telegram-bot-api-secret-token', ''), self.secret_token):
+            self.stats['rejected'] += 1
+            logger.warning("Вебхук: запрос с неверным секретным токеном отклонен")
+            await self._respond(writer, 403, {'ok': False}, keep_alive)
+        elif self.draining:
+            # Telegram повторит доставку позже - обновление не потеряется
+            await self._respond(writer, 503, {'ok': False}, keep_alive=False)
+            return False
+        else:
+            try:
+                update = Update.de_json(json.loads(body), self.application.bot)
+            except (ValueError, TypeError, KeyError) as e:
+                logger.error(f"Вебхук: не удалось разобрать обновление: {e}")
+                await self._respond(writer, 400, {'ok': False}, keep_alive)
+                return keep_alive
+            await self.application.update_queue.put(update)
+            self.stats['updates'] += 1
+            await self._respond(writer, 200, {'ok': True}, keep_alive)
+        return keep_alive
+
+    def _health(self) -> dict:
+        info = {
+            'updates': self.stats['updates'],
+            'rejected': self.stats['rejected'],
+            'update_queue': self.application.update_queue.qsize(),
+        }
+        if self.health_info:
+            info.update(self.health_info())
+        return info
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, payload: dict, keep_alive: bool):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, 'OK')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
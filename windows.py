@@ -0,0 +1,112 @@
+"""Материализованные скользящие окна сообщений (1, 3, 6, 24 часа и другие из настроек).
+
+Вместо перебора всего хранилища на каждый запрос окна хранят готовые списки сообщений
+по каналам. Когда у канала меняются сообщения, пересчитываются только его списки; когда
+самое старое сообщение канала выходит за границу окна (срок лежит в куче), список
+канала в этом окне пересобирается. Списки не меняются на месте, а заменяются новыми:
+поток анализа, взявший окно, работает с согласованным снимком без копирования.
+"""
+import math
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def parse_timestamp(msg: dict, default_tz) -> float:
+    """Время сообщения в секундах Unix; наивное время - в default_tz.
+    Сообщение без разборчивого времени не устаревает (math.inf), как и при переборе хранилища."""
+    try:
+        msg_time = datetime.fromisoformat(msg['timestamp'])
+    except (KeyError, ValueError, TypeError) as e:
+        logger.warning(f"Ошибка парсинга времени для сообщения: {e}")
+        return math.inf
+    if msg_time.tzinfo is None:
+        msg_time = msg_time.replace(tzinfo=default_tz)
+    return msg_time.timestamp()
+
+
+class RollingWindows:
+    """Окна hours -> канал -> сообщения за последние hours часов в порядке хранилища"""
+
+    def __init__(self, hours: Iterable[int], default_tz):
+        self.hours = sorted(set(hours))
+        self.default_tz = default_tz
+        self.lock = threading.Lock()
+        # Каналы в каждом окне идут в порядке появления в хранилище, включая пустые
+        self.views: Dict[int, Dict[str, List[dict]]] = {h: {} for h in self.hours}
+        self.stamps: Dict[int, Dict[str, List[float]]] = {h: {} for h in self.hours}
+        self._deadlines = []  # куча (когда устареет самое старое сообщение, окно, канал, версия)
+        self._versions: Dict[str, int] = {}
+
+    def covers(self, hours) -> bool:
+        return hours in self.views
+
+    def _schedule(self, hours: int, channel_id: str):
+        stamps = self.stamps[hours][channel_id]
+        oldest = min(stamps, default=math.inf)
+        if oldest != math.inf:
+            heapq.heappush(self._deadlines, (oldest + hours * 3600, hours, channel_id, self._versions[channel_id]))
+        # Сроки пересчитанных каналов остаются в куче до наступления - чистим, когда их много
+        if len(self._deadlines) > 4 * len(self._versions) * len(self.hours) + 64:
+            self._deadlines = [item for item in self._deadlines if item[3] == self._versions[item[2]]]
+            heapq.heapify(self._deadlines)
+
+    def set_channel(self, channel_id: str, messages: List[dict], now: Optional[float] = None):
+        """Пересчитывает окна канала после замены всех его сообщений"""
+        now = now if now is not None else time.time()
+        stamps = [parse_timestamp(msg, self.default_tz) for msg in messages]
+        with self.lock:
+            self._versions[channel_id] = self._versions.get(channel_id, 0) + 1
+            for hours in self.hours:
+                cutoff = now - hours * 3600
+                kept = [i for i, ts in enumerate(stamps) if ts > cutoff]
+                self.views[hours][channel_id] = [messages[i] for i in kept]
+                self.stamps[hours][channel_id] = [stamps[i] for i in kept]
+                self._schedule(hours, channel_id)
+
+    def append(self, channel_id: str, msg: dict, now: Optional[float] = None):
+        """Добавляет одно сообщение канала в окна, куда оно попадает по времени"""
+        now = now if now is not None else time.time()
+        ts = parse_timestamp(msg, self.default_tz)
+        with self.lock:
+            self._versions[channel_id] = self._versions.get(channel_id, 0) + 1
+            for hours in self.hours:
+                view = self.views[hours].get(channel_id, [])
+                stamps = self.stamps[hours].get(channel_id, [])
+                if ts > now - hours * 3600:
+                    view, stamps = view + [msg], stamps + [ts]
+                self.views[hours][channel_id] = view
+                self.stamps[hours][channel_id] = stamps
+                self._schedule(hours, channel_id)
+
+    def _expire(self, now: float):
+        """Убирает из окон сообщения, вышедшие за границу, - только у каналов с истекшим сроком"""
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, hours, channel_id, version = heapq.heappop(self._deadlines)
+            if version != self._versions.get(channel_id):
+                continue  # канал пересчитан позже, у него свой срок в куче
+            cutoff = now - hours * 3600
+            view, stamps = self.views[hours][channel_id], self.stamps[hours][channel_id]
+            kept = [i for i, ts in enumerate(stamps) if ts > cutoff]
+            self.views[hours][channel_id] = [view[i] for i in kept]
+            self.stamps[hours][channel_id] = [stamps[i] for i in kept]
+            self._schedule(hours, channel_id)
+
+    def select(self, hours: int, channel_ids, now: Optional[float] = None) -> Dict[str, List[dict]]:
+        """Непустые списки окна по выбранным каналам; сами списки не копируются"""
+        with self.lock:
+            self._expire(now if now is not None else time.time())
+            return {channel_id: messages for channel_id, messages in self.views[hours].items()
+                    if messages and channel_id in channel_ids}
+
+    def counts(self, hours: int, channel_ids, now: Optional[float] = None) -> Dict[str, int]:
+        """Число сообщений окна по каналам (только непустые)"""
+        with self.lock:
+            self._expire(now if now is not None else time.time())
+            return {channel_id: len(messages) for channel_id, messages in self.views[hours].items()
+                    if messages and channel_id in channel_ids}
@@ -0,0 +1,69 @@
+"""Пул потоков для тяжелой работы дайджеста (регулярки, подсчет признаков, рендер) вне event loop"""
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from metrics import registry as metrics_registry
+
+logger = logging.getLogger(__name__)
+
+WORKER_WAIT_SECONDS = metrics_registry.histogram(
+    'digest_bot_worker_wait_seconds', 'Ожидание свободного воркера пула', ['task'])
+WORKER_RUN_SECONDS = metrics_registry.histogram(
+    'digest_bot_worker_run_seconds', 'Время выполнения задачи в пуле', ['task'])
+WORKER_CANCELLED = metrics_registry.counter(
+    'digest_bot_worker_cancelled_total', 'Задачи пула, отмененные до завершения', ['task'])
+
+
+class WorkCancelled(Exception):
+    """Задачу в пуле отменили: запрос, ради которого она считалась, больше не нужен"""
+
+
+def check_cancelled(cancel_event: threading.Event = None):
+    """Проверка для длинных циклов в воркере: прерывает работу, если запрос отменен"""
+    if cancel_event is not None and cancel_event.is_set():
+        raise WorkCancelled()
+
+
+class WorkerPool:
+    """Выполняет функции в отдельных потоках, пока event loop отвечает другим пользователям.
+
+    Задача получает копию contextvars (в том числе текущую трассу). Если ожидающую
+    корутину отменили, задача, которая еще не начата, не запустится вовсе, а начатая
+    увидит выставленный cancel_event и остановится на ближайшей проверке.
+    """
+
+    def __init__(self, workers: int, name: str = 'digest'):
+        self.workers = max(1, workers)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=name)
+
+    async def run(self, func: Callable, *args, cancellable: bool = False, **kwargs):
+        """Выполняет func(*args, **kwargs) в пуле; cancellable=True передает функции cancel_event"""
+        task_name = getattr(func, '__name__', 'task')
+        cancel_event = threading.Event()
+        if cancellable:
+            kwargs['cancel_event'] = cancel_event
+        context = contextvars.copy_context()
+        queued = time.perf_counter()
+
+        def call():
+            if cancel_event.is_set():
+                raise WorkCancelled()
+            started = time.perf_counter()
+            WORKER_WAIT_SECONDS.observe(started - queued, task=task_name)
+            try:
+                return context.run(func, *args, **kwargs)
+            finally:
+                WORKER_RUN_SECONDS.observe(time.perf_counter() - started, task=task_name)
+
+        future = asyncio.get_running_loop().run_in_executor(self.executor, call)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            cancel_event.set()
+            WORKER_CANCELLED.inc(task=task_name)
+            raise